@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+reproducible twobitreader benchmark suite
+
+Writes a synthetic genome (see synthetic.py; the same options always give
+the same file), times the common operations on it and writes the results
+as JSON. Every benchmark is run --repeat times; the best and median times
+are recorded, with the number of operations each run performs.
+
+Usage:
+python benchmarks/suite.py [--output results.json] [--only short_slice,str]
+    [--twobit genome.2bit] [--repeat 5] [genome options, see synthetic.py]
+python benchmarks/suite.py --compare before.json after.json [--threshold 0.1]
+
+--compare prints the change in best time per operation for each benchmark
+in both files and exits with status 1 if any is more than --threshold
+(a fraction) slower.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import twobitreader
+from synthetic import add_genome_arguments, genome_options, write_synthetic_twobit
+
+# bases per short and long slice
+SHORT_SLICE_SIZE = 10
+LONG_SLICE_SIZE = 1000000
+# bases per BED region
+BED_REGION_SIZE = 200
+
+
+def random_regions(sizes, count, size, seed):
+    """
+    count deterministic (chrom, start, end) regions of size bases, or of
+    the longest sequence's size if that is shorter
+    """
+    rng = random.Random(seed)
+    size = min(size, max(sizes.values()))
+    names = sorted(name for name in sizes if sizes[name] >= size)
+    regions = []
+    for _ in range(count):
+        name = rng.choice(names)
+        start = rng.randrange(sizes[name] - size + 1)
+        regions.append((name, start, start + size))
+    return regions
+
+
+def bench_import(path, scale):
+    """cold import of twobitreader in a new interpreter (less interpreter startup)"""
+    root = os.path.join(os.path.dirname(__file__), "..")
+    command = [sys.executable, "-c"]
+
+    def run(code):
+        started = time.perf_counter()
+        subprocess.check_call(command + [code], cwd=root)
+        return time.perf_counter() - started
+
+    def timed():
+        return max(0.0, run("import twobitreader") - run("pass"))
+
+    return 1, timed
+
+
+def bench_open(path, scale):
+    """open a .2bit file (reading every sequence header) and close it"""
+
+    def run():
+        twobitreader.TwoBitFile(path).close()
+
+    return 1, run
+
+
+def bench_open_lazy(path, scale):
+    """open a .2bit file reading only the name index"""
+
+    def run():
+        twobitreader.TwoBitFile(path, lazy=True).close()
+
+    return 1, run
+
+
+def bench_sequence_sizes(path, scale):
+    """sequence_sizes() on a freshly opened lazy file"""
+
+    def run():
+        with twobitreader.TwoBitFile(path, lazy=True) as genome:
+            started = time.perf_counter()
+            genome.sequence_sizes()
+            return time.perf_counter() - started
+
+    return 1, run
+
+
+def _slices(path, count, size):
+    genome = twobitreader.TwoBitFile(path)
+    regions = random_regions(genome.sequence_sizes(), count, size, seed=1)
+
+    def run():
+        for name, start, end in regions:
+            genome[name][start:end]
+
+    return count, run
+
+
+def bench_short_slice(path, scale):
+    """random SHORT_SLICE_SIZE-base get_slice calls"""
+    return _slices(path, int(20000 * scale) or 1, SHORT_SLICE_SIZE)
+
+
+def bench_long_slice(path, scale):
+    """random LONG_SLICE_SIZE-base get_slice calls"""
+    return _slices(path, int(10 * scale) or 1, LONG_SLICE_SIZE)
+
+
+def bench_str(path, scale):
+    """str() of the whole of the longest sequence"""
+    genome = twobitreader.TwoBitFile(path)
+    name = max(genome.keys(), key=genome.sequence_sizes().get)
+
+    def run():
+        str(genome[name])
+
+    return 1, run
+
+
+def bench_bed_to_fasta(path, scale):
+    """twobit_reader over BED_REGION_SIZE-base regions, FASTA to a buffer"""
+    genome = twobitreader.TwoBitFile(path)
+    count = int(20000 * scale) or 1
+    regions = random_regions(genome.sequence_sizes(), count, BED_REGION_SIZE, seed=2)
+    bed = "".join("%s\t%d\t%d\n" % region for region in regions)
+
+    def run():
+        output = io.StringIO()
+        twobitreader.twobit_reader(genome, io.StringIO(bed), output.write)
+
+    return count, run
+
+
+def bench_bed_to_fasta_output(path, scale):
+    """twobit_reader over BED_REGION_SIZE-base regions, buffered FASTA to a binary buffer"""
+    genome = twobitreader.TwoBitFile(path)
+    count = int(20000 * scale) or 1
+    regions = random_regions(genome.sequence_sizes(), count, BED_REGION_SIZE, seed=2)
+    bed = "".join("%s\t%d\t%d\n" % region for region in regions)
+
+    def run():
+        twobitreader.twobit_reader(genome, io.StringIO(bed), output=io.BytesIO())
+
+    return count, run
+
+
+def bench_longs_to_char_array(path, scale):
+    """longs_to_char_array decoding of 64 kb of random packed sequence"""
+    rng = random.Random(3)
+    longs = array(twobitreader.LONG, [rng.getrandbits(32) for _ in range(4096)])
+
+    def run():
+        twobitreader.longs_to_char_array(longs, 0, 16, 65536)
+
+    return 1, run
+
+
+BENCHMARKS = {
+    "import": bench_import,
+    "open": bench_open,
+    "open_lazy": bench_open_lazy,
+    "sequence_sizes": bench_sequence_sizes,
+    "short_slice": bench_short_slice,
+    "long_slice": bench_long_slice,
+    "str": bench_str,
+    "bed_to_fasta": bench_bed_to_fasta,
+    "bed_to_fasta_output": bench_bed_to_fasta_output,
+    "longs_to_char_array": bench_longs_to_char_array,
+}
+
+
+def run_benchmark(name, path, repeat, scale):
+    """time one benchmark; a run that returns a number reports its own time"""
+    operations, run = BENCHMARKS[name](path, scale)
+    run()  # warm up
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        elapsed = run()
+        if elapsed is None:
+            elapsed = time.perf_counter() - started
+        times.append(elapsed)
+    return {
+        "operations": operations,
+        "best": min(times),
+        "median": statistics.median(times),
+        "best_per_operation": min(times) / operations,
+        "description": BENCHMARKS[name].__doc__.strip(),
+    }
+
+
+def git_revision():
+    """the checked-out commit (with + if there are local changes), if known"""
+    root = os.path.join(os.path.dirname(__file__), "..")
+    try:
+        revision = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=root, stderr=subprocess.DEVNULL)
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], cwd=root, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision.decode("ascii").strip() + ("+" if dirty else "")
+
+
+def run_suite(args):
+    names = list(BENCHMARKS) if args.only is None else args.only.split(",")
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit("unknown benchmark %r (choose from %s)" % (name, ", ".join(BENCHMARKS)))
+    path = args.twobit
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix=".2bit")
+        os.close(fd)
+        write_synthetic_twobit(path, **genome_options(args))
+    try:
+        results = {}
+        for name in names:
+            results[name] = run_benchmark(name, path, args.repeat, args.scale)
+            print(
+                "%-20s %12.6f ms/op  (median run %.3f ms)"
+                % (name, 1e3 * results[name]["best_per_operation"], 1e3 * results[name]["median"])
+            )
+    finally:
+        if args.twobit is None:
+            os.remove(path)
+    report = {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "revision": git_revision(),
+        "numpy": twobitreader._load_numpy() is not None,
+        "genome": args.twobit if args.twobit is not None else genome_options(args),
+        "repeat": args.repeat,
+        "scale": args.scale,
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+    return report
+
+
+def compare(before_path, after_path, threshold):
+    """print the change per benchmark; return True if nothing regressed past threshold"""
+    with open(before_path) as handle:
+        before = json.load(handle)["results"]
+    with open(after_path) as handle:
+        after = json.load(handle)["results"]
+    ok = True
+    print("%-20s %14s %14s %9s" % ("benchmark", "before ms/op", "after ms/op", "change"))
+    for name in before:
+        if name not in after:
+            continue
+        old = before[name]["best_per_operation"]
+        new = after[name]["best_per_operation"]
+        change = new / old - 1 if old else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  SLOWER"
+            ok = False
+        print("%-20s %14.6f %14.6f %+8.1f%%%s" % (name, 1e3 * old, 1e3 * new, 100 * change, flag))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--only", help="comma-separated benchmarks to run (default: all)")
+    parser.add_argument("--twobit", help="benchmark this .2bit file instead of a synthetic genome")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the operations per run")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two JSON results")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown that fails --compare")
+    add_genome_arguments(parser)
+    # 5 Mb sequences with dense N-blocks (10,000 per Mb) and about 30% masked
+    parser.set_defaults(count=2, sizes="5000000", n_blocks=10000, n_block_size=10, mask_blocks=1000)
+    args = parser.parse_args()
+    if args.compare is not None:
+        sys.exit(0 if compare(args.compare[0], args.compare[1], args.threshold) else 1)
+    run_suite(args)
+
+
+if __name__ == "__main__":
+    main()
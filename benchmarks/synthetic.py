@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+deterministic synthetic .2bit genomes for benchmarks and tests
+
+The same arguments (and seed) always give a byte-identical file. Packed
+bases are random; N-blocks and soft-masked blocks are placed one per slot
+of sequence_size / count bases, so they never overlap each other, and
+their sizes vary around the given mean. Records are written directly
+(rather than through twobitreader.write) so that generating a large
+genome takes about as long as writing it.
+
+Usage:
+python benchmarks/synthetic.py out.2bit [--count 10] [--sizes 1000000]
+    [--n-blocks 0] [--n-block-size 100] [--mask-blocks 0] [--mask-block-size 300]
+    [--seed 0]
+
+--n-blocks and --mask-blocks are blocks per megabase; --sizes is a
+comma-separated list of sequence sizes, repeated to give --count sequences.
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from twobitreader import LONG
+
+
+def synthetic_blocks(rng, sequence_size, blocks_per_mb, mean_size):
+    """(starts, sizes) of about blocks_per_mb non-overlapping blocks per megabase"""
+    count = int(round(sequence_size * blocks_per_mb / 1e6))
+    starts = array(LONG)
+    sizes = array(LONG)
+    if count < 1:
+        return starts, sizes
+    slot = sequence_size // count
+    for i in range(count):
+        size = min(rng.randint(1, 2 * mean_size - 1), slot)
+        if size < 1:
+            continue
+        starts.append(i * slot + rng.randrange(slot - size + 1))
+        sizes.append(size)
+    return starts, sizes
+
+
+def write_synthetic_twobit(
+    path,
+    sequence_count=10,
+    sequence_sizes=1000000,
+    n_blocks_per_mb=0,
+    n_block_size=100,
+    mask_blocks_per_mb=0,
+    mask_block_size=300,
+    seed=0,
+):
+    """
+    write sequence_count random sequences named chr1, chr2, ...
+
+    sequence_sizes is one size or a list of sizes (repeated as needed);
+    N-blocks and mask blocks are given per megabase, with mean sizes
+    n_block_size and mask_block_size. Returns the sequence sizes.
+    """
+    rng = random.Random(seed)
+    if isinstance(sequence_sizes, int):
+        sequence_sizes = [sequence_sizes]
+    sizes = [sequence_sizes[i % len(sequence_sizes)] for i in range(sequence_count)]
+    names = ["chr%d" % (i + 1) for i in range(sequence_count)]
+    records = []
+    for size in sizes:
+        n_starts, n_sizes = synthetic_blocks(rng, size, n_blocks_per_mb, n_block_size)
+        mask_starts, mask_sizes = synthetic_blocks(rng, size, mask_blocks_per_mb, mask_block_size)
+        tables = array(LONG, [size, len(n_starts)]) + n_starts + n_sizes
+        tables += array(LONG, [len(mask_starts)]) + mask_starts + mask_sizes + array(LONG, [0])
+        packed_size = (size + 3) // 4
+        records.append((tables.tobytes(), packed_size, rng.getrandbits(8 * packed_size).to_bytes(packed_size, "little")))
+    offset = 16 + sum(1 + len(name) + 4 for name in names)
+    with open(path, "wb") as handle:
+        handle.write(array(LONG, [0x1A412743, 0, sequence_count, 0]).tobytes())
+        for name, (tables, packed_size, _) in zip(names, records):
+            handle.write(struct.pack("B", len(name)) + name.encode("ascii") + array(LONG, [offset]).tobytes())
+            offset += len(tables) + packed_size
+        for tables, _, packed in records:
+            handle.write(tables)
+            handle.write(packed)
+    return dict(zip(names, sizes))
+
+
+def write_random_twobit(path, sequence_count=10, sequence_size=1000000, seed=0):
+    """write sequence_count random sequences (no N-blocks or masking)"""
+    return write_synthetic_twobit(path, sequence_count, sequence_size, seed=seed)
+
+
+def add_genome_arguments(parser):
+    """the generator options, shared with the benchmark suite"""
+    parser.add_argument("--count", type=int, default=10, help="number of sequences")
+    parser.add_argument("--sizes", default="1000000", help="comma-separated sequence sizes")
+    parser.add_argument("--n-blocks", type=float, default=0, help="N-blocks per megabase")
+    parser.add_argument("--n-block-size", type=int, default=100, help="mean N-block size")
+    parser.add_argument("--mask-blocks", type=float, default=0, help="mask blocks per megabase")
+    parser.add_argument("--mask-block-size", type=int, default=300, help="mean mask block size")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+
+def genome_options(args):
+    """keyword arguments for write_synthetic_twobit from parsed arguments"""
+    return {
+        "sequence_count": args.count,
+        "sequence_sizes": [int(size) for size in args.sizes.split(",")],
+        "n_blocks_per_mb": args.n_blocks,
+        "n_block_size": args.n_block_size,
+        "mask_blocks_per_mb": args.mask_blocks,
+        "mask_block_size": args.mask_block_size,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", help=".2bit file to write")
+    add_genome_arguments(parser)
+    args = parser.parse_args()
+    write_synthetic_twobit(args.output, **genome_options(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+multithreaded slicing benchmark
+
+Opens one TwoBitFile and slices it from 1, 2, 4, ... threads at once,
+reporting slices per second and the speedup over a single thread.
+Scaling beyond one core is only expected on free-threaded CPython builds
+(python3.13t and later); with the GIL enabled the numbers show that
+sharing one file between threads is safe, not that it is faster.
+
+Usage:
+python benchmarks/threads.py [genome.2bit] [--threads 1,2,4,8] [--slices N]
+
+Without a .2bit file a random 10 Mb genome is written to a temporary file.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import twobitreader
+from synthetic import write_random_twobit
+
+
+def slice_worker(genome, regions):
+    for name, start, end in regions:
+        genome[name][start:end]
+    return len(regions)
+
+
+def run(genome, thread_count, slices, slice_size, seed=0):
+    """return slices per second for thread_count threads"""
+    rng = random.Random(seed)
+    sizes = genome.sequence_sizes()
+    names = sorted(sizes)
+    regions = []
+    for _ in range(slices):
+        name = rng.choice(names)
+        start = rng.randrange(0, sizes[name] - slice_size)
+        regions.append((name, start, start + slice_size))
+    chunks = [regions[i::thread_count] for i in range(thread_count)]
+    with ThreadPoolExecutor(max_workers=thread_count) as executor:
+        started = time.perf_counter()
+        done = sum(executor.map(slice_worker, [genome] * thread_count, chunks))
+        elapsed = time.perf_counter() - started
+    return done / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("twobit", nargs="?", help=".2bit file (default: random 10 Mb genome)")
+    parser.add_argument("--threads", default="1,2,4,8", help="comma-separated thread counts")
+    parser.add_argument("--slices", type=int, default=20000, help="slices per run")
+    parser.add_argument("--size", type=int, default=1000, help="bases per slice")
+    parser.add_argument("--mmap", action="store_true", help="use the mmap backend")
+    args = parser.parse_args()
+
+    path = args.twobit
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix=".2bit")
+        os.close(fd)
+        write_random_twobit(path)
+    try:
+        is_gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)
+        print("python %s, GIL %s" % (sys.version.split()[0], "enabled" if is_gil_enabled() else "disabled"))
+        with twobitreader.TwoBitFile(path, mmap=args.mmap) as genome:
+            baseline = None
+            for thread_count in [int(x) for x in args.threads.split(",")]:
+                rate = run(genome, thread_count, args.slices, args.size)
+                if baseline is None:
+                    baseline = rate
+                print("%3d threads: %10.0f slices/s  (%.2fx)" % (thread_count, rate, rate / baseline))
+    finally:
+        if args.twobit is None:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
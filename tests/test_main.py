@@ -57,29 +57,38 @@ def twobit_record(seq, n_blocks=(), mask_blocks=()):
     )
 
 
-def write_twobit_file(path, sequences):
+def write_twobit_file(path, sequences, version=0, records_offset=None):
+    """
+    write a .2bit file; version 1 uses 64-bit index offsets, and
+    records_offset places the records at that (sparse) position
+    """
+    offset_format = "<Q" if version == 1 else "<I"
     names = list(sequences)
-    index_size = sum(1 + len(name.encode("ascii")) + 4 for name in names)
+    index_size = sum(1 + len(name.encode("ascii")) + struct.calcsize(offset_format) for name in names)
     offset = 16 + index_size
+    if records_offset is not None:
+        offset = records_offset
     index = []
     records = []
     for name in names:
         encoded_name = name.encode("ascii")
         data = sequences[name]
         body = twobit_record(data["seq"], data.get("n_blocks", ()), data.get("mask_blocks", ()))
-        index.append(struct.pack("B", len(encoded_name)) + encoded_name + struct.pack("<I", offset))
+        index.append(struct.pack("B", len(encoded_name)) + encoded_name + struct.pack(offset_format, offset))
         records.append(body)
         offset += len(body)
     with open(path, "wb") as handle:
-        handle.write(
-            b"".join(
-                [
-                    struct.pack("<IIII", 0x1A412743, 0, len(names), 0),
-                    b"".join(index),
-                    b"".join(records),
-                ]
-            )
-        )
+        handle.write(struct.pack("<IIII", 0x1A412743, version, len(names), 0))
+        handle.write(b"".join(index))
+        if records_offset is not None:
+            handle.seek(records_offset)
+        handle.write(b"".join(records))
+
+
+def mock_batch_size(size):
+    from unittest import mock
+
+    return mock.patch.object(twobitreader, "TWOBIT_READER_BATCH_SIZE", size)
 
 
 class HasLongTypeTestCase(unittest.TestCase):
@@ -170,6 +179,34 @@ class SimpleLongsToCharTest(unittest.TestCase):
             self.assertEqual(last_base, self.as_string[-1 + (offset - 16)])
 
 
+class PackedToBytesTest(unittest.TestCase):
+    def setUp(self):
+        from array import array
+
+        self.packed = array(twobitreader.LONG, [683102738, 3396552641, 3797081033, 1243780212]).tobytes()
+        self.as_string = "TCTACCTAAGCGTAATGTTCCTCGCGTGGTAAGTACGCAGCCTAGATACGCTACCTTATACTAA"
+
+    def test_decode_tables(self):
+        for position, table in enumerate(twobitreader.DECODE_TABLES):
+            for byte in range(256):
+                self.assertEqual(chr(table[byte]), twobitreader.BYTE_TABLE[byte][position])
+
+    def test_packed_to_bytes(self):
+        dna = twobitreader.packed_to_bytes(self.packed, 0, 64)
+        self.assertTrue(isinstance(dna, bytearray))
+        self.assertEqual(dna.decode("ascii"), self.as_string)
+
+    def test_offsets_and_sizes(self):
+        for offset in range(8):
+            for size in range(0, 64 - offset, 7):
+                dna = twobitreader.packed_to_bytes(memoryview(self.packed), offset, size)
+                self.assertEqual(dna.decode("ascii"), self.as_string[offset : offset + size])
+
+    def test_size_too_large(self):
+        self.assertRaises(ValueError, twobitreader.packed_to_bytes, self.packed, 1, 64)
+        self.assertRaises(ValueError, twobitreader.packed_to_bytes, self.packed, 0, -1)
+
+
 class BadTwoBitFileTest(unittest.TestCase):
     def setUp(self):
         import tempfile
@@ -236,6 +273,791 @@ class GeneratedTwoBitFileTest(unittest.TestCase):
             self.assertEqual(reader["chr1"][0:12], "ACGTNNNTACgt")
             self.assertEqual(reader["chr1"][18:29], "GTNNNNncgtA")
 
+    def test_stats(self):
+        write_twobit_file(
+            self.filename,
+            {
+                "chr1": {
+                    "seq": "ACGTACGTACGTACGTACGTACGTACGTACGT",
+                    "n_blocks": [(4, 3), (20, 5)],
+                    "mask_blocks": [(10, 4), (24, 4)],
+                },
+            },
+        )
+        with twobitreader.TwoBitFile(self.filename) as reader:
+            reader["chr1"][0:12]
+            self.assertEqual(reader.stats(), twobitreader.StatsInfo(*[0] * len(twobitreader.STATS_FIELDS)))
+        events = []
+        with twobitreader.TwoBitFile(self.filename, stats_hook=events.append) as reader:
+            opened = reader.stats()
+            self.assertGreater(opened.reads, 0)
+            self.assertEqual(opened.slices, 0)
+            self.assertEqual(reader["chr1"][0:12], "ACGTNNNTACgt")
+            self.assertEqual(events[-1].slices, 1)
+            self.assertEqual((events[-1].reads, events[-1].bytes_read), (1, 3))
+            self.assertEqual((events[-1].n_blocks, events[-1].mask_blocks), (1, 1))
+            self.assertEqual((events[-1].bases_decoded, events[-1].bases_returned), (12, 12))
+            reader["chr1"].get_slice(14, 20, mask="ignore")
+            self.assertEqual((events[-1].n_blocks, events[-1].mask_blocks), (0, 0))
+            reader.fetch_many([("chr1", 18, 29), ("chr1", 0, 32, "-")])
+            self.assertEqual(len(events), 3)
+            stats = reader.stats()
+            self.assertEqual(stats.slices, 3)
+            self.assertEqual(stats.bases_returned, 12 + 6 + 32)
+            self.assertEqual(stats.n_blocks, 1 + 0 + 2)
+            self.assertEqual(stats.reads - opened.reads, 3)
+            self.assertGreaterEqual(stats.slice_seconds, stats.decode_seconds + stats.blocks_seconds)
+            reader.stats_clear()
+            self.assertEqual(reader.stats().slices, 0)
+        # neither a lambda hook nor a pool of open files is pickled
+        pool = twobitreader.FilePool(max_open=1)
+        with twobitreader.TwoBitFile(self.filename, stats_hook=lambda stats: None, pool=pool) as reader:
+            reader["chr1"][0:4]
+            copy = pickle.loads(pickle.dumps(reader))
+            self.assertEqual(copy["chr1"][0:12], "ACGTNNNTACgt")
+            self.assertEqual(copy.stats().slices, 1)
+            copy.close()
+
+    def write_dense_blocks_file(self):
+        seq = "ACGGTCATTGCA" * 50
+        write_twobit_file(
+            self.filename,
+            {
+                "chr1": {
+                    "seq": seq,
+                    "n_blocks": [(start, 3) for start in range(0, len(seq), 9)],
+                    "mask_blocks": [(start, 4) for start in range(2, len(seq), 7)],
+                },
+            },
+        )
+
+    @unittest.skipIf(twobitreader._load_numpy() is None, "numpy is not installed")
+    def test_numpy_masking_matches_pure_python(self):
+        self.write_dense_blocks_file()
+        with twobitreader.TwoBitFile(self.filename, use_numpy=False) as plain:
+            with twobitreader.TwoBitFile(self.filename, use_numpy=True) as vectorized:
+                for start, end in [(0, None), (5, 400), (1, 2), (100, 300)]:
+                    expected = plain["chr1"][start:end]
+                    self.assertEqual(vectorized["chr1"][start:end], expected)
+                    as_array = vectorized["chr1"].get_slice(start, end, as_array=True)
+                    self.assertEqual(as_array.dtype, twobitreader.numpy.uint8)
+                    self.assertEqual(as_array.tobytes().decode("ascii"), expected)
+                self.assertEqual(len(vectorized["chr1"].get_slice(10, 10, as_array=True)), 0)
+
+    def test_minus_strand_slices_match_reverse_complement(self):
+        self.write_dense_blocks_file()
+        options = [{}, {"cache_size": 64, "cache_block_size": 16}]
+        if twobitreader._load_numpy() is not None:
+            options.append({"use_numpy": True})
+        for option in options:
+            with twobitreader.TwoBitFile(self.filename, **option) as t:
+                for start, end in [(0, None), (5, 400), (1, 2), (99, 301), (7, 7)]:
+                    expected = twobitreader.reverse_complement(t["chr1"][start:end])
+                    self.assertEqual(t["chr1"].get_slice(start, end, strand="-"), expected)
+                    self.assertEqual(t["chr1"].get_slice(start, end, strand="."), t["chr1"][start:end])
+                self.assertRaises(ValueError, t["chr1"].get_slice, 0, 10, strand="x")
+        if twobitreader._load_numpy() is not None:
+            with twobitreader.TwoBitFile(self.filename) as t:
+                as_array = t["chr1"].get_slice(5, 400, as_array=True, strand="-")
+                self.assertEqual(as_array.tobytes().decode("ascii"), twobitreader.reverse_complement(t["chr1"][5:400]))
+
+    def test_mask_policies(self):
+        self.write_dense_blocks_file()
+        with twobitreader.TwoBitFile(self.filename) as t:
+            soft = str(t["chr1"])
+        expected = {
+            "soft": soft,
+            "ignore": soft.upper(),
+            "hard": "".join("N" if base.islower() else base for base in soft),
+        }
+        bitmap = bytearray(base.islower() for base in soft)
+        options = [{}, {"cache_size": 64, "cache_block_size": 16}]
+        if twobitreader._load_numpy() is not None:
+            options.append({"use_numpy": True})
+        for option in options:
+            for mask, seq in expected.items():
+                with twobitreader.TwoBitFile(self.filename, mask=mask, **option) as t:
+                    for start, end in [(0, None), (5, 400), (1, 2), (99, 301)]:
+                        part = seq[start:end]
+                        self.assertEqual(t["chr1"][start:end], part)
+                        self.assertEqual(t["chr1"].get_slice(start, end, strand="-"), twobitreader.reverse_complement(part))
+                    self.assertEqual("".join(t["chr1"].iter_chunks(64)), seq)
+                    self.assertEqual(t.fetch_many([("chr1", 0, 10), ("chr1", 5, 30, "-")], mask="soft")[0], soft[:10])
+            with twobitreader.TwoBitFile(self.filename, mask="bitmap", **option) as t:
+                self.assertEqual(str(t["chr1"]), soft.upper())
+                self.assertEqual(t["chr1"].get_slice(5, 400), (soft.upper()[5:400], bitmap[5:400]))
+                self.assertEqual(t["chr1"].get_slice(5, 400, strand="-")[1], bitmap[5:400][::-1])
+                self.assertEqual(
+                    t.fetch_many([("chr1", 0, 10), ("chr1", 5, 30, "-")]),
+                    [
+                        (soft.upper()[:10], bitmap[:10]),
+                        (twobitreader.reverse_complement(soft.upper()[5:30]), bitmap[5:30][::-1]),
+                    ],
+                )
+                self.assertEqual(t["chr1"].get_slice(3, 3), ("", bytearray()))
+                self.assertEqual(t["chr1"].get_slice(5, 400, mask="soft"), soft[5:400])
+                self.assertRaises(ValueError, next, t["chr1"].iter_chunks())
+                if twobitreader._load_numpy() is not None:
+                    seq, as_array = t["chr1"].get_slice(5, 400, as_array=True)
+                    self.assertEqual(as_array.tolist(), [bool(x) for x in bitmap[5:400]])
+        self.assertRaises(ValueError, twobitreader.TwoBitFile, self.filename, mask="lower")
+
+    def test_composition_and_gc_profile(self):
+        import math
+
+        self.write_dense_blocks_file()
+        options = [{"use_numpy": False}]
+        if twobitreader._load_numpy() is not None:
+            options.append({"use_numpy": True})
+        for option in options:
+            with twobitreader.TwoBitFile(self.filename, **option) as t:
+                seq = str(t["chr1"]).upper()
+                for start, end in [(0, None), (5, 400), (1, 2), (99, 301), (7, 7), (3, 9)]:
+                    part = seq[start:end]
+                    self.assertEqual(t["chr1"].composition(start, end), dict((base, part.count(base)) for base in "ACGTN"))
+                for window, step, start, end in [(10, 10, 0, None), (7, 3, 5, 400), (50, 60, 1, None), (1, 1, 0, 40)]:
+                    expected = []
+                    for window_start in range(start, len(seq) if end is None else end, step):
+                        part = seq[window_start : min(window_start + window, len(seq) if end is None else end)]
+                        called = len(part) - part.count("N")
+                        expected.append((part.count("G") + part.count("C")) / called if called else float("nan"))
+                    profile = t["chr1"].gc_profile(window, step, start, end)
+                    self.assertEqual(len(profile), len(expected))
+                    for got, want in zip(profile, expected):
+                        self.assertTrue(math.isnan(want) and math.isnan(got) or abs(got - want) < 1e-12, (got, want))
+                self.assertRaises(ValueError, t["chr1"].gc_profile, 0)
+
+    def test_kmer_counts_match_brute_force(self):
+        from collections import Counter
+        from twobitreader import kmers
+
+        self.write_dense_blocks_file()
+        with twobitreader.TwoBitFile(self.filename) as t:
+            seq = str(t["chr1"]).upper()
+
+            def brute_force(k, canonical):
+                counts = Counter()
+                for i in range(len(seq) - k + 1):
+                    kmer = seq[i : i + k]
+                    if "N" not in kmer:
+                        code = kmers.str_to_kmer(kmer)
+                        if canonical:
+                            code = min(code, kmers.reverse_complement_kmer(code, k))
+                        counts[code] += 1
+                return counts
+
+            engines = [False, True] if twobitreader._load_numpy() is not None else [False]
+            chunk_size = kmers.KMER_CHUNK_SIZE
+            kmers.KMER_CHUNK_SIZE = 37
+            try:
+                for k in [1, 4, 5, 12]:
+                    for canonical in [True, False]:
+                        expected = brute_force(k, canonical)
+                        for use_numpy in engines:
+                            self.assertEqual(kmers.count_kmers(t, k, canonical, use_numpy=use_numpy), expected)
+                        self.assertEqual(kmers.count_kmers(t["chr1"], k, canonical, use_numpy=False), expected)
+                self.assertEqual(kmers.count_kmers(t, 5, jobs=2), brute_force(5, True))
+            finally:
+                kmers.KMER_CHUNK_SIZE = chunk_size
+            self.assertRaises(ValueError, kmers.count_kmers, t, 32)
+            self.assertRaises(ValueError, kmers.count_kmers, t["chr1"], 5, jobs=2)
+        self.assertEqual(kmers.kmer_to_str(kmers.str_to_kmer("GATTACA"), 7), "GATTACA")
+        self.assertEqual(kmers.kmer_to_str(kmers.reverse_complement_kmer(kmers.str_to_kmer("GATTACA"), 7), 7), "TGTAATC")
+
+    def test_find_matches_brute_force(self):
+        self.write_dense_blocks_file()
+
+        def brute_force(seq, pattern, strands, exclude_n, exclude_masked):
+            reverse = pattern.translate(twobitreader.IUPAC_COMPLEMENT)[::-1]
+
+            def matches(window, codes):
+                for base, code in zip(window, codes):
+                    if base.upper() == "N" and not exclude_n:
+                        continue
+                    if base.upper() not in twobitreader.IUPAC_CODES[code] or (exclude_masked and base.islower()):
+                        return False
+                return True
+
+            hits = []
+            for i in range(len(seq) - len(pattern) + 1):
+                window = seq[i : i + len(pattern)]
+                if strands != "-" and matches(window, pattern):
+                    hits.append(("chr1", i, i + len(pattern), "+"))
+                if strands != "+" and matches(window, reverse):
+                    hits.append(("chr1", i, i + len(pattern), "-"))
+            return hits
+
+        chunk_size = twobitreader.ITER_CHUNK_SIZE
+        twobitreader.ITER_CHUNK_SIZE = 16
+        try:
+            with twobitreader.TwoBitFile(self.filename) as t:
+                seq = str(t["chr1"])
+                for pattern in ["TGCA", "NGG", "GTCAT", "A"]:
+                    for strands in ["both", "+", "-"]:
+                        for exclude_n, exclude_masked in [(True, False), (False, False), (True, True)]:
+                            self.assertEqual(
+                                list(t.find(pattern, strands, exclude_n, exclude_masked)),
+                                brute_force(seq, pattern, strands, exclude_n, exclude_masked),
+                            )
+                self.assertEqual(list(t.find("RYW", jobs=2)), list(t.find("RYW")))
+                # bad arguments raise at the call, before iterating
+                self.assertRaises(ValueError, t.find, "XZ")
+                self.assertRaises(ValueError, t.find, "NGG", strands="x")
+                self.assertRaises(KeyError, t.find, "NGG", names=["chrX"])
+        finally:
+            twobitreader.ITER_CHUNK_SIZE = chunk_size
+
+    @unittest.skipIf(twobitreader._load_numpy() is None, "numpy is not installed")
+    def test_encoded_output(self):
+        numpy = twobitreader.numpy
+        self.write_dense_blocks_file()
+
+        def one_hot(seq, n_value=0):
+            return numpy.array([[float(base == x) for x in "ACGT"] if base != "N" else [n_value] * 4 for base in seq])
+
+        for option in [{}, {"cache_size": 64, "cache_block_size": 16}]:
+            with twobitreader.TwoBitFile(self.filename, **option) as t:
+                seq = str(t["chr1"]).upper()
+                for start, end in [(0, None), (5, 400), (1, 2), (99, 301)]:
+                    part = seq[start:end]
+                    encoded = t["chr1"].get_encoded(start, end)
+                    self.assertEqual(encoded.dtype, numpy.float32)
+                    self.assertTrue((encoded == one_hot(part)).all())
+                    reverse = twobitreader.reverse_complement(part)
+                    encoded = t["chr1"].get_encoded(start, end, "int8", n_value=-1, strand="-")
+                    self.assertEqual(encoded.tolist(), ["ACGT".index(base) if base != "N" else -1 for base in reverse])
+                self.assertEqual(t["chr1"].get_encoded(3, 3).shape, (0, 4))
+                intervals = [("chr1", 0, 30), ("chr1", 10, 40, "-"), ("chr1", 590, None), ("chr1", 7, 37)]
+                out = numpy.full((4, 30, 4), 9, dtype=numpy.float16)
+                t.fill_encoded(intervals, out, n_value=0.25, reverse_complement=[False, False, False, True])
+                expected = [seq[0:30], twobitreader.reverse_complement(seq[10:40]), seq[590:] + "N" * 20]
+                expected.append(twobitreader.reverse_complement(seq[7:37]))
+                for row, part in enumerate(expected):
+                    self.assertTrue((out[row] == one_hot(part, 0.25)).all())
+                out = numpy.empty((2, 30), dtype=numpy.int8)
+                t.fill_encoded(intervals[:2], out, "int8", reverse_complement=True)
+                self.assertEqual(
+                    out[0].tolist(),
+                    [4 if base == "N" else "ACGT".index(base) for base in twobitreader.reverse_complement(seq[:30])],
+                )
+                self.assertRaises(ValueError, t.fill_encoded, intervals, numpy.empty((4, 20, 4)))
+                self.assertRaises(ValueError, t.fill_encoded, intervals, numpy.empty((3, 30, 4)))
+                self.assertRaises(ValueError, t["chr1"].get_encoded, 0, 10, "twohot")
+
+    def test_interval_sampler(self):
+        from twobitreader.sampling import IntervalSampler
+
+        write_twobit_file(
+            self.filename,
+            {
+                "chr1": {"seq": "ACGGTCATTG" * 20, "n_blocks": [(50, 20)], "mask_blocks": [(100, 30)]},
+                "chr2": {"seq": "TTGACCAGTA" * 4},
+                "chr3": {"seq": "ACGTA"},
+            },
+        )
+        with twobitreader.TwoBitFile(self.filename) as t:
+            sampler = IntervalSampler(t, 10, batch_size=16, seed=7)
+            intervals, seqs = sampler[3]
+            self.assertEqual(sampler[3], (intervals, seqs))
+            self.assertNotEqual(sampler.intervals(4), intervals)
+            self.assertEqual(pickle.loads(pickle.dumps(sampler)).intervals(3), intervals)
+            self.assertEqual(list(sampler.iter_batches(1, 7, 3)), [sampler[1], sampler[4]])
+            drawn = [interval for index in range(40) for interval in sampler.intervals(index)]
+            for (chrom, start, end, strand), seq in zip(intervals, seqs):
+                self.assertEqual(seq, t[chrom][start:end])
+            for chrom, start, end, strand in drawn:
+                self.assertNotEqual(chrom, "chr3")
+                self.assertEqual(strand, "+")
+                self.assertEqual(end - start, 10)
+                self.assertFalse(chrom == "chr1" and start < 70 and end > 50)
+            # chr1 has 191 - 31 acceptable starts and chr2 31
+            self.assertGreater(sum(chrom == "chr1" for chrom, _, _, _ in drawn), len(drawn) // 2)
+            unmasked = IntervalSampler(t, 10, batch_size=16, seed=7, max_masked_fraction=0.2, random_strand=True)
+            for index in range(20):
+                for (chrom, start, end, strand), seq in zip(*unmasked[index]):
+                    self.assertLessEqual(sum(base.islower() for base in seq), 2)
+                    self.assertIn(strand, "+-")
+            # every 150-base window of chr1 overlaps its N-block
+            for seq in IntervalSampler(t, 150, batch_size=4, allow_n=True)[0][1]:
+                self.assertIn("N", seq)
+            self.assertRaises(RuntimeError, IntervalSampler(t, 150, batch_size=4).batch, 0)
+            self.assertRaises(ValueError, IntervalSampler, t, 500)
+            if twobitreader._load_numpy() is not None:
+                intervals, x = IntervalSampler(t, 10, batch_size=5, seed=1, encoding="onehot")[0]
+                self.assertEqual(x.shape, (5, 10, 4))
+                self.assertTrue((x.sum(axis=2) == 1).all())
+                intervals, x = IntervalSampler(t, 10, batch_size=5, seed=1, encoding="int8")[0]
+                self.assertEqual(x.dtype, twobitreader.numpy.int8)
+                self.assertEqual(
+                    x[0].tolist(),
+                    ["ACGT".index(base) for base in t[intervals[0][0]][intervals[0][1] : intervals[0][2]].upper()],
+                )
+
+    def test_import_does_not_load_numpy_or_multiprocessing(self):
+        import subprocess
+
+        code = "import sys, twobitreader; sys.exit('numpy' in sys.modules or 'multiprocessing' in sys.modules)"
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+        self.assertEqual(subprocess.call([sys.executable, "-c", code], cwd=root), 0)
+
+    def test_as_array_requires_numpy(self):
+        from unittest import mock
+
+        self.write_dense_blocks_file()
+        with twobitreader.TwoBitFile(self.filename) as reader:
+            with mock.patch.object(twobitreader, "numpy", None):
+                self.assertRaises(ImportError, reader["chr1"].get_slice, 0, 10, as_array=True)
+                self.assertRaises(ImportError, twobitreader.TwoBitFile, self.filename, use_numpy=True)
+
+    def test_sidecar_index_round_trip(self):
+        sequences = {
+            "chr1": {"seq": "ACGTACGTACGTACGTACGTACGTACGTACGT", "n_blocks": [(4, 3), (20, 5)], "mask_blocks": [(10, 4)]},
+            "chr2": {"seq": "GGGCCCAAATTT"},
+            "chr3": {"seq": "ACGTTGCA" * 9, "mask_blocks": [(0, 2), (30, 10), (70, 2)]},
+        }
+        write_twobit_file(self.filename, sequences)
+        sidecar = self.filename + twobitreader.SIDECAR_SUFFIX
+        self.addCleanup(lambda: os.path.exists(sidecar) and os.remove(sidecar))
+        with twobitreader.TwoBitFile(self.filename) as plain:
+            expected = dict((name, str(sequence)) for name, sequence in plain.items())
+            sizes = plain.sequence_sizes()
+        with twobitreader.TwoBitFile(self.filename, sidecar=True) as first:
+            self.assertTrue(first._sidecar is None)
+            self.assertTrue(os.path.exists(sidecar))
+        for lazy in [False, True]:
+            with twobitreader.TwoBitFile(self.filename, sidecar=True, lazy=lazy) as reopened:
+                self.assertTrue(reopened._sidecar is not None)
+                self.assertEqual(list(reopened.keys()), list(sequences))
+                self.assertEqual(reopened.sequence_sizes(), sizes)
+                for name in sequences:
+                    self.assertEqual(str(reopened[name]), expected[name])
+                    self.assertEqual(reopened[name][5:23], expected[name][5:23])
+
+    def test_stale_sidecar_index_is_rebuilt(self):
+        write_twobit_file(self.filename, {"chr1": {"seq": "ACGTACGT"}})
+        sidecar = self.filename + ".idx"
+        self.addCleanup(lambda: os.path.exists(sidecar) and os.remove(sidecar))
+        twobitreader.TwoBitFile(self.filename, sidecar=sidecar).close()
+        write_twobit_file(self.filename, {"chr1": {"seq": "TTTTGGGGCC", "n_blocks": [(0, 2)]}, "chr2": {"seq": "A"}})
+        stat = os.stat(self.filename)
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        with twobitreader.TwoBitFile(self.filename, sidecar=sidecar) as t:
+            self.assertTrue(t._sidecar is None)
+            self.assertEqual(str(t["chr1"]), "NNTTGGGGCC")
+        with twobitreader.TwoBitFile(self.filename, sidecar=sidecar) as t:
+            self.assertTrue(t._sidecar is not None)
+            self.assertEqual(str(t["chr1"]), "NNTTGGGGCC")
+            self.assertEqual(str(t["chr2"]), "A")
+        with open(sidecar, "r+b") as handle:
+            handle.truncate(50)
+        with twobitreader.TwoBitFile(self.filename, sidecar=sidecar) as t:
+            self.assertTrue(t._sidecar is None)
+            self.assertEqual(str(t["chr1"]), "NNTTGGGGCC")
+
+    def test_unwritable_sidecar_index_logs_warning(self):
+        write_twobit_file(self.filename, {"chr1": {"seq": "ACGTACGT"}})
+        sidecar = os.path.join(self.filename + ".missing", "index.tbi2")
+        with self.assertLogs(level="WARNING") as logs:
+            with twobitreader.TwoBitFile(self.filename, sidecar=sidecar) as t:
+                self.assertEqual(str(t["chr1"]), "ACGTACGT")
+        self.assertTrue(any("sidecar" in message for message in logs.output))
+
+    def test_version_1_file(self):
+        sequences = {
+            "chr1": {"seq": "ACGTACGTACGTACGTACGTACGTACGTACGT", "n_blocks": [(4, 3)], "mask_blocks": [(10, 4)]},
+            "chr2": {"seq": "GGGCCCAAATTT"},
+        }
+        write_twobit_file(self.filename, sequences, version=1)
+        with twobitreader.TwoBitFile(self.filename) as t:
+            self.assertEqual(t.sequence_sizes(), {"chr1": 32, "chr2": 12})
+            self.assertEqual(t["chr1"][0:16], "ACGTNNNTACgtacGT")
+            self.assertEqual(str(t["chr2"]), "GGGCCCAAATTT")
+
+    def test_unknown_version(self):
+        write_twobit_file(self.filename, {"chr1": {"seq": "ACGT"}}, version=2)
+        self.assertRaises(twobitreader.TwoBitFileError, twobitreader.TwoBitFile, self.filename)
+
+    @unittest.skipIf(sys.maxsize < 2**32, "needs a 64-bit Python")
+    def test_version_1_sparse_file_over_4_gib(self):
+        sequences = {
+            "chr1": {"seq": "ACGTACGTACGTACGTACGT", "n_blocks": [(4, 3)], "mask_blocks": [(10, 4)]},
+            "chr2": {"seq": "GGGCCCAAATTTGC"},
+        }
+        records_offset = 2**32 + 12345
+        try:
+            write_twobit_file(self.filename, sequences, version=1, records_offset=records_offset)
+        except (IOError, OSError, OverflowError) as error:
+            self.skipTest("cannot write a sparse 4 GiB file here: %s" % error)
+        self.assertTrue(os.path.getsize(self.filename) > 2**32)
+        sidecar = self.filename + twobitreader.SIDECAR_SUFFIX
+        self.addCleanup(lambda: os.path.exists(sidecar) and os.remove(sidecar))
+        for options in [
+            {},
+            {"mmap": True},
+            {"lazy": True, "sidecar": True},
+            {"sidecar": True, "cache_size": 64, "cache_block_size": 16},
+        ]:
+            with twobitreader.TwoBitFile(self.filename, **options) as t:
+                self.assertEqual(t._offset_dict["chr1"], records_offset)
+                self.assertEqual(t.sequence_sizes(), {"chr1": 20, "chr2": 14})
+                self.assertEqual(str(t["chr1"]), "ACGTNNNTACgtacGTACGT")
+                self.assertEqual(t["chr2"][3:14], "CCCAAATTTGC")
+                self.assertEqual(t.fetch_many([("chr2", 0, 3), ("chr1", 8, 12, "-")]), ["GGG", "acGT"])
+
+
+class TwoBitWriterTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".2bit")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_fasta_round_trip(self):
+        import random
+        from twobitreader.write import TwoBitWriter
+
+        rng = random.Random(1)
+        sequences = {}
+        for name in ["chrA", "chrB", "chrC"]:
+            size = rng.randrange(1, 3000)
+            sequences[name] = "".join(rng.choice("ACGTacgtNnRy") * rng.randrange(1, 20) for _ in range(size // 10))
+        fasta = b"".join(
+            (">%s description\n" % name).encode("ascii")
+            + b"".join(seq[i : i + 60].encode("ascii") + b"\n" for i in range(0, len(seq), 60))
+            for name, seq in sequences.items()
+        )
+        with TwoBitWriter(self.filename) as writer:
+            # tiny blocks split headers, lines and runs across reads
+            writer.write_fasta(StringIO(fasta), block_size=7)
+        with twobitreader.TwoBitFile(self.filename) as t:
+            for name, seq in sequences.items():
+                expected = "".join(base if base in "ACGTacgt" else ("N" if base.isupper() else "n") for base in seq)
+                self.assertEqual(str(t[name]), expected)
+
+    def test_rewrite_is_byte_identical(self):
+        from twobitreader.write import TwoBitWriter
+
+        this_dir = os.path.dirname(__file__)
+        original = os.path.join(this_dir, "test.2bit")
+        with twobitreader.TwoBitFile(original) as t:
+            with TwoBitWriter(self.filename) as writer:
+                for name, _ in t._sequence_offsets:
+                    seq = str(t[name])
+                    # feed in uneven chunks
+                    writer.write_sequence(name, [seq[i : i + 3] for i in range(0, len(seq), 3)])
+        with open(original, "rb") as a, open(self.filename, "rb") as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_version_1_and_errors(self):
+        from twobitreader.write import TwoBitWriter
+
+        with TwoBitWriter(self.filename, version=1) as writer:
+            writer.write_sequence("chr1", "ACGTNNac")
+            self.assertRaises(ValueError, writer.write_sequence, "chr1", "A")
+            self.assertRaises(ValueError, writer.write_sequence, "x" * 256, "A")
+        with twobitreader.TwoBitFile(self.filename) as t:
+            self.assertEqual(t._version, 1)
+            self.assertEqual(str(t["chr1"]), "ACGTNNac")
+        with TwoBitWriter(self.filename) as writer:
+            self.assertRaises(ValueError, writer.write_fasta, StringIO(b"ACGT\n>chr1\nACGT\n"))
+
+    def test_command_line(self):
+        import subprocess
+
+        fd, fasta = tempfile.mkstemp(suffix=".fa")
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(b">seq1\nACGTacgt\nNNNN\n>seq2\nGATTACA\n")
+        self.addCleanup(os.remove, fasta)
+        root = os.path.join(os.path.dirname(__file__), "..")
+        subprocess.check_call([sys.executable, "-m", "twobitreader.write", fasta, self.filename], cwd=root)
+        with twobitreader.TwoBitFile(self.filename) as t:
+            self.assertEqual(str(t["seq1"]), "ACGTacgtNNNN")
+            self.assertEqual(str(t["seq2"]), "GATTACA")
+
+
+class AsyncTwoBitFileTest(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(os.path.dirname(__file__), "test.2bit")
+
+    def run_with_genome(self, coroutine_function, **options):
+        import asyncio
+        from twobitreader.aio import AsyncTwoBitFile
+
+        async def main():
+            async with await AsyncTwoBitFile.open(self.filename, **options) as genome:
+                return await coroutine_function(genome)
+
+        return asyncio.run(main())
+
+    def test_matches_sync_reads(self):
+        intervals = [("chr1", 0, 10), ("chr2", 5, 20, "-"), ("chr10", 40, None), ("chr1", -5, None)]
+
+        async def lookups(genome):
+            single = [await genome[interval[0]].get_slice(*interval[1:]) for interval in intervals]
+            many = await genome.fetch_many(intervals)
+            return single, many
+
+        with twobitreader.TwoBitFile(self.filename) as t:
+            expected = t.fetch_many(intervals)
+        single, many = self.run_with_genome(lookups, batch_size=2)
+        self.assertEqual(single, expected)
+        self.assertEqual(many, expected)
+
+    def test_identical_requests_share_one_read(self):
+        import asyncio
+
+        batches = []
+
+        async def lookups(genome):
+            fetch_batch = genome._fetch_batch
+            genome._fetch_batch = lambda batch: batches.append(list(batch)) or fetch_batch(batch)
+            return await asyncio.gather(*[genome.get_slice("chr3", 2, 12) for _ in range(100)])
+
+        results = self.run_with_genome(lookups)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(batches, [[("chr3", 2, 12, "+")]])
+
+    def test_bad_request_fails_alone(self):
+        import asyncio
+
+        async def lookups(genome):
+            return await asyncio.gather(
+                genome.get_slice("chr1", 0, 4), genome.get_slice("chr1", 0, 4, "x"), return_exceptions=True
+            )
+
+        good, bad = self.run_with_genome(lookups)
+        self.assertEqual(good, "GAAC")
+        self.assertTrue(isinstance(bad, ValueError))
+
+    def test_open_parses_the_file_on_the_executor(self):
+        import threading
+        from unittest import mock
+
+        threads = []
+
+        class RecordingTwoBitFile(twobitreader.TwoBitFile):
+            def __init__(self, *args, **kwargs):
+                threads.append(threading.get_ident())
+                twobitreader.TwoBitFile.__init__(self, *args, **kwargs)
+
+        async def lookups(genome):
+            return await genome.get_slice("chr1", 0, 4)
+
+        with mock.patch("twobitreader.aio.TwoBitFile", RecordingTwoBitFile):
+            self.assertEqual(self.run_with_genome(lookups), "GAAC")
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_size_reads_on_the_executor(self):
+        import threading
+
+        loop_thread = threading.get_ident()
+        threads = []
+
+        async def lookups(genome):
+            reader = genome._genome._reader
+            read_at = reader.read_at
+            reader.read_at = lambda offset, size: threads.append(threading.get_ident()) or read_at(offset, size)
+            return await genome["chr2"].size()
+
+        with twobitreader.TwoBitFile(self.filename) as t:
+            self.assertEqual(self.run_with_genome(lookups, lazy=True), len(t["chr2"]))
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+
+
+class TwoBitCollectionTest(unittest.TestCase):
+    def setUp(self):
+        import shutil
+
+        self.directory = tempfile.mkdtemp()
+        source = os.path.join(os.path.dirname(__file__), "test.2bit")
+        self.paths = []
+        for i in range(6):
+            path = os.path.join(self.directory, "sample%d.2bit" % i)
+            shutil.copy(source, path)
+            self.paths.append(path)
+        self.reference = twobitreader.TwoBitFile(source)
+
+    def tearDown(self):
+        import shutil
+
+        self.reference.close()
+        shutil.rmtree(self.directory)
+
+    def test_pool_bounds_open_files(self):
+        from twobitreader.collection import TwoBitCollection
+
+        ref = self.reference
+        with TwoBitCollection(self.paths, max_open=2) as cohort:
+            self.assertEqual(cohort.keys(), ["sample%d" % i for i in range(6)])
+            for _ in range(2):
+                for i in range(6):
+                    self.assertEqual(cohort["sample%d:chr1" % i][3:40], ref["chr1"][3:40])
+                    self.assertEqual(str(cohort[("sample%d" % i, "chr10")]), str(ref["chr10"]))
+                    self.assertLessEqual(cohort.pool_info().currsize, 2)
+            info = cohort.pool_info()
+            self.assertGreater(info.evictions, 0)
+            self.assertEqual(info.opens - info.evictions, info.currsize)
+            self.assertIn("sample3:chr2", cohort)
+            self.assertIn("sample3", cohort)
+            self.assertNotIn("sample3:chrX", cohort)
+            self.assertNotIn("sample9:chr1", cohort)
+            self.assertNotIn(("sample3",), cohort)
+            self.assertNotIn(("sample3", "chr2", "extra"), cohort)
+            self.assertRaises(KeyError, cohort.__getitem__, "chr1")
+            self.assertEqual(len(cohort.sequence_names()), 6 * len(ref))
+            self.assertEqual(cohort.sequence_sizes(["sample4"])["sample4:chr3"], len(ref["chr3"]))
+            intervals = [("sample5:chr1", 0, 10), ("sample0:chr2", 5, 15, "-"), ("sample5:chr1", 8, 20)]
+            expected = [ref["chr1"][0:10], ref["chr2"].get_slice(5, 15, strand="-"), ref["chr1"][8:20]]
+            self.assertEqual(cohort.fetch_many(intervals), expected)
+            copy = pickle.loads(pickle.dumps(cohort))
+            self.assertEqual(copy["sample2:chr4"][:], ref["chr4"][:])
+            copy.close()
+        self.assertEqual(cohort.pool_info().currsize, 0)
+
+    def test_file_pool_reopens_files(self):
+        pool = twobitreader.FilePool(max_open=1)
+        first = twobitreader.TwoBitFile(self.paths[0], pool=pool)
+        second = twobitreader.TwoBitFile(self.paths[1], pool=pool, lazy=True)
+        for _ in range(3):
+            self.assertEqual(first["chr1"][:], self.reference["chr1"][:])
+            self.assertEqual(second["chr9"][:], self.reference["chr9"][:])
+        self.assertEqual(pool.info().currsize, 1)
+        self.assertRaises(ValueError, twobitreader.TwoBitFile, self.paths[0], pool=pool, mmap=True)
+        self.assertRaises(ValueError, twobitreader.FilePool, 0)
+        first.close()
+        self.assertRaises(ValueError, first["chr1"].get_slice, 0, 5)
+        second.close()
+        self.assertEqual(pool.info().currsize, 0)
+
+    def test_file_pool_discard_waits_for_reads(self):
+        import threading
+
+        pool = twobitreader.FilePool(max_open=2)
+        t = twobitreader.TwoBitFile(self.paths[0], pool=pool, lazy=True)
+        pooled = t._reader
+        reader = pool._open[pooled][0]
+        read_at = reader.read_at
+        reading = threading.Event()
+        release = threading.Event()
+
+        def slow_read(offset, size):
+            reading.set()
+            release.wait(10)
+            return read_at(offset, size)
+
+        reader.read_at = slow_read
+        thread = threading.Thread(target=pool.read_at, args=(pooled, 0, 16))
+        thread.start()
+        self.assertTrue(reading.wait(10))
+        pool.discard(pooled)
+        self.assertFalse(reader.closed)
+        release.set()
+        thread.join(10)
+        self.assertTrue(reader.closed)
+        self.assertEqual(pool.info().currsize, 0)
+        t.close()
+
+
+class BytesSource(twobitreader.ByteSource):
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def read_at(self, offset, size):
+        if offset + size > self.size:
+            raise EOFError("read beyond end of file")
+        return self.data[offset : offset + size]
+
+
+class RemoteTwoBitFileTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+        from threading import Thread
+
+        with open(os.path.join(os.path.dirname(__file__), "test.2bit"), "rb") as handle:
+            data = handle.read()
+        cls.data = data
+
+        class Handler(BaseHTTPRequestHandler):
+            # serves test.2bit, honouring Range on /test.2bit but not /norange.2bit
+            def do_GET(self):
+                header = self.headers.get("Range")
+                if header is None or self.path == "/norange.2bit":
+                    self.send_response(200)
+                    body = data
+                else:
+                    start, end = header.split("=")[1].split("-")
+                    start, end = int(start), min(int(end), len(data) - 1)
+                    body = data[start : end + 1]
+                    self.send_response(206)
+                    self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, len(data)))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        cls.server = Server(("127.0.0.1", 0), Handler)
+        cls.url = "http://127.0.0.1:%d/" % cls.server.server_address[1]
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.reference = twobitreader.TwoBitFile(os.path.join(os.path.dirname(__file__), "test.2bit"))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.reference.close()
+
+    def test_http_source_matches_local_file(self):
+        from twobitreader.remote import HTTPSource
+
+        ref = self.reference
+        source = HTTPSource(self.url + "test.2bit", block_size=16, cache_blocks=8)
+        self.assertEqual(source.size, len(self.data))
+        self.assertEqual(source.requests, 1)
+        with twobitreader.TwoBitFile(source, lazy=True) as t:
+            self.assertEqual(t.sequence_sizes(), ref.sequence_sizes())
+            for name in ref:
+                self.assertEqual(str(t[name]), str(ref[name]))
+                self.assertEqual(t[name][3:7], ref[name][3:7])
+            # a repeated slice is served from the block cache
+            self.assertEqual(t["chr1"][3:7], ref["chr1"][3:7])
+            requests = source.requests
+            self.assertEqual(t["chr1"][3:7], ref["chr1"][3:7])
+            self.assertEqual(source.requests, requests)
+            self.assertEqual(bytes(source.read_at(0, len(self.data))), self.data)
+            self.assertRaises(EOFError, source.read_at, len(self.data) - 2, 4)
+            t2 = pickle.loads(pickle.dumps(t))
+            self.assertEqual(t2["chr10"][0:5], ref["chr10"][0:5])
+            t2.close()
+        self.assertRaises(ValueError, source.read_at, 0, 4)
+
+    def test_http_url_and_errors(self):
+        with twobitreader.TwoBitFile(self.url + "test.2bit") as t:
+            self.assertEqual(str(t["chr1"]), str(self.reference["chr1"]))
+        self.assertRaises(IOError, twobitreader.TwoBitFile, self.url + "norange.2bit")
+        # bad options fail before any request is made
+        from unittest import mock
+
+        with mock.patch("twobitreader.remote.HTTPSource") as source:
+            for option in [{"mmap": True}, {"sidecar": True}, {"pool": twobitreader.FilePool()}, {"mask": "x"}]:
+                self.assertRaises(ValueError, twobitreader.TwoBitFile, self.url + "test.2bit", **option)
+        self.assertFalse(source.called)
+
+    def test_custom_byte_source(self):
+        with twobitreader.TwoBitFile(BytesSource(self.data), stats=True) as t:
+            self.assertEqual(t.sequence_sizes(), self.reference.sequence_sizes())
+            self.assertEqual(t["chr10"][2:9], self.reference["chr10"][2:9])
+
 
 class CheckTestTwoBitFileTest(unittest.TestCase):
     def setUp(self):
@@ -354,6 +1176,265 @@ class CheckTestTwoBitFileTest(unittest.TestCase):
             chr10 = str(t["chr10"])
             self.assertEqual(chr10, "gaaagggaactccctgaccccttgtgaaagggaactccctgaccccttgt")
 
+    def test_lazy_open_defers_sequence_records(self):
+        t = twobitreader.TwoBitFile(self.filename, lazy=True)
+        self.assertEqual(len(t), 10)
+        self.assertTrue("chr10" in t)
+        self.assertFalse("chr11" in t)
+        self.assertEqual(set(t.keys()), set(["chr%d" % x for x in range(1, 11)]))
+        self.assertFalse(isinstance(dict.__getitem__(t, "chr10"), twobitreader.TwoBitSequence))
+        chr10 = t["chr10"]
+        self.assertTrue(isinstance(chr10, twobitreader.TwoBitSequence))
+        self.assertTrue(dict.__getitem__(t, "chr10") is chr10)
+        self.assertFalse(isinstance(dict.__getitem__(t, "chr1"), twobitreader.TwoBitSequence))
+        self.assertEqual(str(chr10), "gaaagggaactccctgaccccttgtgaaagggaactccctgaccccttgt")
+        self.assertTrue(t.get("chr11") is None)
+        t.close()
+
+    def test_lazy_open_matches_eager(self):
+        eager = twobitreader.TwoBitFile(self.filename)
+        lazy = twobitreader.TwoBitFile(self.filename, lazy=True)
+        self.assertEqual(lazy.sequence_sizes(), eager.sequence_sizes())
+        for name, sequence in lazy.items():
+            self.assertTrue(isinstance(sequence, twobitreader.TwoBitSequence))
+            self.assertEqual(str(sequence), str(eager[name]))
+        eager.close()
+        lazy.close()
+
+    def test_lazy_file_as_plain_dict(self):
+        def is_sequence(sequence):
+            return isinstance(sequence, twobitreader.TwoBitSequence)
+
+        for convert in [dict, lambda t: dict(**t), lambda t: t.copy()]:
+            t = twobitreader.TwoBitFile(self.filename, lazy=True)
+            d = convert(t)
+            self.assertEqual(len(d), 10)
+            self.assertTrue(all(is_sequence(sequence) for sequence in d.values()))
+            t.close()
+        t = twobitreader.TwoBitFile(self.filename, lazy=True)
+        self.assertTrue(is_sequence(t.setdefault("chr1")))
+        name, sequence = t.popitem()
+        self.assertTrue(is_sequence(sequence))
+        self.assertNotIn("not loaded", repr(t))
+        t.close()
+
+    def test_mmap_matches_buffered_reads(self):
+        buffered = twobitreader.TwoBitFile(self.filename)
+        mapped = twobitreader.TwoBitFile(self.filename, mmap=True)
+        self.assertEqual(mapped.sequence_sizes(), buffered.sequence_sizes())
+        for name in buffered:
+            self.assertEqual(str(mapped[name]), str(buffered[name]))
+            self.assertEqual(mapped[name][3:40], buffered[name][3:40])
+        self.assertTrue(isinstance(mapped["chr1"]._n_block_starts, memoryview))
+        buffered.close()
+        mapped.close()
+
+    def test_mmap_closed_file(self):
+        t = twobitreader.TwoBitFile(self.filename, mmap=True)
+        chr1 = t["chr1"]
+        t.close()
+        with self.assertRaises(ValueError):
+            str(chr1)
+
+    def test_concurrent_slicing_from_threads(self):
+        import threading
+
+        with twobitreader.TwoBitFile(self.filename) as t:
+            expected = dict((name, str(sequence)) for name, sequence in t.items())
+        for options in [{}, {"mmap": True}, {"lazy": True}]:
+            t = twobitreader.TwoBitFile(self.filename, **options)
+            failures = []
+
+            def worker(seed):
+                for i in range(200):
+                    name = "chr%d" % ((seed + i) % 10 + 1)
+                    start = (seed * 7 + i) % 40
+                    end = start + (i % 11) + 1
+                    if t[name][start:end] != expected[name][start:end]:
+                        failures.append((name, start, end))
+
+            threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(failures, [])
+            t.close()
+
+    def test_fetch_many_preserves_order(self):
+        t = twobitreader.TwoBitFile(self.filename)
+        intervals = [
+            ("chr10", 20, 30),
+            ("chr1", 40, 60),
+            ("chr10", 0, 25),
+            ("chr1", 0, 5, "-"),
+            ("chr10", 45, 100, "+"),
+            ("chr1", 50, 50),
+            ("chr10", -5, None, "."),
+        ]
+        expected = []
+        for interval in intervals:
+            seq = t[interval[0]][interval[1] : interval[2]]
+            if len(interval) > 3 and interval[3] == "-":
+                seq = twobitreader.reverse_complement(seq)
+            expected.append(seq)
+        self.assertEqual(t.fetch_many(intervals), expected)
+        self.assertEqual(t.fetch_many(intervals, max_gap=0), expected)
+        self.assertEqual(t.fetch_many([]), [])
+        self.assertRaises(ValueError, t.fetch_many, [("chr1", 0, 5, "x")])
+        self.assertRaises(KeyError, t.fetch_many, [("chr11", 0, 5)])
+        t.close()
+
+    def test_reverse_complement(self):
+        self.assertEqual(twobitreader.reverse_complement("ACGTNacgtn"), "nacgtNACGT")
+        self.assertEqual(twobitreader.reverse_complement("GAAc"), "gTTC")
+
+    def test_twobit_reader_writes_fasta(self):
+        t = twobitreader.TwoBitFile(self.filename)
+        output = []
+        twobitreader.twobit_reader(t, input_stream=["chr10 0 5\n", "chr1 70 80\n", "chr10 45 50\n"], write=output.append)
+        self.assertEqual(output, [">chr10:0-5", "gaaag", ">chr1:70-75", "TCCAC", ">chr10:45-50", "cttgt"])
+        t.close()
+
+    def test_twobit_reader_uses_bed_strand(self):
+        t = twobitreader.TwoBitFile(self.filename)
+        output = []
+        lines = ["chr10\t0\t5\tx\t0\t-\n", "chr1\t70\t80\tx\t0\t+\n", "chr10\t0\t5\tx\n"]
+        twobitreader.twobit_reader(t, input_stream=lines, write=output.append)
+        self.assertEqual(output, [">chr10:0-5(-)", "ctttc", ">chr1:70-75", "TCCAC", ">chr10:0-5", "gaaag"])
+        t.close()
+
+    def test_fasta_output_matches_textwrap(self):
+        import textwrap
+
+        for seq in ["", "ACGT", "ACGTacgtNN" * 6, "ACGTacgtNN" * 6 + "A", "TTGCAn" * 200]:
+            self.assertEqual(twobitreader.wrap_fasta(seq), textwrap.fill(seq, 60))
+            self.assertEqual(twobitreader.wrap_fasta(seq.encode("ascii"), 7), textwrap.fill(seq, 7).encode("ascii"))
+            self.assertEqual(twobitreader.wrap_fasta(seq, 0), seq)
+            output = StringIO()
+            with twobitreader.FastaWriter(output, width=13, buffer_size=16) as fasta:
+                fasta.write_record("x", seq)
+                fasta.write_record("y", seq.encode("ascii"))
+            record = ">%s\n" + textwrap.fill(seq, 13) + "\n"
+            self.assertEqual(output.getvalue(), ((record % "x") + (record % "y")).encode("ascii"))
+        t = twobitreader.TwoBitFile(self.filename)
+        lines = ["chr%d %d %d" % (i % 10 + 1, i % 17, i % 17 + 25) for i in range(300)] + ["chr1\t0\t75\tx\t0\t-"]
+        expected = []
+        twobitreader.twobit_reader(t, input_stream=lines, write=expected.append)
+        expected = ("\n".join(expected) + "\n").encode("ascii")
+        for jobs in [1, 2]:
+            output = StringIO()
+            twobitreader.twobit_reader(t, input_stream=lines, output=output, jobs=jobs)
+            self.assertEqual(output.getvalue(), expected)
+        output = StringIO()
+        twobitreader.twobit_reader(t, input_stream=["chr1 0 75"], output=output, width=0)
+        self.assertEqual(output.getvalue(), (">chr1:0-75\n" + str(t["chr1"]) + "\n").encode("ascii"))
+        t.close()
+
+    def test_twobit_reader_parallel_keeps_input_order(self):
+        t = twobitreader.TwoBitFile(self.filename)
+        lines = ["chr%d %d %d" % (i % 10 + 1, i % 17, i % 17 + 25) for i in range(300)]
+        serial = []
+        parallel = []
+        twobitreader.twobit_reader(t, input_stream=lines, write=serial.append)
+        with mock_batch_size(7):
+            twobitreader.twobit_reader(t, input_stream=lines, write=parallel.append, jobs=3)
+        self.assertEqual(len(serial), 600)
+        self.assertEqual(parallel, serial)
+        # jobs=0 means one worker per CPU, not serial
+        from unittest import mock
+
+        with mock.patch.object(twobitreader, "cpu_count", return_value=2):
+            with mock.patch.object(
+                twobitreader, "_parallel_fasta_chunks", wraps=twobitreader._parallel_fasta_chunks
+            ) as chunks:
+                parallel = []
+                twobitreader.twobit_reader(t, input_stream=lines, write=parallel.append, jobs=0)
+        self.assertEqual(chunks.call_args[0][2], 2)
+        self.assertEqual(parallel, serial)
+        t.close()
+
+    def test_cmdline_reader_bed_file_and_jobs(self):
+        import subprocess
+
+        fd, bed_filename = tempfile.mkstemp(suffix=".bed")
+        with os.fdopen(fd, "w") as bed:
+            bed.write("chr10\t0\t5\nchr1\t70\t80\nchr10\t45\t50\n")
+        try:
+            package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+            expected = ">chr10:0-5\ngaaag\n>chr1:70-75\nTCCAC\n>chr10:45-50\ncttgt\n"
+            for extra in [[], ["--jobs", "2"], ["--width", "3"], ["--mask", "ignore"]]:
+                result = subprocess.run(
+                    [sys.executable, "-m", "twobitreader", self.filename, bed_filename] + extra,
+                    capture_output=True,
+                    text=True,
+                    cwd=package_dir,
+                    timeout=60,
+                )
+                self.assertEqual(result.returncode, 0, result.stderr)
+                if "--width" in extra:
+                    self.assertEqual(result.stdout, ">chr10:0-5\ngaa\nag\n>chr1:70-75\nTCC\nAC\n>chr10:45-50\nctt\ngt\n")
+                    continue
+                if "--mask" in extra:
+                    expected = ">chr10:0-5\nGAAAG\n>chr1:70-75\nTCCAC\n>chr10:45-50\nCTTGT\n"
+                self.assertEqual(result.stdout, expected)
+        finally:
+            os.remove(bed_filename)
+
+    def test_iter_chunks_matches_str(self):
+        t = twobitreader.TwoBitFile(self.filename)
+        for name in ["chr1", "chr10"]:
+            whole = str(t[name])
+            for chunk_size in [1, 4, 5, 16, 30, 100]:
+                chunks = list(t[name].iter_chunks(chunk_size))
+                self.assertEqual("".join(chunks), whole)
+                self.assertTrue(all(len(chunk) <= max(4, chunk_size) for chunk in chunks))
+            for start, end in [(3, 70), (48, 53), (10, 10), (-7, None)]:
+                joined = b"".join(bytes(chunk) for chunk in t[name].iter_chunks(8, start, end, as_bytes=True))
+                self.assertEqual(joined.decode("ascii"), whole[start:end])
+        t.close()
+
+    def test_iter_chunks_reuses_buffer(self):
+        t = twobitreader.TwoBitFile(self.filename)
+        chunks = list(t["chr1"].iter_chunks(16, as_bytes=True))
+        self.assertEqual(len(chunks), 5)
+        self.assertTrue(all(chunk.obj is chunks[0].obj for chunk in chunks))
+        t.close()
+
+    def test_block_cache_serves_overlapping_slices(self):
+        plain = twobitreader.TwoBitFile(self.filename)
+        t = twobitreader.TwoBitFile(self.filename, cache_size=64, cache_block_size=8)
+        self.assertEqual(t.cache_info(), (0, 0, 0, 0, 64))
+        self.assertEqual(t["chr1"][3:13], plain["chr1"][3:13])
+        self.assertEqual(t.cache_info().misses, 2)
+        self.assertEqual(t["chr1"][5:12], plain["chr1"][5:12])
+        self.assertEqual(t.cache_info().hits, 2)
+        self.assertEqual(t.cache_info().currsize, 16)
+        for name in sorted(plain):
+            for start, end in [(0, 20), (17, 43), (44, None), (-9, -1)]:
+                self.assertEqual(t[name][start:end], plain[name][start:end])
+        info = t.cache_info()
+        self.assertTrue(info.evictions > 0)
+        self.assertTrue(info.currsize <= 64)
+        self.assertEqual(str(t["chr1"]), str(plain["chr1"]))  # larger than the cache
+        t.cache_clear()
+        self.assertEqual(t.cache_info(), (0, 0, 0, 0, 64))
+        self.assertEqual(plain.cache_info(), (0, 0, 0, 0, 0))
+        plain.close()
+        t.close()
+
+    def test_block_cache_smaller_than_a_block(self):
+        self.assertRaises(ValueError, twobitreader.TwoBitFile, self.filename, cache_size=1000)
+        self.assertRaises(ValueError, twobitreader.TwoBitFile, self.filename, cache_size=8, cache_block_size=16)
+
+    def test_block_cache_options_survive_pickling(self):
+        t = twobitreader.TwoBitFile(self.filename, lazy=True, cache_size=128, cache_block_size=16)
+        t2 = pickle.loads(pickle.dumps(t))
+        self.assertEqual(t2.cache_info().maxsize, 128)
+        self.assertEqual(t2["chr10"][0:5], "gaaag")
+        t.close()
+        t2.close()
+
     def test_closed_file(self):
         t = twobitreader.TwoBitFile(self.filename)
         t.close()
@@ -361,5 +1442,28 @@ class CheckTestTwoBitFileTest(unittest.TestCase):
             chr1 = str(t["chr1"])
 
 
+class BenchmarkSuiteTest(unittest.TestCase):
+    def test_suite_runs_on_tiny_genome(self):
+        import json
+        import subprocess
+
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+        fd, output = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            # every sequence is shorter than the long slices
+            command = [sys.executable, os.path.join("benchmarks", "suite.py"), "--output", output]
+            command += ["--count", "3", "--sizes", "20000", "--scale", "0.01", "--repeat", "1"]
+            result = subprocess.run(command, capture_output=True, text=True, cwd=root, timeout=300)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            with open(output) as handle:
+                results = json.load(handle)["results"]
+        finally:
+            os.remove(output)
+        self.assertIn("long_slice", results)
+        self.assertIn("bed_to_fasta", results)
+        self.assertIn("bed_to_fasta_output", results)
+
+
 if __name__ == "__main__":
     unittest.main()
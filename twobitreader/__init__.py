@@ -6,19 +6,39 @@ No warranty is provided, express or implied
 """
 
 from array import array
-from bisect import bisect_right
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque, namedtuple
 from errno import ENOENT, EACCES
-from os import R_OK, access
+from functools import lru_cache, partial
+from io import BytesIO
+from itertools import islice
+from os import R_OK, access, cpu_count, remove, replace, stat
+from threading import Lock, local
+from time import perf_counter
+
+try:
+    from os import pread
+except ImportError:  # not available on Windows
+    pread = None
 
 try:
     from os import strerror
 except ImportError:
     strerror = lambda x: "strerror not supported"
-from os.path import exists, getsize
+from os.path import dirname, exists, getsize
+import argparse
 import logging
-import textwrap
+import mmap
+import re
+import struct
+import tempfile
 import sys
 
+# NumPy is slow to import, so it is imported the first time it is needed
+# (see _load_numpy); until then, and if it is not installed, numpy is None
+numpy = None
+_numpy_loaded = False
+
 at_least_py3 = at_least_py32 = False
 if sys.version_info > (3,):
     at_least_py3 = True
@@ -184,8 +204,175 @@ class _LazyTwoByteTable(object):
         return self._get_table().values()
 
 
+def create_decode_tables(complement=False):
+    """
+    create DECODE_TABLES, one bytes.translate table per base position
+    table i maps a packed byte to the i-th base (from the high bits) it encodes
+    with complement=True the tables give the complementary bases instead
+    (flipping the high bit of a 2-bit code swaps T/A and C/G)
+    """
+    flip = 0x2 if complement else 0x0
+    return tuple(bytes(ord(bits_to_base(((x >> shift) & 0x3) ^ flip)) for x in xrange(2**8)) for shift in (6, 4, 2, 0))
+
+
 BYTE_TABLE = create_byte_table()
 TWOBYTE_TABLE = _LazyTwoByteTable()
+DECODE_TABLES = create_decode_tables()
+COMPLEMENT_DECODE_TABLES = create_decode_tables(complement=True)
+# decode G and C to S (strong) and A and T to W (weak), for GC counting
+GC_DECODE_TABLES = tuple(table.translate(bytes.maketrans(b"ACGT", b"WSSW")) for table in DECODE_TABLES)
+# decode to base indices A=0, C=1, G=2, T=3 (see TwoBitSequence.get_encoded)
+INDEX_BYTES = bytes.maketrans(b"ACGT", b"\x00\x01\x02\x03")
+INDEX_DECODE_TABLES = tuple(table.translate(INDEX_BYTES) for table in DECODE_TABLES)
+COMPLEMENT_INDEX_DECODE_TABLES = tuple(table.translate(INDEX_BYTES) for table in COMPLEMENT_DECODE_TABLES)
+# the index of N in base indices
+N_INDEX = 4
+ENCODINGS = ("onehot", "int8")
+
+
+def _encoding_table(encoding, n_value, dtype):
+    """
+    NumPy lookup table from base index (A, C, G, T, N) to encoded value:
+    rows of a one-hot matrix for 'onehot', the index itself for 'int8';
+    N becomes n_value (by default a zero row for 'onehot', 4 for 'int8')
+    """
+    if encoding == "onehot":
+        table = numpy.zeros((N_INDEX + 1, 4), dtype=dtype)
+        table[numpy.arange(4), numpy.arange(4)] = 1
+        table[N_INDEX] = 0 if n_value is None else n_value
+    elif encoding == "int8":
+        table = numpy.arange(N_INDEX + 1).astype(dtype)
+        table[N_INDEX] = N_INDEX if n_value is None else n_value
+    else:
+        raise ValueError("encoding must be one of %s, not %r" % (", ".join(ENCODINGS), encoding))
+    return table
+
+
+def packed_to_bytes(packed, first_base_offset, array_size, tables=DECODE_TABLES):
+    """Decode packed 2-bit DNA to a bytearray of bases.
+
+    ``packed`` is any bytes-like object holding four bases per byte.
+    Decoding starts ``first_base_offset`` bases into the first byte and
+    yields ``array_size`` bases.
+
+    Each of the four base positions is expanded for all bytes at once with
+    ``bytes.translate`` and interleaved into the output, so no Python object
+    is created per base. The result can be edited in place and converted
+    with ``.decode("ascii")``.
+    """
+    if array_size < 0:
+        raise ValueError("array_size must be at least 0")
+    if first_base_offset < 0:
+        raise ValueError("first_base_offset must be at least 0")
+    if not isinstance(packed, bytes):
+        packed = bytes(packed)
+    if first_base_offset + array_size > 4 * len(packed):
+        raise ValueError("array_size exceeds maximum possible for input")
+    dna = bytearray(4 * len(packed))
+    _expand_into(dna, packed, tables)
+    del dna[first_base_offset + array_size :]
+    del dna[:first_base_offset]
+    return dna
+
+
+COMPLEMENT = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+COMPLEMENT_BYTES = bytes.maketrans(b"ACGTNacgtn", b"TGCANtgcan")
+
+# the bases each IUPAC code stands for
+IUPAC_CODES = {
+    "A": "A",
+    "C": "C",
+    "G": "G",
+    "T": "T",
+    "R": "AG",
+    "Y": "CT",
+    "S": "CG",
+    "W": "AT",
+    "K": "GT",
+    "M": "AC",
+    "B": "CGT",
+    "D": "AGT",
+    "H": "ACT",
+    "V": "ACG",
+    "N": "ACGT",
+}
+IUPAC_COMPLEMENT = str.maketrans("ACGTRYSWKMBDHVN", "TGCAYRSWMKVHDBN")
+
+
+def _motif_regex(pattern, allow_n=False):
+    """regex (str) matching an IUPAC pattern on upper-case bases, N too if allow_n"""
+    parts = []
+    for code in pattern:
+        if code not in IUPAC_CODES:
+            raise ValueError("%r is not an IUPAC base code" % (code,))
+        bases = IUPAC_CODES[code] + ("N" if allow_n else "")
+        parts.append(bases if len(bases) == 1 else "[%s]" % bases)
+    return "".join(parts)
+
+
+@lru_cache(maxsize=32)
+def _compile_motif(pattern, strands, exclude_n):
+    """
+    compile the search for an IUPAC pattern on strands ('both', '+' or '-')
+    returns (search, reverse_match): search finds every (overlapping) hit
+    with a lookahead, and for strands='both' group 1 is set by plus-strand
+    hits; reverse_match checks a minus-strand hit at a position
+    """
+    pattern = pattern.upper()
+    if not pattern:
+        raise ValueError("empty pattern")
+    forward = _motif_regex(pattern, not exclude_n)
+    reverse = _motif_regex(pattern.translate(IUPAC_COMPLEMENT)[::-1], not exclude_n)
+    if strands == "+":
+        return re.compile(("(?=%s)" % forward).encode("ascii")), None
+    if strands == "-":
+        return re.compile(("(?=%s)" % reverse).encode("ascii")), None
+    if strands != "both":
+        raise ValueError("strands must be 'both', '+' or '-', not %r" % (strands,))
+    search = re.compile(("(?=(%s)|%s)" % (forward, reverse)).encode("ascii"))
+    return search, re.compile(reverse.encode("ascii")).match
+
+
+def reverse_complement(seq):
+    """reverse complement a DNA string, keeping soft-masked (lower) case"""
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+@lru_cache(maxsize=8)
+def _low_bits(size):
+    """the low bit of every 2-bit code in size bytes, as an int"""
+    return int.from_bytes(b"\x55" * size, "big")
+
+
+def _expand_into(buffer, packed, tables=DECODE_TABLES):
+    """write the four bases of each byte of packed (bytes) to the start of buffer"""
+    stop = 4 * len(packed)
+    for position, table in enumerate(tables):
+        buffer[position:stop:4] = packed.translate(table)
+
+
+def _block_range(block_starts, min_, max_):
+    """
+    return (first, last) indices of the blocks that may overlap [min_, max_)
+    """
+    first_region = max(0, bisect_right(block_starts, min_) - 1)
+    last_region = min(len(block_starts), 1 + bisect_right(block_starts, max_, lo=first_region))
+    return first_region, last_region
+
+
+def _overlapping_blocks(block_starts, block_sizes, min_, max_):
+    """
+    yield (start, end) for each N-block or mask-block overlapping [min_, max_)
+    coordinates are clipped to the interval and made relative to min_
+    """
+    first_region, last_region = _block_range(block_starts, min_, max_)
+    for start, size in izip(block_starts[first_region:last_region], block_sizes[first_region:last_region]):
+        end = start + size
+        if end <= min_:
+            continue
+        if start >= max_:
+            break
+        yield max(start, min_) - min_, min(end, max_) - min_
 
 
 def longs_to_char_array(longs, first_base_offset, last_base_offset, array_size, more_bytes=None):
@@ -216,56 +403,540 @@ def longs_to_char_array(longs, first_base_offset, last_base_offset, array_size,
     if array_size > longs_len * 16 + 4 * shorts_length:
         raise ValueError("array_size exceeds maximum possible for input")
 
-    dna = list("N" * (longs_len * 16 + 4 * shorts_length))
-    # translate from 32-bit blocks to bytes
-    # this method ensures correct endianess (byteswap as neeed)
-    i = 0
-    if longs_len > 0:
-        bytes_ = array("B")
-        if at_least_py32:
-            bytes_.frombytes(longs.tobytes())
-        else:
-            bytes_.fromstring(longs.tostring())
-        # first block
-        first_block = "".join(["".join(BYTE_TABLE[bytes_[x]]) for x in range(4)])
-        i = 16 - first_base_offset
-        if array_size < i:
-            i = array_size
-        dna[0:i] = list(first_block[first_base_offset : first_base_offset + i])
-    if longs_len > 1:
-        # middle blocks (implicitly skipped if they don't exist)
-        for byte in bytes_[4:-4]:
-            dna[i : i + 4] = BYTE_TABLE[byte]
-            i += 4
-        # last block
-        last_block = list("".join(["".join(BYTE_TABLE[bytes_[x]]) for x in range(-4, 0)]))
-        if more_bytes is None:
-            dna[i : i + last_base_offset] = last_block[0:last_base_offset]
-        else:  # if there are more bytes, we need the whole last block
-            dna[i : i + 16] = last_block[0:16]
-        i += 16
+    # translate from 32-bit blocks to bytes in memory order
+    packed = longs.tobytes()
     if more_bytes is not None:
-        bytes_ = array("B")
-        if at_least_py32:
-            bytes_.frombytes(more_bytes)
+        packed += bytes(more_bytes)
+    return list(packed_to_bytes(packed, first_base_offset, array_size).decode("ascii"))
+
+
+def _read_longs(reader, offset, count, byteswapped=False):
+    """
+    read count 32-bit fields starting at offset
+    returns a memoryview over the data when no byteswapping is needed
+    (zero-copy for memory-mapped files), otherwise a byteswapped array
+    """
+    data = reader.read_at(offset, count * 4)
+    if byteswapped:
+        longs = array(LONG)
+        longs.frombytes(data)
+        longs.byteswap()
+        return longs
+    return memoryview(data).cast(LONG)
+
+
+class ByteSource(object):
+    """
+    random-access bytes that a TwoBitFile can read from instead of a
+    local file, e.g. a remote object (see twobitreader.remote.HTTPSource)
+
+    A subclass sets size (the total number of bytes) and implements
+    read_at(offset, size), which returns a bytes-like object of exactly
+    size bytes (raising EOFError past the end) and may be called from
+    several threads at once; close() releases whatever it holds. Pass an
+    instance to TwoBitFile in place of a filename.
+    >>> genome = TwoBitFile(MyObjectStoreSource('bucket', 'hg38.2bit'), lazy=True)
+    """
+
+    size = None
+    closed = False
+
+    def read_at(self, offset, size):
+        """return size bytes starting at offset"""
+        raise NotImplementedError
+
+    def close(self):
+        self.closed = True
+
+
+class _FileReader(ByteSource):
+    """
+    positional reads from an open file handle
+    uses os.pread where available so reads never depend on (or move) the
+    shared file position; otherwise seek and read happen under a lock.
+    Either way one reader can serve many threads.
+    """
+
+    def __init__(self, file_handle):
+        self._file_handle = file_handle
+        self._lock = Lock()
+        self._fileno = None
+        if pread is not None:
+            try:
+                self._fileno = file_handle.fileno()
+            except (AttributeError, IOError, ValueError):
+                pass
+
+    @property
+    def closed(self):
+        return self._file_handle.closed
+
+    def read_at(self, offset, size):
+        """return size bytes starting at offset"""
+        file_handle = self._file_handle
+        if self._fileno is None:
+            with self._lock:
+                file_handle.seek(offset)
+                data = file_handle.read(size)
+        elif file_handle.closed:
+            raise ValueError("I/O operation on closed file.")
         else:
-            bytes_.fromstring(more_bytes)
-        j = i
-        for byte in bytes_:
-            j = i + 4
-            if j > array_size:
-                dnabytes = BYTE_TABLE[byte][0 : (array_size - i)]
-                dna[i:array_size] = dnabytes
-                break
-            dna[i : i + 4] = BYTE_TABLE[byte]
-            i += 4
-    return dna[0:array_size]
+            data = pread(self._fileno, size, offset)
+            while 0 < len(data) < size:
+                more = pread(self._fileno, size - len(data), offset + len(data))
+                if not more:
+                    break
+                data += more
+        if len(data) < size:
+            raise EOFError("read beyond end of file")
+        return data
+
+    def close(self):
+        self._file_handle.close()
+
+
+class _MmapReader(ByteSource):
+    """
+    positional reads from a read-only memory map of an open file handle
+    read_at returns memoryview slices of the mapping (no copy is made)
+    """
+
+    def __init__(self, file_handle):
+        self._file_handle = file_handle
+        self._map = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+    @property
+    def closed(self):
+        return self._view is None
+
+    def read_at(self, offset, size):
+        """return a memoryview of size bytes starting at offset"""
+        view = self._view
+        if view is None:
+            raise ValueError("I/O operation on closed file.")
+        data = view[offset : offset + size]
+        if len(data) < size:
+            raise EOFError("read beyond end of file")
+        return data
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+            try:
+                self._map.close()
+            except BufferError:
+                # sequence tables still hold views of the mapping; it is
+                # unmapped once they are garbage collected
+                pass
+        self._file_handle.close()
+
+
+# regions overlapping more blocks than this are masked with NumPy (if enabled)
+NUMPY_BLOCK_THRESHOLD = 64
+# default number of bases decoded at a time by TwoBitSequence.iter_chunks
+ITER_CHUNK_SIZE = 1 << 20
+# fetch_many merges intervals separated by at most this many bases
+FETCH_MANY_MAX_GAP = 1024
+# ... as long as the merged read stays below this many bases
+FETCH_MANY_MAX_SPAN = 1 << 20
+# how soft-masked (repeat) regions are returned, see TwoBitSequence.get_slice
+MASK_POLICIES = ("soft", "ignore", "hard", "bitmap")
+
+
+def _check_mask(mask):
+    """raise ValueError for an unknown mask policy"""
+    if mask not in MASK_POLICIES:
+        raise ValueError("mask must be one of %s, not %r" % (", ".join(MASK_POLICIES), mask))
+
+
+def _numpy_block_mask(block_starts, block_sizes, min_, max_):
+    """
+    boolean NumPy array marking the positions of [min_, max_) covered by blocks
+    built with one vectorized run expansion instead of a loop over the blocks
+    """
+    first_region, last_region = _block_range(block_starts, min_, max_)
+    size = max_ - min_
+    starts = numpy.asarray(block_starts[first_region:last_region], dtype=numpy.int64)
+    ends = starts + numpy.asarray(block_sizes[first_region:last_region], dtype=numpy.int64)
+    # blocks are sorted and disjoint, so their edges split [min_, max_) into
+    # alternating uncovered and covered runs
+    edges = numpy.empty(2 * len(starts) + 2, dtype=numpy.int64)
+    edges[0] = 0
+    edges[1:-1:2] = starts - min_
+    edges[2:-1:2] = ends - min_
+    edges[-1] = size
+    numpy.clip(edges, 0, size, out=edges)
+    run_lengths = numpy.diff(edges)
+    if (run_lengths < 0).any():
+        # overlapping blocks: count block starts and ends instead
+        counts = numpy.zeros(size + 1, dtype=numpy.int32)
+        numpy.add.at(counts, edges[1:-1:2], 1)
+        numpy.add.at(counts, edges[2:-1:2], -1)
+        return numpy.cumsum(counts[:size]) > 0
+    covered = numpy.zeros(len(run_lengths), dtype=bool)
+    covered[1::2] = True
+    return numpy.repeat(covered, run_lengths)
+
+
+def _numpy_gc_fractions(codes, window_starts, offset, window):
+    """
+    GC fraction (nan if all N) of each window of the S/W/N codes, for
+    windows starting at window_starts (a range; codes[0] is at offset)
+    every window is summed as the difference of two prefix sums, taken at
+    the sorted window starts and ends with one add.reduceat
+    """
+    codes = numpy.frombuffer(codes, dtype=numpy.uint8)
+    starts = numpy.arange(window_starts[0], window_starts[-1] + 1, window_starts.step, dtype=numpy.int64) - offset
+    ends = numpy.minimum(starts + window, len(codes))
+    if window_starts.step == window:
+        # adjacent windows: each end is the next start
+        points = numpy.append(starts, ends[-1])
+        first = numpy.arange(len(starts))
+        last = first + 1
+    else:
+        points = numpy.union1d(starts, ends)
+        first = numpy.searchsorted(points, starts)
+        last = numpy.searchsorted(points, ends)
+
+    def window_sums(indicator):
+        # a chunk is short enough for 32-bit sums
+        prefix = numpy.zeros(len(points), dtype=numpy.int64)
+        numpy.cumsum(numpy.add.reduceat(indicator.view(numpy.uint8), points[:-1], dtype=numpy.int32), out=prefix[1:])
+        return prefix[last] - prefix[first]
+
+    strong = window_sums(codes == ord("S"))
+    called = (ends - starts) - window_sums(codes == ord("N"))
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return strong / called
+
+
+def _load_numpy():
+    """import NumPy on first use, returning it (or None if it is not installed)"""
+    global numpy, _numpy_loaded
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+
+def _resolve_use_numpy(use_numpy):
+    """None selects NumPy when it is importable; True requires it"""
+    if use_numpy is None:
+        return _load_numpy() is not None
+    if use_numpy and _load_numpy() is None:
+        raise ImportError("use_numpy=True requires numpy")
+    return bool(use_numpy)
+
+
+# TwoBitFile caches decoded sequence in blocks of this many bases
+CACHE_BLOCK_SIZE = 4096
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "currsize", "maxsize"])
+
+
+class BlockCache(object):
+    """
+    LRU cache of decoded, fixed-size, aligned sequence blocks
+    shared by all TwoBitSequence objects of a TwoBitFile
+
+    maxsize is the budget in bytes (one byte per cached base); the least
+    recently used blocks are evicted once it is exceeded. Blocks hold the
+    bases before N-blocks and mask-blocks are applied.
+    """
+
+    def __init__(self, maxsize, block_size=CACHE_BLOCK_SIZE):
+        if block_size < 4 or block_size % 4:
+            raise ValueError("block_size must be a positive multiple of 4")
+        if maxsize < block_size:
+            # every block would be evicted as soon as it was stored
+            raise ValueError("cache size %d is smaller than one %d-base block" % (maxsize, block_size))
+        self.maxsize = maxsize
+        self.block_size = block_size
+        self.hits = self.misses = self.evictions = 0
+        self._size = 0
+        self._blocks = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        """return the cached block for key (or None), counting a hit or miss"""
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._blocks.move_to_end(key)
+            return block
+
+    def put(self, key, block):
+        """add a block, evicting least recently used blocks to stay in budget"""
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = block
+            self._size += len(block)
+            while self._size > self.maxsize and self._blocks:
+                _, evicted = self._blocks.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def info(self):
+        """return hit, miss and eviction counters and the current size as a CacheInfo"""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self._size, self.maxsize)
+
+    def clear(self):
+        """drop all blocks and reset the counters"""
+        with self._lock:
+            self._blocks.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+
+# counters and cumulative seconds per phase kept by TwoBitFile(stats=True)
+STATS_FIELDS = (
+    "reads",
+    "seeks",
+    "bytes_read",
+    "slices",
+    "bases_returned",
+    "bases_decoded",
+    "n_blocks",
+    "mask_blocks",
+    "read_seconds",
+    "decode_seconds",
+    "blocks_seconds",
+    "slice_seconds",
+)
+StatsInfo = namedtuple("StatsInfo", STATS_FIELDS)
+
+
+class _Stats(object):
+    """
+    accumulates StatsInfo counters for a TwoBitFile opened with stats=True
+
+    While a get_slice call is running its counters are gathered in a
+    per-thread record, which is added to the totals (under one lock) and
+    handed to the hook when the call returns; counts made outside get_slice
+    go to the totals directly.
+    """
+
+    def __init__(self, hook=None):
+        self._hook = hook
+        self._lock = Lock()
+        self._local = local()
+        self._totals = dict.fromkeys(STATS_FIELDS, 0)
+
+    def add(self, **values):
+        record = getattr(self._local, "record", None)
+        if record is None:
+            with self._lock:
+                totals = self._totals
+                for field, value in iteritems(values):
+                    totals[field] += value
+            return
+        for field, value in iteritems(values):
+            record[field] += value
+
+    def begin(self):
+        """start a record for a get_slice call (None if one is already running)"""
+        if getattr(self._local, "record", None) is not None:
+            return None
+        record = self._local.record = dict.fromkeys(STATS_FIELDS, 0)
+        return record
+
+    def end(self, record):
+        """add a finished record to the totals and pass it to the hook"""
+        self._local.record = None
+        with self._lock:
+            totals = self._totals
+            for field, value in iteritems(record):
+                totals[field] += value
+        if self._hook is not None:
+            self._hook(StatsInfo(**record))
+
+    def info(self):
+        with self._lock:
+            return StatsInfo(**self._totals)
+
+    def clear(self):
+        with self._lock:
+            self._totals = dict.fromkeys(STATS_FIELDS, 0)
+
+
+class _StatsReader(object):
+    """
+    wraps a positional reader, counting reads, bytes and time spent reading;
+    a read that does not start where the previous one ended (in any thread)
+    counts as a seek
+    """
+
+    def __init__(self, reader, stats):
+        self._reader = reader
+        self._stats = stats
+        self._lock = Lock()
+        self._next_offset = None
+
+    @property
+    def closed(self):
+        return self._reader.closed
+
+    def read_at(self, offset, size):
+        started = perf_counter()
+        data = self._reader.read_at(offset, size)
+        elapsed = perf_counter() - started
+        with self._lock:
+            seek = offset != self._next_offset
+            self._next_offset = offset + size
+        stats = self._stats
+        # lets _StatsTwoBitSequence._read_bases tell reading from decoding
+        stats._local.last_read_seconds = elapsed
+        stats.add(reads=1, seeks=seek, bytes_read=size, read_seconds=elapsed)
+        return data
+
+    def close(self):
+        self._reader.close()
+
+
+# a FilePool keeps at most this many files open by default
+POOL_MAX_OPEN = 64
+
+PoolInfo = namedtuple("PoolInfo", ["opens", "evictions", "currsize", "maxsize"])
+
+
+class FilePool(object):
+    """
+    bounded LRU pool of open file handles, shared by the TwoBitFile objects
+    opened with pool=...
+
+    A file is opened when it is read and stays open until max_open other
+    files are open and it is the least recently used one (files being read
+    at that moment are never closed). Its TwoBitFile keeps the name index
+    and sequence tables meanwhile, so reopening costs one open() call.
+    """
+
+    def __init__(self, max_open=POOL_MAX_OPEN):
+        if max_open < 1:
+            raise ValueError("max_open must be at least 1")
+        self.max_open = max_open
+        self.opens = self.evictions = 0
+        # _PooledReader -> [_FileReader, number of reads in progress, discarded]
+        self._open = OrderedDict()
+        self._lock = Lock()
+
+    def __reduce__(self):
+        # open handles are not pickled; a copy starts empty
+        return (FilePool, (self.max_open,))
+
+    def read_at(self, pooled, offset, size):
+        """read from the file of a _PooledReader, opening it if needed"""
+        with self._lock:
+            entry = self._open.get(pooled)
+            if entry is None:
+                self._make_room()
+                entry = self._open[pooled] = [_FileReader(open(pooled._filename, "rb")), 0, False]
+                self.opens += 1
+            else:
+                self._open.move_to_end(pooled)
+            entry[1] += 1
+        try:
+            return entry[0].read_at(offset, size)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                close = entry[2] and entry[1] == 0
+            if close:
+                entry[0].close()
+
+    def _make_room(self):
+        """close least recently used idle files until another can be opened"""
+        if len(self._open) < self.max_open:
+            return
+        for pooled, (reader, users, _) in list(self._open.items()):
+            if users == 0:
+                del self._open[pooled]
+                reader.close()
+                self.evictions += 1
+                if len(self._open) < self.max_open:
+                    return
+
+    def discard(self, pooled):
+        """
+        close the file of a _PooledReader, if it is open (once the reads in
+        progress on it have finished)
+        """
+        with self._lock:
+            entry = self._open.pop(pooled, None)
+            if entry is None:
+                return
+            # the last read in progress closes it
+            entry[2] = True
+            if entry[1] > 0:
+                return
+        entry[0].close()
+
+    def info(self):
+        """return opens, evictions and the number of open files as a PoolInfo"""
+        with self._lock:
+            return PoolInfo(self.opens, self.evictions, len(self._open), self.max_open)
+
+
+class _PooledReader(ByteSource):
+    """positional reads of one file through a FilePool"""
+
+    def __init__(self, pool, filename):
+        self._pool = pool
+        self._filename = filename
+        self.closed = False
+
+    def read_at(self, offset, size):
+        """return size bytes starting at offset"""
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        return self._pool.read_at(self, offset, size)
+
+    def close(self):
+        self.closed = True
+        self._pool.discard(self)
+
+
+# the name index is read this many bytes at a time
+INDEX_READ_SIZE = 1 << 16
+
+# sidecar index files are named <file>.2bit + SIDECAR_SUFFIX by default
+SIDECAR_SUFFIX = ".tbi2"
+SIDECAR_MAGIC = b"TBI2"
+SIDECAR_VERSION = 1
+# magic, signature (byte order check), version, sequence count,
+# source size, source mtime (ns), source byteswapped, reserved
+SIDECAR_HEADER = struct.Struct("=4sIIIQqII")
+
+
+def _padded(data):
+    """pad bytes to a multiple of 8 so the next section stays aligned"""
+    return data + b"\0" * (-len(data) % 8)
+
+
+class _NotLoaded(object):
+    """placeholder for sequences that a lazy TwoBitFile has not built yet"""
+
+    def __repr__(self):
+        return "<not loaded>"
+
+
+_NOT_LOADED = _NotLoaded()
 
 
 class TwoBitFile(dict):
     """
     python-level reader for .2bit files (i.e., from UCSC genome browser)
-    (note: no writing support)
+    (to write .2bit files, see twobitreader.write)
 
     TwoBitFile inherits from dict
     You may access sequences by name, e.g.
@@ -281,30 +952,245 @@ class TwoBitFile(dict):
     >>> whole_chr20 = str(chr20)
 
     Fair warning: dumping the entire chromosome requires a lot of memory
+    (iter_chunks() streams a sequence in constant memory instead)
 
     See TwoBitSequence for more info.
 
+    Reads are position-independent, so one TwoBitFile (and its
+    TwoBitSequence objects) can be shared by many threads.
+
     TwoBitFile is also a context manager:
     >>> with TwoBitFile('hg18.2bit') as genome:
     >>>    seq = genome['chr20'][100100:100120]
+
+    Pass lazy=True to read only the header and name index when opening.
+    Each TwoBitSequence (with its N-block and mask-block tables) is then
+    built the first time it is looked up, so opening an assembly with many
+    scaffolds stays cheap. len(), keys() and "in" never touch the sequence
+    records.
+    >>> genome = TwoBitFile('draft.2bit', lazy=True)
+
+    Pass mmap=True to memory-map the file instead of using buffered reads.
+    Packed DNA and the N-block and mask-block tables are then read as
+    zero-copy views of the mapping, and processes opening the same genome
+    share the operating system's page cache.
+    >>> genome = TwoBitFile('hg18.2bit', mmap=True)
+
+    If NumPy is importable it is used to apply N-blocks and mask-blocks to
+    regions that overlap many of them, and to return slices as uint8 arrays
+    (see TwoBitSequence.get_slice). Pass use_numpy=False to always use the
+    pure-Python decoder, or use_numpy=True to require NumPy.
+
+    Pass cache_size (in bytes) to keep recently decoded sequence in an LRU
+    cache of cache_block_size-base blocks shared by all sequences of the
+    file. Overlapping slices are then assembled from cached blocks instead
+    of being read and decoded again; see cache_info() for hit, miss and
+    eviction counts. Slices larger than the cache bypass it. cache_size
+    must hold at least one block.
+    >>> genome = TwoBitFile('hg18.2bit', cache_size=64 * 1024 * 1024)
+
+    Pass sidecar=True to keep a persistent index next to the file
+    (hg18.2bit.tbi2, or give the path instead of True). It holds the names,
+    offsets, sizes and N-block and mask-block tables, plus the size and
+    modification time of the .2bit file. The first open writes it; later
+    opens load it with a single read instead of parsing the name index and
+    every sequence record. A stale or unreadable sidecar is rebuilt.
+    >>> genome = TwoBitFile('hg18.2bit', sidecar=True, lazy=True)
+
+    Pass mask to choose how soft-masked regions are returned by default:
+    'soft' (lower case, the default), 'ignore' (upper case only), 'hard'
+    (replaced by N) or 'bitmap' (upper case, with the mask returned
+    separately); see TwoBitSequence.get_slice.
+    >>> genome = TwoBitFile('hg18.2bit', mask='ignore')
+
+    Pass stats=True to count reads, seeks, bytes read, slices, bases
+    decoded and N-blocks and mask-blocks applied, and to time the read,
+    decode and block phases of get_slice; see stats(). stats_hook (which
+    implies stats=True) is called with a StatsInfo for each get_slice call,
+    e.g. to export them to a metrics system. Without stats nothing is
+    counted and slicing runs exactly as before.
+    >>> genome = TwoBitFile('hg18.2bit', stats_hook=lambda s: histogram.observe(s.slice_seconds))
+
+    Pass a FilePool as pool to share a bounded number of open files with
+    other TwoBitFile objects: the file is then opened only while it is
+    being read (and reopened on demand), which lets one process work with
+    thousands of .2bit files; see also twobitreader.collection. A pooled
+    file is not memory-mapped.
+    >>> pool = FilePool(max_open=128)
+    >>> genomes = [TwoBitFile(path, lazy=True, pool=pool) for path in paths]
+
+    foo may also be an http:// or https:// URL, read with HTTP range
+    requests (see twobitreader.remote), or any other ByteSource; the
+    source is closed with the TwoBitFile. Open remote files with
+    lazy=True, so that only the sequences you use are fetched.
+    >>> genome = TwoBitFile('https://example.org/hg38.2bit', lazy=True)
     """
 
-    def __init__(self, foo):
+    def __init__(
+        self,
+        foo,
+        lazy=False,
+        mmap=False,
+        use_numpy=None,
+        cache_size=0,
+        cache_block_size=CACHE_BLOCK_SIZE,
+        sidecar=False,
+        mask="soft",
+        stats=False,
+        stats_hook=None,
+        pool=None,
+    ):
         super(TwoBitFile, self).__init__()
         self._file_handle = None  # for __del__ if checks fail
-        if not exists(foo):
+        self._reader = None
+        # options are checked before a remote source is opened
+        _check_mask(mask)
+        is_url = isinstance(foo, str) and foo.startswith(("http://", "https://"))
+        if is_url or isinstance(foo, ByteSource):
+            if mmap or sidecar or pool is not None:
+                raise ValueError("mmap, sidecar and pool need a local file")
+            if is_url:
+                from twobitreader.remote import HTTPSource
+
+                foo = HTTPSource(foo)
+        elif not exists(foo):
             raise IOError(ENOENT, strerror(ENOENT), foo)
-        if not access(foo, R_OK):
+        elif not access(foo, R_OK):
             raise IOError(EACCES, strerror(EACCES), foo)
         self._filename = foo
-        self._file_size = getsize(foo)
-        self._file_handle = open(foo, "rb")
+        self._options = dict(
+            lazy=lazy,
+            mmap=mmap,
+            use_numpy=use_numpy,
+            cache_size=cache_size,
+            cache_block_size=cache_block_size,
+            sidecar=sidecar,
+            mask=mask,
+            stats=stats,
+            stats_hook=stats_hook,
+            pool=pool,
+        )
+        if pool is not None and mmap:
+            raise ValueError("a pooled file cannot be memory-mapped")
+        self._mask = mask
+        self._use_numpy = _resolve_use_numpy(use_numpy)
+        self._cache = None
+        if cache_size > 0:
+            self._cache = BlockCache(cache_size, cache_block_size)
+        if isinstance(foo, ByteSource):
+            self._file_size = foo.size
+            self._reader = foo
+        elif pool is not None:
+            self._file_size = getsize(foo)
+            self._reader = _PooledReader(pool, foo)
+        else:
+            self._file_size = getsize(foo)
+            self._file_handle = open(foo, "rb")
+            if mmap and self._file_size > 0:
+                self._reader = _MmapReader(self._file_handle)
+            else:
+                self._reader = _FileReader(self._file_handle)
+        self._stats = None
+        if stats or stats_hook is not None:
+            self._stats = _Stats(stats_hook)
+            self._reader = _StatsReader(self._reader, self._stats)
         self._load_header()
-        self._load_index()
-        for name, offset in iteritems(self._offset_dict):
-            self[name] = TwoBitSequence(self._file_handle, offset, self._file_size, self._byteswapped)
+        self._sidecar = None
+        if sidecar is True:
+            sidecar = foo + SIDECAR_SUFFIX
+        if not (sidecar and self._load_sidecar(sidecar)):
+            self._load_index()
+        for name in self._offset_dict:
+            if lazy:
+                dict.__setitem__(self, name, _NOT_LOADED)
+            else:
+                self[name] = self._load_sequence(name)
+        if sidecar and self._sidecar is None:
+            self._write_sidecar(sidecar)
         return
 
+    def _load_sequence(self, name):
+        """build the TwoBitSequence for name and store it"""
+        sequence = self._new_sequence(name)
+        dict.__setitem__(self, name, sequence)
+        return sequence
+
+    def _new_sequence(self, name):
+        """build the TwoBitSequence for name from the sidecar or its record"""
+        tables = None
+        if self._sidecar is not None:
+            tables = self._sidecar_tables(name)
+        options = {}
+        sequence_class = TwoBitSequence
+        if self._stats is not None:
+            options["stats"] = self._stats
+            sequence_class = _StatsTwoBitSequence
+        return sequence_class(
+            self._reader,
+            self._offset_dict[name],
+            self._file_size,
+            self._byteswapped,
+            use_numpy=self._use_numpy,
+            cache=self._cache,
+            tables=tables,
+            mask=self._mask,
+            **options,
+        )
+
+    def _load_all(self):
+        """build every sequence that has not been loaded yet (lazy mode)"""
+        for name, sequence in list(dict.items(self)):
+            if sequence is _NOT_LOADED:
+                self._load_sequence(name)
+
+    def __getitem__(self, name):
+        sequence = dict.__getitem__(self, name)
+        if sequence is _NOT_LOADED:
+            sequence = self._load_sequence(name)
+        return sequence
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        return default
+
+    def pop(self, name, *default):
+        if name in self:
+            self[name]
+        return dict.pop(self, name, *default)
+
+    def setdefault(self, name, default=None):
+        if name in self:
+            return self[name]
+        return dict.setdefault(self, name, default)
+
+    def popitem(self):
+        name, sequence = dict.popitem(self)
+        if sequence is _NOT_LOADED:
+            sequence = self._new_sequence(name)
+        return name, sequence
+
+    def values(self):
+        self._load_all()
+        return dict.values(self)
+
+    def items(self):
+        self._load_all()
+        return dict.items(self)
+
+    def copy(self):
+        """a plain dict of every sequence"""
+        return dict(self.items())
+
+    def __iter__(self):
+        # overriding __iter__ makes dict(genome) and {**genome} go through
+        # keys() and __getitem__ rather than copying the placeholders
+        return dict.__iter__(self)
+
+    def __repr__(self):
+        self._load_all()
+        return dict.__repr__(self)
+
     def __enter__(self):
         return self
 
@@ -314,19 +1200,155 @@ class TwoBitFile(dict):
     def close(self):
         """close the underlying two-bit file"""
         # attempts to access after this results in a ValueError
-        self._file_handle.close()
+        if self._reader is not None:
+            self._reader.close()
+        else:
+            self._file_handle.close()
 
     def __del__(self):
-        if self._file_handle is not None:
+        if self._reader is not None or self._file_handle is not None:
             self.close()
 
     def __reduce__(self):  # enables pickling
-        return (TwoBitFile, (self._filename,))
+        # a stats hook (often a lambda) could not report back from another
+        # process, and a pool holds open files, so neither is pickled; the
+        # copy keeps its own counters and opens its file directly
+        options = dict(self._options, stats_hook=None, pool=None)
+        options["stats"] = self._stats is not None
+        return (partial(TwoBitFile, **options), (self._filename,))
+
+    def fill_encoded(self, intervals, out, encoding="onehot", n_value=None, reverse_complement=False):
+        """
+        encode a batch of intervals into the NumPy array out, which is
+        (batch, length, 4) for 'onehot' or (batch, length) for 'int8'
+        (see TwoBitSequence.get_encoded), and return out
+
+        intervals are (chrom, start, end) or (chrom, start, end, strand)
+        tuples, one per row, no longer than length; shorter intervals are
+        padded with N. reverse_complement (True, or one flag per row, e.g.
+        for random augmentation) reverse-complements rows on top of their
+        strand. Bases are decoded from the packed bytes to indices and
+        written through out.dtype lookup tables, one take() per row.
+        >>> batch = numpy.empty((64, 1000, 4), dtype=numpy.float32)
+        >>> genome.fill_encoded(intervals, batch, reverse_complement=flips)
+        """
+        if _load_numpy() is None:
+            raise ImportError("fill_encoded requires numpy")
+        table = _encoding_table(encoding, n_value, out.dtype)
+        if out.ndim != (3 if encoding == "onehot" else 2) or (encoding == "onehot" and out.shape[2] != 4):
+            raise ValueError("out must be (batch, length, 4) for 'onehot' or (batch, length) for 'int8'")
+        intervals = list(intervals)
+        if len(intervals) != out.shape[0]:
+            raise ValueError("got %d intervals for a batch of %d" % (len(intervals), out.shape[0]))
+        if numpy.ndim(reverse_complement) == 0:
+            reverse_complement = [reverse_complement] * len(intervals)
+        length = out.shape[1]
+        for row, (interval, flip) in enumerate(izip(intervals, reverse_complement)):
+            chrom, start, end = interval[:3]
+            strand = interval[3] if len(interval) > 3 else "+"
+            if strand not in ("+", "-", "."):
+                raise ValueError("strand must be '+', '-' or '.', not %r" % (strand,))
+            sequence = self[chrom]
+            start, end = sequence._normalize_range(start, end)
+            if end - start > length:
+                raise ValueError("interval %r is longer than %d" % (interval, length))
+            indices = numpy.frombuffer(sequence._base_indices(start, end, (strand == "-") != bool(flip)), dtype=numpy.uint8)
+            table.take(indices, axis=0, out=out[row, : end - start])
+            if end - start < length:
+                out[row, end - start :] = table[N_INDEX]
+        return out
+
+    def find(self, pattern, strands="both", exclude_n=True, exclude_masked=False, names=None, jobs=1):
+        """
+        yield every hit of an exact or IUPAC pattern (e.g. 'NGG' or
+        'GAATTC') as (chrom, start, end, strand), in file order (or the
+        order of names) and by position; overlapping hits are all reported
+
+        strands is 'both', '+' or '-'; minus-strand hits are hits of the
+        reverse complement of the pattern. Hits with a base in an N-block
+        are skipped unless exclude_n=False (N then matches any code), and
+        with exclude_masked=True so are hits with a soft-masked base.
+
+        Each sequence is searched in ITER_CHUNK_SIZE-base chunks that
+        overlap by len(pattern) - 1 bases, so no hit is missed at a chunk
+        boundary and memory use does not depend on the sequence length.
+        With jobs > 1 (0 for one per CPU) chunks are searched on a pool of
+        worker processes.
+        >>> for chrom, start, end, strand in genome.find('NGG', jobs=8):
+        """
+        # compile and split into chunks here (find itself is not a
+        # generator), so bad arguments fail at the call
+        _compile_motif(pattern, strands, exclude_n)
+        if names is None:
+            names = list(self.keys())
+        tasks = []
+        for name in names:
+            size = len(self[name])
+            tasks.extend((name, start, min(start + ITER_CHUNK_SIZE, size)) for start in xrange(0, size, ITER_CHUNK_SIZE))
+        motif = (pattern, strands, exclude_n, exclude_masked)
+        if jobs < 1:
+            jobs = cpu_count() or 1
+        return self._find_hits(tasks, motif, jobs)
+
+    def _find_hits(self, tasks, motif, jobs):
+        """yield the hits of find for (name, start, end) chunks"""
+        if jobs == 1:
+            for name, start, end in tasks:
+                for hit in _motif_hits(self[name], name, start, end, *motif):
+                    yield hit
+            return
+        from concurrent.futures import ProcessPoolExecutor
+
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(self,)) as executor:
+            for name, start, end in tasks:
+                pending.append(executor.submit(_worker_motif_hits, name, start, end, *motif))
+                if len(pending) >= 2 * jobs:
+                    for hit in pending.popleft().result():
+                        yield hit
+            while pending:
+                for hit in pending.popleft().result():
+                    yield hit
+
+    def cache_info(self):
+        """
+        return (hits, misses, evictions, currsize, maxsize) for the decoded
+        block cache as a CacheInfo named tuple (all zero without a cache)
+        """
+        if self._cache is None:
+            return CacheInfo(0, 0, 0, 0, 0)
+        return self._cache.info()
+
+    def cache_clear(self):
+        """empty the decoded block cache and reset its counters"""
+        if self._cache is not None:
+            self._cache.clear()
+
+    def stats(self):
+        """
+        return the counters and cumulative phase timings (in seconds) as a
+        StatsInfo named tuple (all zero unless opened with stats=True)
+
+        reads, seeks, bytes_read and read_seconds cover every read of the
+        file. slices, bases_returned and slice_seconds count get_slice calls
+        (and so slicing, str(), fetch_many and BED extraction); the decode
+        and block counters also include other decoding, such as gc_profile.
+        bases_decoded excludes bases served from the block cache, and
+        decode_seconds excludes reading.
+        >>> genome.stats()._asdict()
+        """
+        if self._stats is None:
+            return StatsInfo(*[0] * len(STATS_FIELDS))
+        return self._stats.info()
+
+    def stats_clear(self):
+        """reset the counters and timings"""
+        if self._stats is not None:
+            self._stats.clear()
 
     def _load_header(self):
-        file_handle = self._file_handle
         header = array(LONG)
-        header.fromfile(file_handle, 4)
+        header.frombytes(self._reader.read_at(0, 16))
         # check signature -- must be 0x1A412743
         # if not, swap bytes
         byteswapped = False
@@ -337,53 +1359,248 @@ class TwoBitFile(dict):
             signature2, version, sequence_count, reserved = header
             if not signature2 == 0x1A412743:
                 raise TwoBitFileError("Signature in header should be " + "0x1A412743, instead found 0x%X" % signature)
-        if not version == 0:
-            raise TwoBitFileError("File version in header should be 0.")
+        # version 1 files use 64-bit offsets in the index (for files over 4 GB)
+        if not version in (0, 1):
+            raise TwoBitFileError("File version in header should be 0 or 1.")
         if not reserved == 0:
             raise TwoBitFileError("Reserved field in header should be 0.")
         self._byteswapped = byteswapped
+        self._version = version
         self._sequence_count = sequence_count
 
     def _load_index(self):
-        file_handle = self._file_handle
-        byteswapped = self._byteswapped
+        read_at = self._reader.read_at
+        offset_type = "Q" if self._version == 1 else "I"
+        if self._byteswapped:
+            offset_field = struct.Struct((">" if sys.byteorder == "little" else "<") + offset_type)
+        else:
+            offset_field = struct.Struct("=" + offset_type)
         remaining = self._sequence_count
         sequence_offsets = []
-        file_handle.seek(16)
+        # the index is read INDEX_READ_SIZE bytes at a time into data,
+        # which starts at file position position; i is the parse position
+        data = b""
+        position = 16
+        i = 0
         while remaining > 0:
-            name_size = array("B")
-            name_size.fromfile(file_handle, 1)
-            if byteswapped:
-                name_size.byteswap()
-            name = array("B")
-            name.fromfile(file_handle, name_size[0])
-            name = "".join([chr(X) for X in name])
-
-            if byteswapped:
-                name.byteswap()
-            offset = array(LONG)
-            offset.fromfile(file_handle, 1)
-            if byteswapped:
-                offset.byteswap()
-            sequence_offsets.append((name, offset[0]))
+            if len(data) - i < 1 + 255 + offset_field.size:
+                available = self._file_size - position - len(data)
+                if available > 0:
+                    more = read_at(position + len(data), min(INDEX_READ_SIZE, available))
+                    data = data[i:] + bytes(more)
+                    position += i
+                    i = 0
+            if i >= len(data) or i + 1 + data[i] + offset_field.size > len(data):
+                raise EOFError("read beyond end of file")
+            name_size = data[i]
+            name = data[i + 1 : i + 1 + name_size].decode("ascii")
+            i += 1 + name_size
+            (offset,) = offset_field.unpack_from(data, i)
+            i += offset_field.size
+            sequence_offsets.append((name, offset))
             remaining -= 1
         self._sequence_offsets = sequence_offsets
         self._offset_dict = dict(sequence_offsets)
 
+    def _load_sidecar(self, path):
+        """
+        load the name index and sequence tables from a sidecar index
+        returns False if it is missing, unreadable or out of date
+        """
+        try:
+            with open(path, "rb") as handle:
+                data = handle.read()
+            source = stat(self._filename)
+        except (IOError, OSError):
+            return False
+        if len(data) < SIDECAR_HEADER.size:
+            return False
+        magic, signature, version, count, size, mtime_ns, byteswapped, _ = SIDECAR_HEADER.unpack_from(data)
+        if (
+            magic != SIDECAR_MAGIC
+            or signature != 0x1A412743
+            or version != SIDECAR_VERSION
+            or count != self._sequence_count
+            or size != source.st_size
+            or mtime_ns != source.st_mtime_ns
+            or byteswapped != self._byteswapped
+        ):
+            return False
+        try:
+            view = memoryview(data)
+            position = SIDECAR_HEADER.size
+            sections = []
+            # per-sequence arrays, then the concatenated tables
+            for typecode, length in [("Q", count), ("Q", count), ("Q", count + 1), ("Q", count + 1), ("Q", count + 1)]:
+                sections.append(view[position : position + 8 * length].cast(typecode))
+                position += 8 * length
+            offsets, dna_sizes, n_first, mask_first, name_first = sections
+            for length in [n_first[count], n_first[count], mask_first[count], mask_first[count]]:
+                sections.append(view[position : position + 4 * length].cast(LONG))
+                position += 4 * length + (-4 * length % 8)
+            names = view[position : position + name_first[count]]
+            if len(names) != name_first[count]:
+                return False
+        except (IndexError, TypeError, ValueError):
+            return False
+        self._sidecar = sections
+        names = bytes(names).decode("ascii")
+        name_first = name_first.tolist()
+        names = [names[start:end] for start, end in izip(name_first, name_first[1:])]
+        self._sidecar_index = dict(izip(names, xrange(count)))
+        sequence_offsets = list(izip(names, offsets.tolist()))
+        self._sequence_offsets = sequence_offsets
+        self._offset_dict = dict(sequence_offsets)
+        return True
+
+    def _sidecar_tables(self, name):
+        """(dna_size, n_starts, n_sizes, mask_starts, mask_sizes) from the sidecar"""
+        _, dna_sizes, n_first, mask_first, _, n_starts, n_sizes, mask_starts, mask_sizes = self._sidecar
+        i = self._sidecar_index[name]
+        n_slice = slice(n_first[i], n_first[i + 1])
+        mask_slice = slice(mask_first[i], mask_first[i + 1])
+        return dna_sizes[i], n_starts[n_slice], n_sizes[n_slice], mask_starts[mask_slice], mask_sizes[mask_slice]
+
+    def _write_sidecar(self, path):
+        """write the sidecar index, logging a warning if that fails"""
+        count = len(self._sequence_offsets)
+        offsets = array("Q")
+        dna_sizes = array("Q")
+        n_first = array("Q", [0])
+        mask_first = array("Q", [0])
+        name_first = array("Q", [0])
+        tables = [array(LONG) for _ in range(4)]
+        names = []
+        for name, offset in self._sequence_offsets:
+            sequence = dict.__getitem__(self, name)
+            if sequence is _NOT_LOADED:
+                sequence = self._new_sequence(name)
+            offsets.append(offset)
+            dna_sizes.append(sequence._dna_size)
+            for table, values in zip(
+                tables,
+                [
+                    sequence._n_block_starts,
+                    sequence._n_block_sizes,
+                    sequence._mask_block_starts,
+                    sequence._mask_block_sizes,
+                ],
+            ):
+                table.frombytes(values.tobytes())
+            n_first.append(len(tables[0]))
+            mask_first.append(len(tables[2]))
+            names.append(name.encode("ascii"))
+            name_first.append(name_first[-1] + len(names[-1]))
+        source = stat(self._filename)
+        header = SIDECAR_HEADER.pack(
+            SIDECAR_MAGIC,
+            0x1A412743,
+            SIDECAR_VERSION,
+            count,
+            source.st_size,
+            source.st_mtime_ns,
+            self._byteswapped,
+            0,
+        )
+        parts = [header] + [_padded(section.tobytes()) for section in [offsets, dna_sizes, n_first, mask_first, name_first]]
+        parts += [_padded(table.tobytes()) for table in tables]
+        parts.append(b"".join(names))
+        # write to a temporary file first so readers never see a partial index
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix=".tbi2-", dir=dirname(path) or ".")
+            with open(fd, "wb") as handle:
+                handle.write(b"".join(parts))
+            replace(temp_path, path)
+        except (IOError, OSError) as error:
+            logging.warning("Could not write sidecar index %s: %s", path, error)
+            if temp_path is not None and exists(temp_path):
+                remove(temp_path)
+
     def sequence_sizes(self):
         """returns a dictionary with the sizes of each sequence"""
+        if self._sidecar is not None:
+            dna_sizes = self._sidecar[1]
+            return dict((name, dna_sizes[self._sidecar_index[name]]) for name in self._offset_dict)
         d = {}
-        file_handle = self._file_handle
+        reader = self._reader
         byteswapped = self._byteswapped
         for name, offset in iteritems(self._offset_dict):
-            file_handle.seek(offset)
-            dna_size = array(LONG)
-            dna_size.fromfile(file_handle, 1)
-            if byteswapped:
-                dna_size.byteswap()
-            d[name] = dna_size[0]
+            d[name] = _read_longs(reader, offset, 1, byteswapped)[0]
         return d
 
+    def fetch_many(self, intervals, max_gap=FETCH_MANY_MAX_GAP, mask=None):
+        """
+        fetch many intervals at once, returning a list of strings in the
+        order the intervals were given
+
+        intervals is an iterable of (chrom, start, end) or
+        (chrom, start, end, strand) tuples; coordinates work as in slicing
+        and strand '-' returns the reverse complement ('+' and '.' do not)
+
+        mask overrides the file's mask policy (see TwoBitSequence.get_slice);
+        with mask='bitmap' each result is a (sequence, mask) pair
+
+        Intervals are sorted by sequence and position, and intervals that
+        overlap or lie within max_gap bases of each other are read and
+        decoded together, then cut apart.
+        >>> genome.fetch_many([('chr1', 100, 120), ('chr1', 110, 130, '-')])
+        """
+        if mask is None:
+            mask = self._mask
+        _check_mask(mask)
+        requests = []
+        for i, interval in enumerate(intervals):
+            chrom, start, end = interval[:3]
+            strand = interval[3] if len(interval) > 3 else "+"
+            if strand not in ("+", "-", "."):
+                raise ValueError("strand must be '+', '-' or '.', not %r" % (strand,))
+            start, end = self[chrom]._normalize_range(start, end)
+            requests.append((chrom, start, end, i, strand))
+        requests.sort()
+        results = [None] * len(requests)
+        group = []
+        group_end = 0
+        for request in requests:
+            chrom, start, end = request[:3]
+            if group and (
+                chrom != group[0][0] or start > group_end + max_gap or max(end, group_end) - group[0][1] > FETCH_MANY_MAX_SPAN
+            ):
+                self._fetch_group(group, group_end, results, mask)
+                group = []
+            if not group:
+                group_end = end
+            group.append(request)
+            group_end = max(group_end, end)
+        if group:
+            self._fetch_group(group, group_end, results, mask)
+        return results
+
+    def _fetch_group(self, group, group_end, results, mask):
+        """read one merged interval for a group of sorted requests"""
+        chrom, group_start = group[0][:2]
+        if len(group) == 1:
+            # reverse complement while decoding
+            results[group[0][3]] = self[chrom].get_slice(group_start, group_end, strand=group[0][4], mask=mask)
+            return
+        sequence = self[chrom]
+        merged = sequence._slice_bytes(group_start, group_end, mask=mask)
+        if mask == "bitmap":
+            merged_bitmap = sequence._mask_bitmap(group_start, group_end)
+        for chrom, start, end, i, strand in group:
+            dna = merged[start - group_start : end - group_start]
+            if strand == "-":
+                # reverse complement the bytes, before they become a str
+                dna = dna.translate(COMPLEMENT_BYTES)
+                dna.reverse()
+            seq = dna.decode("ascii")
+            if mask == "bitmap":
+                bitmap = merged_bitmap[start - group_start : end - group_start]
+                if strand == "-":
+                    bitmap.reverse()
+                seq = (seq, bitmap)
+            results[i] = seq
+
 
 class TwoBitSequence(object):
     """
@@ -399,6 +1616,7 @@ class TwoBitSequence(object):
     >>> whole_chr20 = str(chr20) # get whole chr as string
 
     Fair warning: dumping the entire chromosome requires a lot of memory
+    (iter_chunks() streams a sequence in constant memory instead)
 
     Note that we follow python/UCSC conventions:
     Coordinates are 0-based, end-open
@@ -410,52 +1628,48 @@ class TwoBitSequence(object):
     but if you want to string-ize your TwoBitFile, here's a recipe:
 
     x = TwoBitFile('my.2bit')
-    d = x.dict()
+    d = dict(x)
     for k,v in d.items(): d[k] = str(v)
     """
 
-    def __init__(self, file_handle, offset, file_size, byteswapped=False):
+    def __init__(
+        self, file_handle, offset, file_size, byteswapped=False, use_numpy=None, cache=None, tables=None, mask="soft"
+    ):
+        # file_handle may be a plain file object or one of the positional
+        # readers used by TwoBitFile
+        if not hasattr(file_handle, "read_at"):
+            file_handle = _FileReader(file_handle)
         self._file_size = file_size
         self._file_handle = file_handle
         self._original_offset = offset
         self._byteswapped = byteswapped
-        file_handle.seek(offset)
-        header = array(LONG)
-        header.fromfile(file_handle, 2)
-        if byteswapped:
-            header.byteswap()
-        dna_size, n_block_count = header
+        self._use_numpy = _resolve_use_numpy(use_numpy)
+        self._cache = cache
+        _check_mask(mask)
+        self._mask = mask
+        if tables is None:
+            # read the record header and tables from the file
+            dna_size, n_block_count = _read_longs(file_handle, offset, 2, byteswapped)
+            n_block_starts = _read_longs(file_handle, offset + 8, n_block_count, byteswapped)
+            n_block_sizes = _read_longs(file_handle, offset + 8 + 4 * n_block_count, n_block_count, byteswapped)
+            mask_offset = offset + 8 + 8 * n_block_count
+            mask_block_count = _read_longs(file_handle, mask_offset, 1, byteswapped)[0]
+            mask_block_starts = _read_longs(file_handle, mask_offset + 4, mask_block_count, byteswapped)
+            mask_block_sizes = _read_longs(file_handle, mask_offset + 4 + 4 * mask_block_count, mask_block_count, byteswapped)
+        else:
+            # (dna_size, n_block_starts, n_block_sizes, mask_block_starts, mask_block_sizes)
+            # already loaded, e.g. from a sidecar index
+            dna_size, n_block_starts, n_block_sizes, mask_block_starts, mask_block_sizes = tables
         self._dna_size = dna_size  # number of characters, 2 bits each
         self._n_bytes = (dna_size + 3) / 4  # number of bytes
         # number of 32-bit fragments
         self._packed_dna_size = (dna_size + 15) / 16
-        n_block_starts = array(LONG)
-        n_block_sizes = array(LONG)
-        n_block_starts.fromfile(file_handle, n_block_count)
-        if byteswapped:
-            n_block_starts.byteswap()
-        n_block_sizes.fromfile(file_handle, n_block_count)
-        if byteswapped:
-            n_block_sizes.byteswap()
         self._n_block_starts = n_block_starts
         self._n_block_sizes = n_block_sizes
-        mask_rawc = array(LONG)
-        mask_rawc.fromfile(file_handle, 1)
-        if byteswapped:
-            mask_rawc.byteswap()
-        mask_block_count = mask_rawc[0]
-        mask_block_starts = array(LONG)
-        mask_block_starts.fromfile(file_handle, mask_block_count)
-        if byteswapped:
-            mask_block_starts.byteswap()
-        mask_block_sizes = array(LONG)
-        mask_block_sizes.fromfile(file_handle, mask_block_count)
-        if byteswapped:
-            mask_block_sizes.byteswap()
         self._mask_block_starts = mask_block_starts
         self._mask_block_sizes = mask_block_sizes
-        file_handle.read(4)
-        self._offset = file_handle.tell()
+        # packed DNA follows the tables and the reserved field
+        self._offset = offset + 16 + 8 * len(n_block_starts) + 8 * len(mask_block_starts)
 
     def __len__(self):
         return self._dna_size
@@ -477,9 +1691,10 @@ class TwoBitSequence(object):
                 max_ = None
             return self.get_slice(min_=slice_or_key, max_=max_)
 
-    def get_slice(self, min_, max_=None):
+    def _normalize_range(self, min_, max_):
         """
-        get_slice returns only a sub-sequence
+        resolve None and negative coordinates and truncate at the sequence end
+        returns (min_, max_) with max_ >= min_
         """
         # handle negative coordinates
         dna_size = self._dna_size
@@ -495,111 +1710,437 @@ class TwoBitSequence(object):
             min_ = dna_size + min_
         if max_ is None or max_ > dna_size:
             max_ = dna_size
-
         # make sure there's a proper range
         if min_ > max_:
-            return ""
-        if max_ == 0 or max_ == min_:
-            return ""
+            max_ = min_
+        return min_, max_
+
+    def get_slice(self, min_, max_=None, as_array=False, strand="+", mask=None):
+        """
+        get_slice returns only a sub-sequence
 
+        With as_array=True the sub-sequence is returned as a NumPy uint8
+        array of ASCII codes instead of a str (this requires NumPy).
+
+        With strand='-' the reverse complement is returned ('+' and '.' do
+        not change the sequence). Bases are complemented while they are
+        decoded and soft-masked (lower) case is kept.
+
+        mask overrides the mask policy of the file for this call:
+        'soft'    masked bases are lower case
+        'ignore'  all bases are upper case (mask-blocks are never read)
+        'hard'    masked bases are replaced by N
+        'bitmap'  returns (sequence, bitmap): the sequence is upper case and
+                  the bitmap (a bytearray, or a bool array with as_array=True)
+                  is 1 at masked bases
+        """
+        if as_array and _load_numpy() is None:
+            raise ImportError("as_array=True requires numpy")
+        if strand not in ("+", "-", "."):
+            raise ValueError("strand must be '+', '-' or '.', not %r" % (strand,))
+        if mask is None:
+            mask = self._mask
+        _check_mask(mask)
+        reverse = strand == "-"
+        min_, max_ = self._normalize_range(min_, max_)
+        dna = self._slice_bytes(min_, max_, reverse, mask, as_array)
+        if as_array:
+            seq = numpy.frombuffer(dna, dtype=numpy.uint8)
+        else:
+            seq = dna.decode("ascii")
+        if mask != "bitmap":
+            return seq
+        return seq, self._mask_bitmap(min_, max_, as_array, reverse)
+
+    def _slice_bytes(self, min_, max_, reverse=False, mask="soft", as_array=False):
+        """
+        the bases of the normalized range [min_, max_) as a bytearray, with
+        N-blocks and mask-blocks applied (and reverse complemented if
+        reverse is true); as_array=True always masks with NumPy
+        """
+        if max_ == min_:
+            return bytearray()
         # load all the data
-        file_handle = self._file_handle
-        byteswapped = self._byteswapped
         n_block_starts = self._n_block_starts
         n_block_sizes = self._n_block_sizes
         mask_block_starts = self._mask_block_starts
         mask_block_sizes = self._mask_block_sizes
-        offset = self._offset
-        packed_dna_size = self._packed_dna_size
-        # n_bytes = self._n_bytes
 
-        # region_size is how many bases the region is
-        if max_ is None:
-            region_size = dna_size - min_
+        cache = self._cache
+        if cache is not None and max_ - min_ <= cache.maxsize:
+            dna = self._cached_bases(cache, min_, max_)
+            if reverse:
+                dna = dna.translate(COMPLEMENT_BYTES)
         else:
-            region_size = max_ - min_
-
-        # start_block, end_block are the first/last 32-bit blocks we need
-        # blocks start at 0
-        start_block = min_ // 16
-        # jump directly to desired file location
-        local_offset = offset + (start_block * 4)
-        end_block = (max_ - 1 + 16) // 16
-        # don't read past seq end
-
-        file_handle.seek(local_offset)
-
-        # note we won't actually read the last base
-        # this is a python slice first_base_offset:16*blocks+last_base_offset
-        first_base_offset = min_ % 16
-        last_base_offset = max_ % 16
-        if last_base_offset == 0:
-            last_base_offset = 16
-        # +1 we still need to read end_block maybe
-        blocks_to_read = end_block - start_block
-        if (blocks_to_read + start_block) > packed_dna_size:
-            blocks_to_read = packed_dna_size - start_block
-
-        fourbyte_dna = array(LONG)
-        # remainder_seq = None
-        if (blocks_to_read * 4 + local_offset) > self._file_size:
-            fourbyte_dna.fromfile(file_handle, blocks_to_read - 1)
-            morebytes = file_handle.read()  # read the remaining characters
-        #            if byteswapped:
-        #                morebytes = ''.join(reversed(morebytes))
-        else:
-            fourbyte_dna.fromfile(file_handle, blocks_to_read)
-            morebytes = None
-        if byteswapped:
-            fourbyte_dna.byteswap()
-        str_as_array = longs_to_char_array(
-            fourbyte_dna, first_base_offset, last_base_offset, region_size, more_bytes=morebytes
-        )
-        first_n_region = max(0, bisect_right(n_block_starts, min_) - 1)
-        last_n_region = min(len(n_block_starts), 1 + bisect_right(n_block_starts, max_, lo=first_n_region))
-        for start, size in izip(n_block_starts[first_n_region:last_n_region], n_block_sizes[first_n_region:last_n_region]):
-            end = start + size
-            if end <= min_:
+            dna = self._read_bases(min_, max_, COMPLEMENT_DECODE_TABLES if reverse else DECODE_TABLES)
+        if not len(dna) == max_ - min_:
+            raise RuntimeError("Sequence was the wrong size")
+        # a region overlaps at most one block per base (plus the edges)
+        masked = False
+        if as_array or (self._use_numpy and max_ - min_ > NUMPY_BLOCK_THRESHOLD):
+            first_n_region, last_n_region = _block_range(n_block_starts, min_, max_)
+            block_count = last_n_region - first_n_region
+            if mask in ("soft", "hard"):
+                first_masked_region, last_masked_region = _block_range(mask_block_starts, min_, max_)
+                block_count += last_masked_region - first_masked_region
+            if as_array or block_count > NUMPY_BLOCK_THRESHOLD:
+                self._numpy_mask(dna, min_, max_, mask)
+                masked = True
+        if not masked:
+            self._apply_blocks(dna, min_, max_, mask=mask)
+        if reverse:
+            dna.reverse()
+        return dna
+
+    def _mask_bitmap(self, min_, max_, as_array=False, reverse=False):
+        """
+        mark the masked bases of [min_, max_) with 1 in a bytearray
+        (or a bool array with as_array=True), reversed if reverse is true
+        """
+        if as_array:
+            bitmap = _numpy_block_mask(self._mask_block_starts, self._mask_block_sizes, min_, max_)
+            return bitmap[::-1].copy() if reverse else bitmap
+        bitmap = bytearray(max_ - min_)
+        for start, end in _overlapping_blocks(self._mask_block_starts, self._mask_block_sizes, min_, max_):
+            bitmap[start:end] = b"\x01" * (end - start)
+        if reverse:
+            bitmap.reverse()
+        return bitmap
+
+    def _read_bases(self, min_, max_, tables=DECODE_TABLES):
+        """read and decode [min_, max_) to a bytearray (before N/mask blocks)"""
+        # packed DNA holds four bases per byte, first base in the high bits
+        # jump directly to the bytes covering [min_, max_)
+        first_byte = min_ // 4
+        last_byte = (max_ + 3) // 4
+        packed = self._file_handle.read_at(self._offset + first_byte, last_byte - first_byte)
+        return packed_to_bytes(packed, min_ % 4, max_ - min_, tables)
+
+    def _cached_bases(self, cache, min_, max_):
+        """
+        assemble [min_, max_) from cached blocks, reading and decoding each
+        run of missing blocks at once
+        """
+        block_size = cache.block_size
+        first_block = min_ // block_size
+        last_block = (max_ - 1) // block_size + 1
+        blocks = [cache.get((self._offset, block)) for block in xrange(first_block, last_block)]
+        i = 0
+        while i < len(blocks):
+            if blocks[i] is not None:
+                i += 1
                 continue
-            if start > max_:
-                break
-            if start < min_:
-                start = min_
-            if end > max_:
-                end = max_
-            start -= min_
-            end -= min_
-            # this should actually be decoded, 00=N, 01=n
-            str_as_array[start:end] = list("N" * (end - start))
-        lower = str.lower
-        first_masked_region = max(0, bisect_right(mask_block_starts, min_) - 1)
-        last_masked_region = min(len(mask_block_starts), 1 + bisect_right(mask_block_starts, max_, lo=first_masked_region))
-        for start, size in izip(
-            mask_block_starts[first_masked_region:last_masked_region], mask_block_sizes[first_masked_region:last_masked_region]
-        ):
-            end = start + size
-            if end <= min_:
+            j = i
+            while j < len(blocks) and blocks[j] is None:
+                j += 1
+            run_start = (first_block + i) * block_size
+            bases = bytes(self._read_bases(run_start, min((first_block + j) * block_size, self._dna_size)))
+            for k in xrange(i, j):
+                block = bases[(k - i) * block_size : (k - i + 1) * block_size]
+                cache.put((self._offset, first_block + k), block)
+                blocks[k] = block
+            i = j
+        skip = min_ - first_block * block_size
+        if len(blocks) == 1:
+            return bytearray(blocks[0][skip : skip + max_ - min_])
+        dna = bytearray(b"".join(blocks))
+        del dna[skip + max_ - min_ :]
+        del dna[:skip]
+        return dna
+
+    def _apply_blocks(self, dna, min_, max_, offset=0, mask="soft"):
+        """
+        write N-blocks and mask-blocks (as the mask policy says) into the
+        bytearray dna, which holds the bases of [min_, max_) starting at
+        dna[offset]
+        """
+        for start, end in _overlapping_blocks(self._n_block_starts, self._n_block_sizes, min_, max_):
+            dna[offset + start : offset + end] = b"N" * (end - start)
+        if mask == "soft":
+            for start, end in _overlapping_blocks(self._mask_block_starts, self._mask_block_sizes, min_, max_):
+                dna[offset + start : offset + end] = dna[offset + start : offset + end].lower()
+        elif mask == "hard":
+            for start, end in _overlapping_blocks(self._mask_block_starts, self._mask_block_sizes, min_, max_):
+                dna[offset + start : offset + end] = b"N" * (end - start)
+
+    def iter_chunks(self, chunk_size=ITER_CHUNK_SIZE, start=0, end=None, as_bytes=False, mask=None):
+        """
+        iterate over [start, end) of the sequence in chunks of at most
+        chunk_size bases, decoding one chunk at a time
+
+        Chunk boundaries fall on multiples of chunk_size (rounded down to a
+        multiple of 4, so each chunk starts on a packed byte), and N-blocks
+        and mask-blocks that cross a boundary are split between chunks.
+        Every chunk is decoded into the same preallocated buffer, so memory
+        use does not depend on the sequence length.
+
+        Chunks are yielded as str, or with as_bytes=True as a memoryview of
+        that buffer. The view is overwritten by the next chunk, so copy it
+        if you need to keep it.
+
+        mask overrides the mask policy of the file ('soft', 'ignore' or
+        'hard'; see get_slice).
+        >>> sha = hashlib.sha256()
+        >>> for chunk in genome['chr1'].iter_chunks(as_bytes=True):
+        >>>     sha.update(chunk)
+        """
+        if mask is None:
+            mask = self._mask
+        if mask == "bitmap":
+            raise ValueError("iter_chunks does not support mask='bitmap'")
+        _check_mask(mask)
+        min_, max_ = self._normalize_range(start, end)
+        chunk_size = max(4, chunk_size - chunk_size % 4)
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        read_at = self._file_handle.read_at
+        while min_ < max_:
+            chunk_end = min(max_, (min_ // chunk_size + 1) * chunk_size)
+            first_byte = min_ // 4
+            last_byte = (chunk_end + 3) // 4
+            packed = read_at(self._offset + first_byte, last_byte - first_byte)
+            _expand_into(buffer, bytes(packed))
+            offset = min_ % 4
+            self._apply_blocks(buffer, min_, chunk_end, offset, mask)
+            chunk = view[offset : offset + chunk_end - min_]
+            if as_bytes:
+                yield chunk
+            else:
+                yield str(chunk, "ascii")
+            min_ = chunk_end
+
+    def _numpy_mask(self, dna, min_, max_, mask="soft"):
+        """
+        apply N-blocks and mask-blocks (as the mask policy says) to the
+        decoded bytearray dna in place with vectorized range writes
+        """
+        bases = numpy.frombuffer(dna, dtype=numpy.uint8)
+        covered = _numpy_block_mask(self._n_block_starts, self._n_block_sizes, min_, max_)
+        numpy.copyto(bases, ord("N"), where=covered)
+        if mask == "soft":
+            covered = _numpy_block_mask(self._mask_block_starts, self._mask_block_sizes, min_, max_)
+            # setting 0x20 lower-cases an ASCII letter
+            numpy.bitwise_or(bases, 0x20, out=bases, where=covered)
+        elif mask == "hard":
+            covered = _numpy_block_mask(self._mask_block_starts, self._mask_block_sizes, min_, max_)
+            numpy.copyto(bases, ord("N"), where=covered)
+
+    def get_encoded(self, start=0, end=None, encoding="onehot", n_value=None, strand="+", dtype=None):
+        """
+        the bases of [start, end) as a NumPy array, decoded from the packed
+        bytes straight to base indices without building a str
+
+        'onehot'  a (length, 4) array with columns A, C, G, T (float32 by
+                  default); N rows are n_value (default 0)
+        'int8'    a (length,) array of A=0, C=1, G=2, T=3 and N=n_value
+                  (default 4)
+        strand='-' encodes the reverse complement; soft-masking is ignored
+        >>> x = genome['chr1'].get_encoded(1000, 2000)
+        """
+        if _load_numpy() is None:
+            raise ImportError("get_encoded requires numpy")
+        if dtype is None:
+            dtype = numpy.float32 if encoding == "onehot" else numpy.int8
+        table = _encoding_table(encoding, n_value, dtype)
+        if strand not in ("+", "-", "."):
+            raise ValueError("strand must be '+', '-' or '.', not %r" % (strand,))
+        min_, max_ = self._normalize_range(start, end)
+        indices = numpy.frombuffer(self._base_indices(min_, max_, strand == "-"), dtype=numpy.uint8)
+        return table.take(indices, axis=0)
+
+    def _base_indices(self, min_, max_, reverse=False):
+        """
+        bytearray of the base indices (A=0, C=1, G=2, T=3, N=N_INDEX) of
+        [min_, max_), complemented and reversed if reverse
+        """
+        if max_ == min_:
+            return bytearray()
+        cache = self._cache
+        if cache is not None and max_ - min_ <= cache.maxsize:
+            indices = self._cached_bases(cache, min_, max_)
+            if reverse:
+                indices = indices.translate(COMPLEMENT_BYTES)
+            indices = indices.translate(INDEX_BYTES)
+        else:
+            indices = self._read_bases(min_, max_, COMPLEMENT_INDEX_DECODE_TABLES if reverse else INDEX_DECODE_TABLES)
+        for start, end in _overlapping_blocks(self._n_block_starts, self._n_block_sizes, min_, max_):
+            indices[start:end] = bytes([N_INDEX]) * (end - start)
+        if reverse:
+            indices.reverse()
+        return indices
+
+    def composition(self, start=0, end=None):
+        """
+        count the bases of [start, end) straight from the packed bytes,
+        returning a dict with keys 'A', 'C', 'G', 'T' and 'N'
+        (soft-masked bases count as their upper-case base)
+        >>> genome['chr1'].composition(100000, 200000)
+        {'A': 29120, 'C': 20854, 'G': 20902, 'T': 29124, 'N': 0}
+
+        Each stretch between N-blocks is read in ITER_CHUNK_SIZE-base pieces
+        and counted with popcounts of the packed bits taken as one integer;
+        N-blocks are counted from their sizes.
+        """
+        min_, max_ = self._normalize_range(start, end)
+        counts = dict.fromkeys("ACGTN", 0)
+        position = min_
+        for n_start, n_end in _overlapping_blocks(self._n_block_starts, self._n_block_sizes, min_, max_):
+            self._count_bases(position, min_ + n_start, counts)
+            counts["N"] += n_end - n_start
+            position = min_ + n_end
+        self._count_bases(position, max_, counts)
+        return counts
+
+    def _count_bases(self, min_, max_, counts):
+        """add the A/C/G/T counts of the packed bases of [min_, max_) to counts"""
+        read_at = self._file_handle.read_at
+        # keep chunks on byte boundaries
+        chunk_size = max(4, ITER_CHUNK_SIZE - ITER_CHUNK_SIZE % 4)
+        while min_ < max_:
+            chunk_end = min(max_, (min_ // chunk_size + 1) * chunk_size)
+            first_byte = min_ // 4
+            last_byte = (chunk_end + 3) // 4
+            packed = bytes(read_at(self._offset + first_byte, last_byte - first_byte))
+            # with T=00, C=01, A=10, G=11, G has both bits of a base set, A
+            # only the high bit and C only the low bit
+            low_bits = _low_bits(len(packed))
+            bits = int.from_bytes(packed, "big")
+            high = (bits >> 1) & low_bits
+            low = bits & low_bits
+            g = (high & low).bit_count()
+            a = high.bit_count() - g
+            c = low.bit_count() - g
+            counts["A"] += a
+            counts["C"] += c
+            counts["G"] += g
+            counts["T"] += 4 * len(packed) - a - c - g
+            # take back the bases of the first and last byte outside [min_, chunk_end)
+            skip_head = min_ % 4
+            skip_tail = 4 * len(packed) - (chunk_end - min_) - skip_head
+            if skip_head or skip_tail:
+                edges = packed_to_bytes(packed[:1], 0, skip_head) + packed_to_bytes(packed[-1:], 4 - skip_tail, skip_tail)
+                for letter in "ACGT":
+                    counts[letter] -= edges.count(ord(letter))
+            min_ = chunk_end
+
+    def gc_profile(self, window, step=None, start=0, end=None):
+        """
+        GC fraction of windows of window bases starting every step bases
+        (step defaults to window) from start to end, as an array('d')
+        the last windows are cut short at end
+
+        N bases are left out of the fraction, and windows that are all N
+        give nan. Each ITER_CHUNK_SIZE-base stretch of windows is decoded
+        once to strong (G/C), weak (A/T) and N codes, so no str is built.
+        With NumPy (use_numpy) the strong and N codes between the sorted
+        window edges of a stretch are summed with numpy.add.reduceat, and
+        each window is a difference of two prefix sums; otherwise they are
+        counted per window with bytes.count.
+        >>> gc = genome['chr1'].gc_profile(100)
+        """
+        if step is None:
+            step = window
+        if window < 1 or step < 1:
+            raise ValueError("window and step must be at least 1")
+        min_, max_ = self._normalize_range(start, end)
+        window_starts = xrange(min_, max_, step)
+        windows_per_chunk = max(1, ITER_CHUNK_SIZE // step)
+        nan = float("nan")
+        profile = array("d")
+        for first in xrange(0, len(window_starts), windows_per_chunk):
+            chunk_starts = window_starts[first : first + windows_per_chunk]
+            chunk_min = chunk_starts[0]
+            chunk_max = min(max_, chunk_starts[-1] + window)
+            codes = self._read_bases(chunk_min, chunk_max, GC_DECODE_TABLES)
+            self._apply_blocks(codes, chunk_min, chunk_max, mask="ignore")
+            if self._use_numpy:
+                profile.frombytes(_numpy_gc_fractions(codes, chunk_starts, chunk_min, window).tobytes())
                 continue
-            if start > max_:
-                break
-            if start < min_:
-                start = min_
-            if end > max_:
-                end = max_
-            start -= min_
-            end -= min_
-            str_as_array[start:end] = list(lower(safe_tostring(str_as_array[start:end])))
-        if not len(str_as_array) == max_ - min_:
-            raise RuntimeError("Sequence was the wrong size")
-        return safe_tostring(str_as_array)
+            count = codes.count
+            for window_start in chunk_starts:
+                a = window_start - chunk_min
+                b = min(a + window, chunk_max - chunk_min)
+                called = b - a - count(b"N", a, b)
+                profile.append(count(b"S", a, b) / called if called else nan)
+        return profile
 
     def __str__(self):
         """
         returns the entire chromosome
         """
+        if self._mask == "bitmap":
+            return self.get_slice(0, None, mask="ignore")
         return self.get_slice(0, None)
 
 
+def _count_overlapping(block_starts, block_sizes, min_, max_):
+    """the number of blocks overlapping [min_, max_)"""
+    first = max(0, bisect_right(block_starts, min_) - 1)
+    if first < len(block_starts) and block_starts[first] + block_sizes[first] <= min_:
+        first += 1
+    return max(0, bisect_left(block_starts, max_) - first)
+
+
+class _StatsTwoBitSequence(TwoBitSequence):
+    """
+    a TwoBitSequence that records StatsInfo counters and phase timings
+    (used by TwoBitFile(stats=True), so plain sequences pay nothing)
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._stats = kwargs.pop("stats")
+        TwoBitSequence.__init__(self, *args, **kwargs)
+
+    def get_slice(self, min_, max_=None, as_array=False, strand="+", mask=None):
+        return self._record_slice(TwoBitSequence.get_slice, min_, max_, as_array, strand, mask)
+
+    def _slice_bytes(self, min_, max_, reverse=False, mask="soft", as_array=False):
+        # fetch_many reads merged groups through here rather than get_slice
+        return self._record_slice(TwoBitSequence._slice_bytes, min_, max_, reverse, mask, as_array)
+
+    def _record_slice(self, method, *args):
+        """call method, recording one slice unless a slice is already being recorded"""
+        stats = self._stats
+        record = stats.begin()
+        if record is None:
+            return method(self, *args)
+        started = perf_counter()
+        try:
+            result = method(self, *args)
+            record["slices"] = 1
+            record["bases_returned"] = len(result[0] if isinstance(result, tuple) else result)
+            return result
+        finally:
+            record["slice_seconds"] = perf_counter() - started
+            stats.end(record)
+
+    def _read_bases(self, min_, max_, tables=DECODE_TABLES):
+        # TwoBitSequence._read_bases makes one read; the rest of its time is decoding
+        stats = self._stats
+        started = perf_counter()
+        dna = TwoBitSequence._read_bases(self, min_, max_, tables)
+        elapsed = perf_counter() - started - stats._local.last_read_seconds
+        stats.add(bases_decoded=max_ - min_, decode_seconds=max(0.0, elapsed))
+        return dna
+
+    def _apply_blocks(self, dna, min_, max_, offset=0, mask="soft"):
+        started = perf_counter()
+        TwoBitSequence._apply_blocks(self, dna, min_, max_, offset, mask)
+        self._count_blocks(min_, max_, mask, perf_counter() - started)
+
+    def _numpy_mask(self, dna, min_, max_, mask="soft"):
+        started = perf_counter()
+        TwoBitSequence._numpy_mask(self, dna, min_, max_, mask)
+        self._count_blocks(min_, max_, mask, perf_counter() - started)
+
+    def _count_blocks(self, min_, max_, mask, elapsed):
+        mask_blocks = 0
+        if mask in ("soft", "hard"):
+            mask_blocks = _count_overlapping(self._mask_block_starts, self._mask_block_sizes, min_, max_)
+        n_blocks = _count_overlapping(self._n_block_starts, self._n_block_sizes, min_, max_)
+        self._stats.add(n_blocks=n_blocks, mask_blocks=mask_blocks, blocks_seconds=elapsed)
+
+
 class TwoBitFileError(Exception):
     """
     Base exception for TwoBit module
@@ -628,7 +2169,8 @@ following fields:
 signature - the number 0x1A412743 in the architecture of the machine that \
 created the file.
 version - zero for now. Readers should abort if they see a version number \
-higher than 0.
+higher than 0. (UCSC tools now also write version 1, in which the offset \
+field of each index entry is 64 bits so files can exceed 4 GB.)
 sequenceCount - the number of sequences in the file
 reserved - always zero for now.
 All fields are 32 bits unless noted. If the signature value is not as given, \
@@ -643,7 +2185,8 @@ each sequence. Each index entry contains three fields:
 nameSize - a byte containing the length of the name field
 name - this contains the sequence name itself, and is variable length \
 depending on nameSize.
-offset - 32 bit offset of the sequence data relative to the start of the file
+offset - 32 bit offset of the sequence data relative to the start of the file \
+(64 bit in version 1 files)
 
 The index is followed by the sequence records. These contain 9 fields:
 
@@ -669,17 +2212,30 @@ improves i/o performance on some machines.
 def cmdline_reader():
     """
     cmdline_reader allows twobitreader module to be executed as a script
-    accepts only one argument -- the .2bit filename
-    reads input (BED format) from stdin
+    usage: python -m twobitreader [--jobs N] [--mask M] [--width N] example.2bit [example.bed]
+    reads input (BED format) from the BED file, or stdin if none is given
     writes output (FASTA format) to stdout
     writes errors/warning to stderr
 
-    Regions should be given in BED format on stdin
+    Regions should be given in BED format
     chrom    start(0-based)    end(0-based, not included)
+    if a sixth (strand) column is '-', the reverse complement is written
+    and the record is named chrom:start-end(-)
 
     To use a BED file of regions, do
+    python -m twobitreader example.2bit example.bed
+    or
     python -m twobitreader example.2bit < example.bed
 
+    --jobs N (-j N) extracts regions on N worker processes (0 for one per
+    CPU); records are still written in input order
+
+    --mask soft|ignore|hard writes soft-masked bases in lower case (the
+    default), in upper case, or as N
+
+    --width N writes sequence lines of N bases (60 by default; 0 writes
+    each sequence on one line)
+
     Non-regions will be skipped and warnings will be issued to logging
     (logging output to stderr by default)
     """
@@ -696,36 +2252,184 @@ def cmdline_reader():
         print(cmdline_reader.__doc__)
         sys.exit()
         return
-    # if user specified multiple files, exit with error
-    elif len(argv) > 2:
-        sys.exit("Too many files specified")
-        return
+    parser = argparse.ArgumentParser(prog="python -m twobitreader", add_help=False)
+    parser.add_argument("twobit_filename")
+    parser.add_argument("bed_filename", nargs="?")
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--mask", choices=("soft", "ignore", "hard"), default="soft")
+    parser.add_argument("--width", type=int, default=FASTA_LINE_WIDTH)
+    args = parser.parse_args(argv[1:])
     # otherwise proceed with opening the .2bit file
-    twobit_file = TwoBitFile(argv[1])
+    twobit_file = TwoBitFile(args.twobit_filename, mask=args.mask)
+    # FASTA goes to the binary stdout in large blocks
+    output = getattr(sys.stdout, "buffer", sys.stdout)
+    options = dict(jobs=args.jobs, output=output, width=args.width)
     # print error/warning messages as we go
-    twobit_reader(twobit_file, input_stream=sys.stdin)
+    if args.bed_filename is None or args.bed_filename == "-":
+        twobit_reader(twobit_file, input_stream=sys.stdin, **options)
+    else:
+        with open(args.bed_filename, buffering=BED_BUFFER_SIZE) as input_stream:
+            twobit_reader(twobit_file, input_stream=input_stream, **options)
+
+
+# BED files named on the command line are read with this buffer size
+BED_BUFFER_SIZE = 1 << 20
+
+
+# FASTA sequence lines hold this many bases (0 for one line per record)
+FASTA_LINE_WIDTH = 60
+# FastaWriter passes output to its file this many bytes at a time
+FASTA_BUFFER_SIZE = 1 << 20
+
+
+def wrap_fasta(seq, width=FASTA_LINE_WIDTH):
+    """
+    split a sequence (str or bytes) into lines of width bases joined by
+    newlines; for DNA this gives the same as textwrap.fill(seq, width),
+    by plain slicing. width 0 (or None) leaves it on one line.
+    """
+    if not width or len(seq) <= width:
+        return seq
+    newline = "\n" if isinstance(seq, str) else b"\n"
+    return newline.join([seq[i : i + width] for i in xrange(0, len(seq), width)])
+
+
+class FastaWriter(object):
+    """
+    buffered FASTA output to a binary file object (or a path)
+
+    Records are formatted into a bytearray, with sequence lines of width
+    bases cut by slicing (width=0 writes each sequence on one line), and
+    written to the output once buffer_size bytes have collected.
+    >>> with FastaWriter(sys.stdout.buffer, width=80) as fasta:
+    >>>     fasta.write_record('chr1:0-100', genome['chr1'][0:100])
+    """
+
+    def __init__(self, output, width=FASTA_LINE_WIDTH, buffer_size=FASTA_BUFFER_SIZE):
+        self._owns_output = isinstance(output, str)
+        if self._owns_output:
+            output = open(output, "wb")
+        self._output = output
+        self._width = width
+        self._buffer_size = buffer_size
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._owns_output:
+            self._output.close()
+
+    def write_record(self, name, seq):
+        """add one record; seq may be a str, bytes or a bytearray"""
+        if isinstance(seq, str):
+            seq = seq.encode("ascii")
+        buffer = self._buffer
+        buffer += b">"
+        buffer += name.encode("ascii")
+        buffer += b"\n"
+        width = self._width
+        if not width or len(seq) <= width:
+            buffer += seq
+            buffer += b"\n"
+        else:
+            view = memoryview(seq)
+            for i in xrange(0, len(seq), width):
+                buffer += view[i : i + width]
+                buffer += b"\n"
+        if len(buffer) >= self._buffer_size:
+            self.flush()
+
+    def write_formatted(self, data):
+        """add FASTA text that is already formatted (bytes)"""
+        if len(self._buffer) + len(data) < self._buffer_size:
+            self._buffer += data
+            return
+        self.flush()
+        self._output.write(data)
+
+    def flush(self):
+        """write out the buffered records"""
+        if self._buffer:
+            self._output.write(self._buffer)
+            self._buffer = bytearray()
+        if hasattr(self._output, "flush"):
+            self._output.flush()
+
+    def close(self):
+        """flush, and close the output if it was opened from a path"""
+        self.flush()
+        if self._owns_output:
+            self._output.close()
 
 
-def twobit_reader(twobit_file, input_stream=None, write=None):
+def twobit_reader(twobit_file, input_stream=None, write=None, jobs=1, output=None, width=FASTA_LINE_WIDTH):
     """
     twobit_reader takes a twobit_file (of class TwoBitFile)
     and an "input_stream" which can be any iterable (incl. file-like objects)
     writes output (FASTA format) using write (print if write=None)
     logs errors/warning to stderr
 
+    write is called with each header line and each record's sequence
+    lines (joined by newlines). Pass output (a binary file object or a
+    path) instead to write FASTA in large buffered blocks (see
+    FastaWriter), which is much faster for long regions. width is the
+    number of bases per sequence line (0 for one line per record).
+
     Regions should be given in BED format on stdin
     chrom    start(0-based)    end(0-based, not included)
+    if a sixth (strand) column is '-', the reverse complement is written
 
     To use a BED file of regions, do
     python -m twobitreader example.2bit < example.bed
 
+    With jobs > 1 (0 for one per CPU) the input is split into chunks that
+    are extracted on a pool of jobs worker processes, each of which opens
+    the .2bit file once. Output is still written in input order.
+
     Non-regions will be skipped and warnings will be issued to logging
     (logging output to stderr by default)
     """
-    warning_msg = 'Invalid %s at line %d\n\t"%s"'
     if input_stream is None:
         return
-    for i, line in enumerate((line.rstrip("\n\r") for line in input_stream)):
+    if jobs < 1:
+        jobs = cpu_count() or 1
+    if output is not None:
+        with FastaWriter(output, width) as fasta:
+            if jobs > 1:
+                for block in _parallel_fasta_chunks(twobit_file, input_stream, jobs, width, binary=True):
+                    fasta.write_formatted(block)
+                return
+            for batch in _region_batches(twobit_file, input_stream):
+                for name, seq in _fasta_records(twobit_file, batch):
+                    fasta.write_record(name, seq)
+        return
+    if write is None:
+        write = print
+    if jobs > 1:
+        for lines in _parallel_fasta_chunks(twobit_file, input_stream, jobs, width):
+            for line in lines:
+                write(line)
+        return
+    for batch in _region_batches(twobit_file, input_stream):
+        _write_fasta_batch(twobit_file, batch, write, width)
+    return
+
+
+# twobit_reader passes this many regions at a time to fetch_many
+TWOBIT_READER_BATCH_SIZE = 10000
+
+
+def _read_bed_regions(twobit_file, input_stream, first_line=0):
+    """
+    yield valid (chrom, start, end, strand) regions from BED lines,
+    logging a warning for each line that is skipped or adjusted
+    """
+    warning_msg = 'Invalid %s at line %d\n\t"%s"'
+    for i, line in enumerate((line.rstrip("\n\r") for line in input_stream), first_line):
         fields = line.split()
         if not len(fields) >= 3:
             logging.warning(warning_msg, "start", i, line)
@@ -749,18 +2453,133 @@ def twobit_reader(twobit_file, input_stream=None, write=None):
             logging.warning(warning_msg, "end", i, line)
             continue
         chrom_len = len(twobit_file[chrom])
-        if end > len(twobit_file[chrom]):
+        if end > chrom_len:
             logging.warning("At line %d, end is greater than chrom length %d\n%s", i, chrom_len, line)
             logging.warning("Sequence will be truncated at chrom" + "length for line %d", i)
             end = chrom_len
-        seq = twobit_file[chrom][start:end]
-        if write is not None:
-            write(">%s:%d-%d" % (chrom, start, end))
-            write(textwrap.fill(seq, 60))
+        strand = "-" if len(fields) >= 6 and fields[5] == "-" else "+"
+        yield chrom, start, end, strand
+
+
+def _region_batches(twobit_file, input_stream):
+    """yield lists of at most TWOBIT_READER_BATCH_SIZE valid BED regions"""
+    batch = []
+    for region in _read_bed_regions(twobit_file, input_stream):
+        batch.append(region)
+        if len(batch) == TWOBIT_READER_BATCH_SIZE:
+            yield batch
+            batch = []
+    yield batch
+
+
+def _fasta_records(twobit_file, regions):
+    """fetch regions with fetch_many, yielding (FASTA name, sequence)"""
+    # FASTA has no room for a separate mask
+    mask = "ignore" if twobit_file._mask == "bitmap" else None
+    for (chrom, start, end, strand), seq in izip(regions, twobit_file.fetch_many(regions, mask=mask)):
+        if strand == "-":
+            yield "%s:%d-%d(-)" % (chrom, start, end), seq
         else:
-            print(">%s:%d-%d" % (chrom, start, end))
-            print(textwrap.fill(seq, 60))
-    return
+            yield "%s:%d-%d" % (chrom, start, end), seq
+
+
+def _write_fasta_batch(twobit_file, regions, write, width=FASTA_LINE_WIDTH):
+    """fetch regions and pass their FASTA lines to write"""
+    for name, seq in _fasta_records(twobit_file, regions):
+        write(">" + name)
+        write(wrap_fasta(seq, width))
+
+
+# the TwoBitFile opened by each worker process (see _init_worker)
+_worker_twobit_file = None
+
+
+def _init_worker(twobit_file):
+    """
+    process pool initializer: keep the TwoBitFile for this worker
+    (under the spawn start method it arrives pickled and is reopened once)
+    """
+    global _worker_twobit_file
+    _worker_twobit_file = twobit_file
+
+
+def _fasta_chunk(first_line, lines, width=FASTA_LINE_WIDTH, binary=False):
+    """
+    worker: return the FASTA lines for one chunk of BED lines, or with
+    binary=True the whole chunk formatted as bytes
+    """
+    regions = list(_read_bed_regions(_worker_twobit_file, lines, first_line))
+    if binary:
+        output = BytesIO()
+        with FastaWriter(output, width, buffer_size=float("inf")) as fasta:
+            for name, seq in _fasta_records(_worker_twobit_file, regions):
+                fasta.write_record(name, seq)
+        return output.getvalue()
+    output = []
+    _write_fasta_batch(_worker_twobit_file, regions, output.append, width)
+    return output
+
+
+def _motif_hits(sequence, name, start, end, pattern, strands, exclude_n, exclude_masked):
+    """list the hits of a pattern starting in [start, end) of sequence (see TwoBitFile.find)"""
+    search, reverse_match = _compile_motif(pattern, strands, exclude_n)
+    # a hit starting before end reaches len(pattern) - 1 bases further
+    stop = min(end + len(pattern) - 1, len(sequence))
+    dna = sequence._read_bases(start, stop)
+    # masked bases are lower case, so upper-case patterns do not match them
+    sequence._apply_blocks(dna, start, stop, mask="soft" if exclude_masked else "ignore")
+    hits = []
+    size = len(pattern)
+    for match in search.finditer(dna):
+        position = match.start()
+        if position >= end - start:
+            break
+        hit_start = start + position
+        if strands != "both":
+            hits.append((name, hit_start, hit_start + size, strands))
+            continue
+        if match.group(1) is None:
+            hits.append((name, hit_start, hit_start + size, "-"))
+            continue
+        hits.append((name, hit_start, hit_start + size, "+"))
+        if reverse_match(dna, position):
+            hits.append((name, hit_start, hit_start + size, "-"))
+    return hits
+
+
+def _worker_motif_hits(name, start, end, *motif):
+    """worker: the hits of a pattern in one chunk of a sequence"""
+    return _motif_hits(_worker_twobit_file[name], name, start, end, *motif)
+
+
+def _line_chunks(input_stream, size):
+    """yield (first_line_number, lines) for chunks of at most size lines"""
+    iterator = iter(input_stream)
+    first_line = 0
+    while True:
+        lines = list(islice(iterator, size))
+        if not lines:
+            return
+        yield first_line, lines
+        first_line += len(lines)
+
+
+def _parallel_fasta_chunks(twobit_file, input_stream, jobs, width=FASTA_LINE_WIDTH, binary=False):
+    """
+    yield the FASTA lines (or bytes, see _fasta_chunk) for each chunk of
+    input in input order, keeping at most two chunks per worker in flight
+    """
+    # imported here as it loads multiprocessing, which only jobs > 1 needs
+    from concurrent.futures import ProcessPoolExecutor
+
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(twobit_file,)) as executor:
+        for first_line, lines in _line_chunks(input_stream, TWOBIT_READER_BATCH_SIZE):
+            pending.append(executor.submit(_fasta_chunk, first_line, lines, width, binary))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+"""
+asyncio interface to .2bit files
+
+>>> genome = await AsyncTwoBitFile.open('hg19.2bit')
+>>> seq = await genome['chr1'].get_slice(100, 120)
+>>> seqs = await genome.fetch_many([('chr1', 100, 120), ('chr2', 5, 10, '-')])
+
+Reads never block the event loop: the file is opened (its index parsed)
+and read on a bounded thread pool, using positional reads on one shared
+TwoBitFile. Requests made during the same
+event loop iteration are collected and read together with
+TwoBitFile.fetch_many (one executor job per AIO_BATCH_SIZE requests, with
+nearby intervals merged into one read), and identical requests that are
+in flight at the same time share a single read.
+
+An AsyncTwoBitFile should be used from one event loop.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from twobitreader import TwoBitFile
+
+# worker threads used when no executor is given
+AIO_MAX_WORKERS = 8
+# at most this many requests are read by one executor job
+AIO_BATCH_SIZE = 256
+
+
+class AsyncTwoBitSequence(object):
+    """
+    A handle on one sequence of an AsyncTwoBitFile
+    >>> seq = await genome['chr1'].get_slice(100, 120, strand='-')
+    """
+
+    def __init__(self, genome, name):
+        self._genome = genome
+        self._name = name
+
+    async def size(self):
+        """the number of bases (read on the executor, as a lazy file may load the record)"""
+        genome = self._genome
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(genome._executor, lambda: len(genome._genome[self._name]))
+
+    async def get_slice(self, min_, max_=None, strand="+"):
+        """return the bases from min_ to max_ (the reverse complement if strand is '-')"""
+        return await self._genome._request(self._name, min_, max_, strand)
+
+
+class AsyncTwoBitFile(object):
+    """
+    asyncio wrapper around a TwoBitFile
+
+    foo and any other keyword options (lazy, mmap, cache_size, sidecar, ...)
+    are passed to TwoBitFile; foo may also be an open TwoBitFile. Reads run
+    on executor if given, otherwise on a private pool of max_workers threads
+    that is shut down by aclose() (or close() outside the event loop).
+
+    Calling AsyncTwoBitFile() opens the file on the calling thread, which
+    for a large index (or a remote file) blocks; in a coroutine use
+    AsyncTwoBitFile.open, which opens it on the executor.
+    >>> async with await AsyncTwoBitFile.open('hg19.2bit', cache_size=1 << 24) as genome:
+    >>>     seq = await genome.get_slice('chr1', 100, 120)
+    """
+
+    def __init__(self, foo, max_workers=AIO_MAX_WORKERS, executor=None, batch_size=AIO_BATCH_SIZE, **options):
+        self._genome = foo if isinstance(foo, TwoBitFile) else TwoBitFile(foo, **options)
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="twobitreader")
+        self._executor = executor
+        self._batch_size = batch_size
+        # (name, start, end, strand) -> asyncio future, for requests not yet answered
+        self._in_flight = {}
+        self._pending = []
+
+    @classmethod
+    async def open(cls, foo, max_workers=AIO_MAX_WORKERS, executor=None, batch_size=AIO_BATCH_SIZE, **options):
+        """an AsyncTwoBitFile whose TwoBitFile is opened on the executor"""
+        owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="twobitreader")
+        loop = asyncio.get_running_loop()
+        try:
+            genome = await loop.run_in_executor(executor, partial(TwoBitFile, foo, **options))
+        except BaseException:
+            if owns_executor:
+                executor.shutdown(wait=False)
+            raise
+        self = cls(genome, executor=executor, batch_size=batch_size)
+        self._owns_executor = owns_executor
+        return self
+
+    def __getitem__(self, name):
+        if name not in self._genome:
+            raise KeyError(name)
+        return AsyncTwoBitSequence(self, name)
+
+    def __contains__(self, name):
+        return name in self._genome
+
+    def __iter__(self):
+        return iter(self._genome)
+
+    def __len__(self):
+        return len(self._genome)
+
+    def keys(self):
+        return self._genome.keys()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        wait for queued reads (off the event loop), then shut down the
+        private thread pool and close the .2bit file
+        """
+        if self._owns_executor:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._executor.shutdown)
+        self._genome.close()
+
+    def close(self):
+        """
+        like aclose, but blocks until queued reads finish; do not call it
+        from a running event loop
+        """
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+        self._genome.close()
+
+    async def sequence_sizes(self):
+        """returns a dictionary with the sizes of each sequence"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._genome.sequence_sizes)
+
+    async def get_slice(self, name, min_, max_=None, strand="+"):
+        """return the bases of name from min_ to max_ (the reverse complement if strand is '-')"""
+        return await self._request(name, min_, max_, strand)
+
+    async def fetch_many(self, intervals):
+        """
+        fetch many intervals at once, returning a list of strings in the
+        order the intervals were given; intervals are (chrom, start, end) or
+        (chrom, start, end, strand) tuples, as for TwoBitFile.fetch_many
+        """
+        return list(await asyncio.gather(*[self._request(*interval) for interval in intervals]))
+
+    def _request(self, name, start, end, strand="+"):
+        """return an awaitable for one interval, sharing reads with identical requests in flight"""
+        key = (name, start, end, strand)
+        future = self._in_flight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._in_flight[key] = future
+            if not self._pending:
+                loop.call_soon(self._flush, loop)
+            self._pending.append(key)
+        # one caller being cancelled must not cancel the read for the others
+        return asyncio.shield(future)
+
+    def _flush(self, loop):
+        """send the requests collected during this loop iteration to the executor"""
+        pending, self._pending = self._pending, []
+        for i in range(0, len(pending), self._batch_size):
+            batch = pending[i : i + self._batch_size]
+            job = loop.run_in_executor(self._executor, self._fetch_batch, batch)
+            job.add_done_callback(partial(self._resolve, batch))
+
+    def _fetch_batch(self, batch):
+        """
+        read a batch of requests on a worker thread, returning a result
+        or an exception for each request
+        """
+        try:
+            return self._genome.fetch_many(batch)
+        except Exception:
+            # retry one by one so that one bad request fails alone
+            results = []
+            for request in batch:
+                try:
+                    results.append(self._genome.fetch_many([request])[0])
+                except Exception as error:
+                    results.append(error)
+            return results
+
+    def _resolve(self, batch, job):
+        """hand the results of a finished executor job to the waiting futures"""
+        if job.cancelled():
+            for key in batch:
+                self._in_flight.pop(key).cancel()
+            return
+        if job.exception() is not None:
+            results = [job.exception()] * len(batch)
+        else:
+            results = job.result()
+        for key, result in zip(batch, results):
+            future = self._in_flight.pop(key)
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,175 @@
+"""
+many .2bit files under one namespace
+
+>>> cohort = TwoBitCollection({'HG002.1': 'HG002.hap1.2bit', 'HG002.2': 'HG002.hap2.2bit'})
+>>> cohort['HG002.1:chr1'][100:120]
+>>> cohort.fetch_many([('HG002.1:chr1', 100, 120), ('HG002.2:chr1', 100, 120, '-')])
+
+Each file is opened (lazily, reading only its name index) the first time
+one of its sequences is used, and kept as a TwoBitFile for the life of the
+collection, so its index is parsed once. File handles come from one
+FilePool: at most max_open files are open at a time, and the least
+recently used is closed (and later reopened on demand) to make room. A
+long-running process can so work across thousands of files without
+running into the open file limit.
+"""
+
+from collections import OrderedDict
+from os.path import basename
+from threading import Lock
+
+from twobitreader import POOL_MAX_OPEN, FilePool, TwoBitFile, izip
+
+# file keys and sequence names are joined with this separator by default
+COLLECTION_SEPARATOR = ":"
+
+
+class TwoBitCollection(object):
+    """
+    a read-only namespace over many .2bit files
+
+    files is a dict of {key: path}, or an iterable of paths keyed by their
+    file name without '.2bit'. Sequences are named key + separator + name
+    (e.g. 'HG002.1:chr1'), so keys should not contain the separator; a
+    sequence can also be looked up with a (key, name) tuple, and
+    collection[key] is the TwoBitFile itself.
+
+    Other keyword options (mask, use_numpy, cache_size, stats, ...) are
+    passed to every TwoBitFile; lazy defaults to True. Note that
+    cache_size is a budget per file.
+    >>> with TwoBitCollection(paths, max_open=256, mask='ignore') as cohort:
+    >>>     seq = cohort[('sample7', 'chr2')][5000:5100]
+    """
+
+    def __init__(self, files, max_open=POOL_MAX_OPEN, separator=COLLECTION_SEPARATOR, **options):
+        if not hasattr(files, "items"):
+            files = [(_file_key(path), path) for path in files]
+        else:
+            files = list(files.items())
+        self._paths = OrderedDict()
+        for key, path in files:
+            if key in self._paths:
+                raise ValueError("duplicate file key %r" % (key,))
+            self._paths[key] = path
+        self._max_open = max_open
+        self._separator = separator
+        options.setdefault("lazy", True)
+        self._options = options
+        self._pool = FilePool(max_open)
+        self._genomes = {}
+        self._lock = Lock()
+
+    def __reduce__(self):  # enables pickling (files are reopened)
+        return (_new_collection, (dict(self._paths), self._max_open, self._separator, self._options))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """close every file of the collection"""
+        with self._lock:
+            genomes, self._genomes = self._genomes, {}
+        for genome in genomes.values():
+            genome.close()
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def keys(self):
+        """the file keys"""
+        return list(self._paths)
+
+    def __contains__(self, key):
+        try:
+            self._split(key)
+        except (KeyError, ValueError):
+            # ValueError: a tuple that is not (key, name)
+            return key in self._paths
+        return True
+
+    def __getitem__(self, key):
+        if key in self._paths:
+            return self.genome(key)
+        file_key, name = self._split(key)
+        return self.genome(file_key)[name]
+
+    def genome(self, key):
+        """the TwoBitFile for a file key, opening it on first use"""
+        genome = self._genomes.get(key)
+        if genome is None:
+            path = self._paths[key]
+            with self._lock:
+                genome = self._genomes.get(key)
+                if genome is None:
+                    genome = self._genomes[key] = TwoBitFile(path, pool=self._pool, **self._options)
+        return genome
+
+    def _split(self, key):
+        """(file key, sequence name) for a (key, name) tuple or a prefixed name"""
+        if isinstance(key, tuple):
+            file_key, name = key
+        else:
+            file_key, separator, name = key.partition(self._separator)
+            if not separator:
+                raise KeyError(key)
+        if file_key not in self._paths or name not in self.genome(file_key):
+            raise KeyError(key)
+        return file_key, name
+
+    def sequence_names(self, keys=None):
+        """the prefixed names of every sequence (of every file, or of those in keys)"""
+        separator = self._separator
+        return [key + separator + name for key in (self._paths if keys is None else keys) for name in self.genome(key).keys()]
+
+    def sequence_sizes(self, keys=None):
+        """a dictionary of prefixed names and sizes (of every file, or of those in keys)"""
+        separator = self._separator
+        sizes = {}
+        for key in self._paths if keys is None else keys:
+            for name, size in self.genome(key).sequence_sizes().items():
+                sizes[key + separator + name] = size
+        return sizes
+
+    def fetch_many(self, intervals, **options):
+        """
+        fetch many intervals at once, returning a list of strings in the
+        order the intervals were given; intervals are (chrom, start, end)
+        or (chrom, start, end, strand) tuples with prefixed (or tuple)
+        chrom names, and options are passed to TwoBitFile.fetch_many
+        """
+        # (file key -> [(position, interval with the plain name)])
+        by_file = OrderedDict()
+        intervals = list(intervals)
+        for i, interval in enumerate(intervals):
+            file_key, name = self._split(interval[0])
+            by_file.setdefault(file_key, []).append((i, (name,) + tuple(interval[1:])))
+        results = [None] * len(intervals)
+        for file_key, requests in by_file.items():
+            positions = [i for i, _ in requests]
+            seqs = self.genome(file_key).fetch_many([request for _, request in requests], **options)
+            for i, seq in izip(positions, seqs):
+                results[i] = seq
+        return results
+
+    def pool_info(self):
+        """opens, evictions and open files of the file pool, as a PoolInfo"""
+        return self._pool.info()
+
+
+def _file_key(path):
+    """the file name of a path without a .2bit extension"""
+    name = basename(path)
+    if name.endswith(".2bit"):
+        name = name[: -len(".2bit")]
+    return name
+
+
+def _new_collection(files, max_open, separator, options):
+    """unpickle a TwoBitCollection"""
+    return TwoBitCollection(files, max_open, separator, **options)
@@ -0,0 +1,264 @@
+"""
+k-mer counting over packed 2-bit sequence
+
+>>> genome = TwoBitFile('hg19.2bit')
+>>> counts = count_kmers(genome, 21, jobs=8)
+>>> counts.most_common(3)
+>>> kmer_to_str(code, 21)
+
+k-mers are encoded as integers with the 2-bit codes of the .2bit format
+(T=0, C=1, A=2, G=3), first base in the high bits, so they are read
+straight from the packed bytes without building strings. The complement
+of a code is code ^ 2, and a canonical k-mer is the smaller of a k-mer
+and its reverse complement. Windows that overlap an N-block are skipped;
+soft-masking is ignored.
+
+Sequences are split into KMER_CHUNK_SIZE-base chunks (overlapping by k - 1
+bases), which can be counted on a pool of worker processes, each summing
+the counts of a run of chunks; these sums are merged at the end.
+"""
+
+from collections import Counter, deque
+from os import cpu_count
+
+import twobitreader
+from twobitreader import TwoBitFile, _init_worker, _load_numpy, _overlapping_blocks, _resolve_use_numpy
+
+# the longest k-mer that fits in a 64-bit code
+KMER_MAX_K = 31
+# sequences are counted in chunks of this many bases
+KMER_CHUNK_SIZE = 1 << 22
+# the pure-Python engine extracts this many k-mers from each integer
+KMER_BLOCK_SIZE = 64
+# the NumPy engine counts k-mers up to this size in a dense 4**k array
+KMER_DENSE_MAX_K = 11
+# count_kmers(jobs=...) splits the chunks into this many runs per worker
+KMER_JOBS_PER_WORKER = 4
+
+# reverse the four 2-bit codes of a byte and complement them
+RC_BYTE_TABLE = bytes(sum((((x >> (2 * i)) & 0x3) ^ 0x2) << (2 * (3 - i)) for i in range(4)) for x in range(2**8))
+_BASES = "TCAG"
+
+
+def kmer_to_str(code, k):
+    """the k-mer (upper case) encoded by code"""
+    return "".join(_BASES[(code >> (2 * (k - 1 - i))) & 0x3] for i in range(k))
+
+
+def str_to_kmer(kmer):
+    """the integer code of a k-mer (ACGT only, either case)"""
+    code = 0
+    for base in kmer.upper():
+        code = (code << 2) | _BASES.index(base)
+    return code
+
+
+def reverse_complement_kmer(code, k):
+    """the code of the reverse complement of a k-mer"""
+    result = 0
+    for _ in range(k):
+        result = (result << 2) | ((code & 0x3) ^ 0x2)
+        code >>= 2
+    return result
+
+
+def count_kmers(source, k, canonical=True, jobs=1, names=None, use_numpy=None):
+    """
+    count the k-mers of a TwoBitFile (every sequence, or those in names)
+    or of one TwoBitSequence, returning a Counter of k-mer codes
+
+    canonical=True counts each k-mer together with its reverse complement
+    (under the smaller code); canonical=False counts the forward strand.
+    jobs > 1 counts chunks on that many worker processes (0 for one per
+    CPU), which needs a TwoBitFile as the source.
+    use_numpy works as for TwoBitFile: None uses NumPy when it is installed.
+    """
+    if not 1 <= k <= KMER_MAX_K:
+        raise ValueError("k must be between 1 and %d" % KMER_MAX_K)
+    use_numpy = _resolve_use_numpy(use_numpy)
+    if isinstance(source, TwoBitFile):
+        if names is None:
+            names = list(source.keys())
+        sequences = [(name, source[name]) for name in names]
+    else:
+        if jobs != 1:
+            raise ValueError("jobs > 1 needs a TwoBitFile (pass names to count some sequences)")
+        sequences = [(None, source)]
+    tasks = [
+        (name, start, min(start + KMER_CHUNK_SIZE, len(sequence)))
+        for name, sequence in sequences
+        for start in range(0, len(sequence), KMER_CHUNK_SIZE)
+    ]
+    if jobs < 1:
+        jobs = cpu_count() or 1
+    if jobs == 1:
+        sequence_of = dict(sequences)
+        return _to_counter(
+            _sum(_count_chunk(sequence_of[name], start, end, k, canonical, use_numpy) for name, start, end in tasks)
+        )
+    # each worker job counts a run of chunks and returns their sum; about
+    # KMER_JOBS_PER_WORKER runs per worker balance the load
+    size = max(1, -(-len(tasks) // (KMER_JOBS_PER_WORKER * jobs)))
+    runs = [tasks[i : i + size] for i in range(0, len(tasks), size)]
+    return _to_counter(_sum(_parallel_counts(source, runs, jobs, k, canonical, use_numpy)))
+
+
+def _parallel_counts(source, runs, jobs, k, canonical, use_numpy):
+    """
+    yield the summed counts of each run of chunks, counted on jobs worker
+    processes, keeping at most two runs per worker in flight (a dense
+    result holds 4**k counts)
+    """
+    # imported here as it loads multiprocessing, which only jobs > 1 needs
+    from concurrent.futures import ProcessPoolExecutor
+
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(source,)) as executor:
+        for run in runs:
+            pending.append(executor.submit(_worker_count_chunks, run, k, canonical, use_numpy))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _sum(results):
+    """
+    add up chunk counts, which are all Counters or all dense NumPy arrays
+    (summed in place into the first), returning None if there are none
+    """
+    total = None
+    for result in results:
+        if total is None:
+            total = result
+        elif isinstance(total, Counter):
+            total.update(result)
+        else:
+            total += result
+    return total
+
+
+def _to_counter(total):
+    """a Counter from the result of _sum"""
+    if total is None:
+        return Counter()
+    if isinstance(total, Counter):
+        return total
+    codes = _load_numpy().flatnonzero(total)
+    return Counter(dict(zip(codes.tolist(), total[codes].tolist())))
+
+
+def _worker_count_chunks(run, k, canonical, use_numpy):
+    """worker: the summed counts of a run of (name, start, end) chunks"""
+    genome = twobitreader._worker_twobit_file
+    return _sum(_count_chunk(genome[name], start, end, k, canonical, use_numpy) for name, start, end in run)
+
+
+def _count_chunk(sequence, start, end, k, canonical, use_numpy):
+    """
+    count the k-mers starting in [start, end) of sequence that do not
+    overlap an N-block
+    """
+    # the last k-mer starting before end reaches k - 1 bases further
+    stop = min(end + k - 1, len(sequence))
+    segments = []
+    position = start
+    for n_start, n_end in _overlapping_blocks(sequence._n_block_starts, sequence._n_block_sizes, start, stop):
+        segments.append((position, start + n_start))
+        position = start + n_end
+    segments.append((position, stop))
+    segments = [(a, b) for a, b in segments if b - a >= k]
+    if use_numpy:
+        return _numpy_count(sequence, segments, k, canonical)
+    counts = Counter()
+    for a, b in segments:
+        _count_segment(sequence, a, b, k, canonical, counts)
+    return counts
+
+
+def _read_packed(sequence, start, end):
+    """the packed bytes covering [start, end), and the base at which they start"""
+    first_byte = start // 4
+    last_byte = (end + 3) // 4
+    packed = bytes(sequence._file_handle.read_at(sequence._offset + first_byte, last_byte - first_byte))
+    return packed, 4 * first_byte
+
+
+def _count_segment(sequence, start, end, k, canonical, counts):
+    """
+    count the k-mers of [start, end) (which holds no N) into counts
+
+    KMER_BLOCK_SIZE k-mers at a time are taken from one integer holding
+    the packed bytes that cover them: k-mer p is (value >> 2 * (last - p - k))
+    masked to 2 * k bits, where last is the base after those bytes. The
+    reverse complements come the same way from the bytes translated with
+    RC_BYTE_TABLE and reversed, so map() and Counter.update do the
+    per-k-mer work in C.
+    """
+    packed, packed_start = _read_packed(sequence, start, end)
+    mask = (1 << (2 * k)) - 1
+    last_kmer = end - k + 1
+    for block_start in range(start, last_kmer, KMER_BLOCK_SIZE):
+        block_end = min(block_start + KMER_BLOCK_SIZE, last_kmer)
+        first = block_start // 4 * 4
+        last = (block_end + k + 2) // 4 * 4
+        data = packed[(first - packed_start) // 4 : (last - packed_start) // 4]
+        value = int.from_bytes(data, "big")
+        forward = map(mask.__and__, map(value.__rshift__, range(2 * (last - block_start - k), 2 * (last - block_end - k), -2)))
+        if not canonical:
+            counts.update(forward)
+            continue
+        reverse = int.from_bytes(data.translate(RC_BYTE_TABLE)[::-1], "big")
+        backward = map(mask.__and__, map(reverse.__rshift__, range(2 * (block_start - first), 2 * (block_end - first), 2)))
+        counts.update(map(min, forward, backward))
+
+
+def _numpy_kmers(codes, k):
+    """
+    the codes of all k-mers of a uint64 array of 2-bit codes, built by
+    doubling: the 2a-mer at i joins the a-mers at i and i + a, and k is
+    assembled from its binary digits, so only about 2 log2(k) passes are made
+    """
+    numpy = _load_numpy()
+    result = None
+    result_size = 0
+    power = codes
+    power_size = 1
+    remaining = k
+    while True:
+        if remaining & 1:
+            if result is None:
+                result, result_size = power, power_size
+            else:
+                size = len(codes) - result_size - power_size + 1
+                result = (result[:size] << numpy.uint64(2 * power_size)) | power[result_size : result_size + size]
+                result_size += power_size
+        remaining >>= 1
+        if not remaining:
+            return result
+        power = (power[:-power_size] << numpy.uint64(2 * power_size)) | power[power_size:]
+        power_size *= 2
+
+
+def _numpy_count(sequence, segments, k, canonical):
+    """count the k-mers of N-free segments with NumPy, as a dense array or a Counter"""
+    numpy = _load_numpy()
+    all_kmers = []
+    for start, end in segments:
+        packed, packed_start = _read_packed(sequence, start, end)
+        packed = numpy.frombuffer(packed, dtype=numpy.uint8)
+        codes = ((packed[:, None] >> numpy.array([6, 4, 2, 0], dtype=numpy.uint8)) & 0x3).ravel()
+        codes = codes[start - packed_start : end - packed_start].astype(numpy.uint64)
+        kmers = _numpy_kmers(codes, k)
+        if canonical:
+            kmers = numpy.minimum(kmers, _numpy_kmers((codes ^ numpy.uint64(2))[::-1], k)[::-1])
+        all_kmers.append(kmers)
+    if k <= KMER_DENSE_MAX_K:
+        dense = numpy.zeros(4**k, dtype=numpy.int64)
+        for kmers in all_kmers:
+            dense += numpy.bincount(kmers.astype(numpy.intp), minlength=4**k)
+        return dense
+    if not all_kmers:
+        return Counter()
+    kmers, counts = numpy.unique(numpy.concatenate(all_kmers), return_counts=True)
+    return Counter(dict(zip(kmers.tolist(), counts.tolist())))
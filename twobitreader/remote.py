@@ -0,0 +1,136 @@
+"""
+reads .2bit files over HTTP with range requests
+
+>>> genome = TwoBitFile('https://hgdownload.soe.ucsc.edu/goldenPath/hg38/bigZips/hg38.2bit', lazy=True)
+>>> genome['chr1'][1000000:1001000]
+
+TwoBitFile opens http:// and https:// URLs with an HTTPSource; make one
+yourself to change its options. Nothing is downloaded up front: the file
+is read in aligned blocks of block_size bytes, fetched on first use and
+kept in a small least-recently-used cache. The first request (made when
+the source is created, to learn the file size) returns the header and,
+for most genomes, the whole name index; a slice then costs at most one
+request for its sequence's tables and one for its packed bases, since
+all the blocks one read is missing are fetched with a single request.
+The server must support range requests (as static file servers and
+object stores do).
+"""
+
+import re
+from collections import OrderedDict
+from threading import Lock
+from urllib.request import Request, urlopen
+
+from twobitreader import ByteSource
+
+# bytes per fetched (and cached) block
+HTTP_BLOCK_SIZE = 1 << 16
+# blocks kept in the cache of each source
+HTTP_CACHE_BLOCKS = 64
+# seconds to wait for a response
+HTTP_TIMEOUT = 60
+
+_CONTENT_RANGE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+
+
+class HTTPSource(ByteSource):
+    """
+    random-access bytes of a file on an HTTP(S) server, read with range
+    requests through a block cache
+
+    headers (e.g. {'Authorization': 'Bearer ...'}) are sent with every
+    request. requests and bytes_fetched count what has been transferred.
+    >>> source = HTTPSource(url, block_size=1 << 20, cache_blocks=16)
+    >>> genome = TwoBitFile(source, lazy=True)
+    """
+
+    def __init__(self, url, block_size=HTTP_BLOCK_SIZE, cache_blocks=HTTP_CACHE_BLOCKS, headers=None, timeout=HTTP_TIMEOUT):
+        if block_size < 1:
+            raise ValueError("block_size must be positive")
+        self.url = url
+        self._block_size = block_size
+        self._cache_blocks = cache_blocks
+        self._headers = dict(headers or {})
+        self._timeout = timeout
+        self._blocks = OrderedDict()
+        self._lock = Lock()
+        self.requests = 0
+        self.bytes_fetched = 0
+        # the first block holds the header and (usually) the name index
+        data, self.size = self._fetch(0, block_size)
+        self._store(0, data)
+
+    def __reduce__(self):  # enables pickling (the cache is not kept)
+        return (HTTPSource, (self.url, self._block_size, self._cache_blocks, self._headers, self._timeout))
+
+    def __repr__(self):
+        return "HTTPSource(%r)" % (self.url,)
+
+    def _fetch(self, start, end):
+        """(bytes start to end, or to the end of the file; file size)"""
+        headers = dict(self._headers)
+        headers["Range"] = "bytes=%d-%d" % (start, end - 1)
+        response = urlopen(Request(self.url, headers=headers), timeout=self._timeout)
+        try:
+            if response.getcode() != 206:
+                raise IOError("%s does not support range requests" % self.url)
+            match = _CONTENT_RANGE.match(response.info().get("Content-Range", ""))
+            if match is None or int(match.group(1)) != start or match.group(3) == "*":
+                raise IOError("%s returned an unexpected Content-Range" % self.url)
+            data = response.read()
+        finally:
+            response.close()
+        if len(data) != int(match.group(2)) - start + 1:
+            raise IOError("%s returned a short response" % self.url)
+        with self._lock:
+            self.requests += 1
+            self.bytes_fetched += len(data)
+        return data, int(match.group(3))
+
+    def _store(self, index, data):
+        with self._lock:
+            self._blocks[index] = data
+            while len(self._blocks) > self._cache_blocks:
+                self._blocks.popitem(last=False)
+
+    def read_at(self, offset, size):
+        """return size bytes starting at offset"""
+        if self.closed:
+            raise ValueError("I/O operation on closed source")
+        if size <= 0:
+            return b""
+        if offset < 0 or offset + size > self.size:
+            raise EOFError("read beyond end of file")
+        block_size = self._block_size
+        first = offset // block_size
+        last = (offset + size - 1) // block_size
+        blocks = {}
+        missing = []
+        with self._lock:
+            for index in range(first, last + 1):
+                data = self._blocks.get(index)
+                if data is None:
+                    missing.append(index)
+                else:
+                    self._blocks[index] = self._blocks.pop(index)
+                    blocks[index] = data
+        if missing and missing[-1] - missing[0] >= self._cache_blocks:
+            # too big to cache: fetch just the bytes asked for
+            data, _ = self._fetch(offset, offset + size)
+            return data
+        if missing:
+            # one request for the span of missing blocks
+            start = missing[0] * block_size
+            data, _ = self._fetch(start, min((missing[-1] + 1) * block_size, self.size))
+            for index in range(missing[0], missing[-1] + 1):
+                block = data[(index - missing[0]) * block_size : (index - missing[0] + 1) * block_size]
+                blocks[index] = block
+                self._store(index, block)
+        data = b"".join(blocks[index] for index in range(first, last + 1))
+        start = offset - first * block_size
+        return data[start : start + size]
+
+    def close(self):
+        self.closed = True
+        with self._lock:
+            self._blocks.clear()
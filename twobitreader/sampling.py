@@ -0,0 +1,156 @@
+"""
+random fixed-length intervals for training and simulation
+
+>>> sampler = IntervalSampler(genome, 1000, batch_size=64, seed=1, encoding='onehot')
+>>> intervals, x = sampler[0]  # x has shape (64, 1000, 4)
+
+Windows are drawn uniformly from all positions at which they fit, so
+sequences are weighted by length. Windows that overlap an N-block, or
+whose soft-masked fraction is above a limit, are rejected using the
+N-block and mask-block tables alone, before any sequence is read.
+
+Batch i depends only on the seed and i: each batch has its own random
+generator, and reads use positional I/O, so a sampler can be shared by
+forked data-loader workers (or pickled to spawned ones) and any batch can
+be regenerated exactly.
+"""
+
+import random
+from bisect import bisect_right
+
+from twobitreader import _load_numpy, _overlapping_blocks
+
+# give up on a sample after this many rejected windows
+SAMPLER_MAX_TRIES = 1000
+
+
+class IntervalSampler(object):
+    """
+    draws batches of batch_size random windows of length bases
+
+    genome      a TwoBitFile (sequences shorter than length are skipped,
+                as are those not in names, if given)
+    allow_n     keep windows that overlap N-blocks (default: reject them)
+    max_masked_fraction
+                reject windows with a larger fraction of soft-masked bases
+    random_strand
+                give each window a random strand ('+' or '-'); minus-strand
+                windows are returned reverse-complemented
+    encoding    None for str sequences, or 'onehot' or 'int8' for a NumPy
+                batch (see TwoBitFile.fill_encoded; n_value and dtype are
+                passed on)
+
+    sampler[i] (or sampler.batch(i)) returns (intervals, data) for batch i,
+    where intervals are (chrom, start, end, strand) tuples; iterating gives
+    batches 0, 1, 2, ... for ever (see iter_batches to shard by worker).
+    """
+
+    def __init__(
+        self,
+        genome,
+        length,
+        batch_size=32,
+        seed=0,
+        names=None,
+        allow_n=False,
+        max_masked_fraction=None,
+        random_strand=False,
+        encoding=None,
+        n_value=None,
+        dtype=None,
+    ):
+        if length < 1 or batch_size < 1:
+            raise ValueError("length and batch_size must be at least 1")
+        if encoding is not None and _load_numpy() is None:
+            raise ImportError("encoding requires numpy")
+        self._genome = genome
+        self.length = length
+        self.batch_size = batch_size
+        self.seed = seed
+        self._allow_n = allow_n
+        self._max_masked_fraction = max_masked_fraction
+        self._random_strand = random_strand
+        self._encoding = encoding
+        self._n_value = n_value
+        self._dtype = dtype
+        sizes = genome.sequence_sizes()
+        if names is None:
+            names = list(genome.keys())
+        # cumulative number of window starts, to map a draw to a sequence
+        self._names = []
+        self._cumulative_starts = []
+        total = 0
+        for name in names:
+            starts = sizes[name] - length + 1
+            if starts > 0:
+                total += starts
+                self._names.append(name)
+                self._cumulative_starts.append(total)
+        if not total:
+            raise ValueError("no sequence is at least %d bases long" % length)
+
+    def __getitem__(self, index):
+        return self.batch(index)
+
+    def __iter__(self):
+        return self.iter_batches()
+
+    def iter_batches(self, start=0, stop=None, step=1):
+        """
+        yield batches start, start + step, ... (before stop, if given)
+        e.g. worker w of n uses iter_batches(w, step=n)
+        """
+        index = start
+        while stop is None or index < stop:
+            yield self.batch(index)
+            index += step
+
+    def intervals(self, index):
+        """the (chrom, start, end, strand) windows of batch index"""
+        if index < 0:
+            raise IndexError("batch index must be at least 0")
+        # a str seed is hashed the same way in every process
+        rng = random.Random("%r:%d" % (self.seed, index))
+        return [self._sample(rng) for _ in range(self.batch_size)]
+
+    def batch(self, index):
+        """(intervals, data) for batch index; data is a list of str or a NumPy array"""
+        intervals = self.intervals(index)
+        genome = self._genome
+        if self._encoding is None:
+            return intervals, genome.fetch_many(intervals)
+        shape = (len(intervals), self.length, 4) if self._encoding == "onehot" else (len(intervals), self.length)
+        numpy = _load_numpy()
+        dtype = self._dtype
+        if dtype is None:
+            dtype = numpy.float32 if self._encoding == "onehot" else numpy.int8
+        out = numpy.empty(shape, dtype=dtype)
+        return intervals, genome.fill_encoded(intervals, out, self._encoding, self._n_value)
+
+    def _sample(self, rng):
+        """draw one window, rejecting those the block tables rule out"""
+        total = self._cumulative_starts[-1]
+        for _ in range(SAMPLER_MAX_TRIES):
+            draw = rng.randrange(total)
+            i = bisect_right(self._cumulative_starts, draw)
+            start = draw - (self._cumulative_starts[i - 1] if i else 0)
+            name = self._names[i]
+            strand = rng.choice("+-") if self._random_strand else "+"
+            if self._accept(self._genome[name], start, start + self.length):
+                return name, start, start + self.length, strand
+        raise RuntimeError("no acceptable window found in %d tries" % SAMPLER_MAX_TRIES)
+
+    def _accept(self, sequence, start, end):
+        """check a window against the N-block and mask-block tables"""
+        if not self._allow_n:
+            for _ in _overlapping_blocks(sequence._n_block_starts, sequence._n_block_sizes, start, end):
+                return False
+        if self._max_masked_fraction is not None:
+            masked = 0
+            for block_start, block_end in _overlapping_blocks(
+                sequence._mask_block_starts, sequence._mask_block_sizes, start, end
+            ):
+                masked += block_end - block_start
+            if masked > self._max_masked_fraction * (end - start):
+                return False
+        return True
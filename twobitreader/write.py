@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+writes .2bit files, e.g. to convert a FASTA file to .2bit
+
+To convert a FASTA file, do
+python -m twobitreader.write genome.fa genome.2bit
+
+Sequences are streamed: bases are packed four per byte as they arrive and
+N-runs and lower-case (soft-masked) runs are collected into block tables,
+so memory use does not depend on the sequence length. Packed sequence is
+spooled to a temporary file until the index can be written.
+"""
+
+import re
+import sys
+import tempfile
+from array import array
+from os.path import dirname
+
+from twobitreader import LONG
+
+# FASTA input is read this many bytes at a time
+FASTA_BLOCK_SIZE = 1 << 20
+# temporary files are copied into the output this many bytes at a time
+COPY_BLOCK_SIZE = 1 << 20
+
+_N_RUN = re.compile(b"[^ACGTacgt]+")
+_LOWER_RUN = re.compile(b"[a-z]+")
+_WHITESPACE = b" \t\r\n\v\f"
+
+
+def create_pack_tables():
+    """
+    create PACK_TABLES, one bytes.translate table per base position
+    table i maps a base to its 2-bit code shifted into position i of a byte
+    (T=00, C=01, A=10, G=11; anything else is packed as T)
+    """
+    codes = dict(zip(b"TCAGtcag", [0, 1, 2, 3] * 2))
+    return tuple(bytes(codes.get(x, 0) << shift for x in range(2**8)) for shift in (6, 4, 2, 0))
+
+
+PACK_TABLES = create_pack_tables()
+
+
+def pack_bases(bases):
+    """
+    pack bases (bytes, length a multiple of 4) to 2 bits per base
+
+    Each of the four base positions is translated for the whole input at
+    once; the shifted codes occupy separate bits, so the four results are
+    combined with a single big-integer OR.
+    """
+    size = len(bases) // 4
+    value = 0
+    for position, table in enumerate(PACK_TABLES):
+        value |= int.from_bytes(bases[position::4].translate(table), "big")
+    return value.to_bytes(size, "big")
+
+
+def _add_runs(pattern, data, position, starts, sizes):
+    """add the runs matched by pattern in data to a block table, joining runs split across chunks"""
+    for match in pattern.finditer(data):
+        start = position + match.start()
+        size = match.end() - match.start()
+        if starts and starts[-1] + sizes[-1] == start:
+            sizes[-1] += size
+        else:
+            starts.append(start)
+            sizes.append(size)
+
+
+class TwoBitWriter(object):
+    """
+    streaming writer for .2bit files
+
+    >>> with TwoBitWriter('out.2bit') as writer:
+    >>>     writer.write_sequence('chr1', 'ACGTNNNNacgt')
+    >>>     writer.write_fasta('more.fa')
+
+    Sequences may be given as a str or bytes, or as an iterable of str or
+    bytes chunks. Bases other than ACGT (in either case) are stored as N,
+    and lower-case bases are soft-masked, as by UCSC's faToTwoBit.
+
+    The .2bit file is assembled when the writer is closed. version=None
+    writes a version 0 file, or version 1 (64-bit offsets) if the output
+    would be 4 GB or larger. Temporary files go in tmpdir (by default, the
+    directory of the output file).
+    """
+
+    def __init__(self, filename, version=None, tmpdir=None):
+        if version not in (None, 0, 1):
+            raise ValueError("version must be None, 0 or 1")
+        self._filename = filename
+        self._version = version
+        if tmpdir is None:
+            tmpdir = dirname(filename) or "."
+        self._dna_spool = tempfile.TemporaryFile(dir=tmpdir)
+        self._table_spool = tempfile.TemporaryFile(dir=tmpdir)
+        # (name, table bytes, packed DNA bytes) for each finished sequence
+        self._records = []
+        self._names = set()
+        self._current = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+    def write_sequence(self, name, seq):
+        """add one sequence (str, bytes or an iterable of chunks)"""
+        self._begin(name)
+        if isinstance(seq, (str, bytes, bytearray)):
+            seq = [seq]
+        for chunk in seq:
+            self._feed(chunk)
+        self._end()
+
+    def write_fasta(self, fasta, block_size=FASTA_BLOCK_SIZE):
+        """
+        add every record of a FASTA file, given as a path or a binary
+        file object; the name is the first word of each header line
+        """
+        if isinstance(fasta, str):
+            with open(fasta, "rb") as handle:
+                return self.write_fasta(handle, block_size)
+        buffer = b""
+        at_eof = False
+        at_line_start = True
+        while not (at_eof and not buffer):
+            if not at_eof:
+                block = fasta.read(block_size)
+                if not block:
+                    at_eof = True
+                buffer += block
+            position = 0
+            while position < len(buffer):
+                if at_line_start and buffer[position] == ord(">"):
+                    end_of_line = buffer.find(b"\n", position)
+                    if end_of_line < 0:
+                        if not at_eof:
+                            break  # read the rest of the header line
+                        end_of_line = len(buffer)
+                    if self._current is not None:
+                        self._end()
+                    fields = buffer[position + 1 : end_of_line].split()
+                    if not fields:
+                        raise ValueError("FASTA header without a name")
+                    self._begin(fields[0].decode("ascii"))
+                    position = end_of_line + 1
+                    continue
+                header_at = buffer.find(b"\n>", position)
+                end = len(buffer) if header_at < 0 else header_at + 1
+                if self._current is None:
+                    if buffer[position:end].translate(None, _WHITESPACE):
+                        raise ValueError("FASTA sequence data before the first header")
+                else:
+                    self._feed(buffer[position:end])
+                at_line_start = buffer[end - 1] == ord("\n")
+                position = end
+            buffer = buffer[position:]
+        if self._current is not None:
+            self._end()
+
+    def _begin(self, name):
+        if self._current is not None:
+            raise RuntimeError("a sequence is already being written")
+        encoded_name = name.encode("ascii")
+        if not 0 < len(encoded_name) < 256:
+            raise ValueError("sequence names must be 1-255 characters: %r" % (name,))
+        if name in self._names:
+            raise ValueError("duplicate sequence name %r" % (name,))
+        self._names.add(name)
+        self._current = {
+            "name": name,
+            "size": 0,
+            "pending": b"",
+            "dna_start": self._dna_spool.tell(),
+            "n_starts": array(LONG),
+            "n_sizes": array(LONG),
+            "mask_starts": array(LONG),
+            "mask_sizes": array(LONG),
+        }
+
+    def _feed(self, chunk):
+        current = self._current
+        if isinstance(chunk, str):
+            chunk = chunk.encode("ascii")
+        chunk = bytes(chunk).translate(None, _WHITESPACE)
+        position = current["size"]
+        _add_runs(_N_RUN, chunk, position, current["n_starts"], current["n_sizes"])
+        _add_runs(_LOWER_RUN, chunk, position, current["mask_starts"], current["mask_sizes"])
+        current["size"] = position + len(chunk)
+        if current["size"] > 0xFFFFFFFF:
+            raise ValueError("sequence %r is longer than a .2bit record allows" % (current["name"],))
+        bases = current["pending"] + chunk
+        full = len(bases) - len(bases) % 4
+        self._dna_spool.write(pack_bases(bases[:full]))
+        current["pending"] = bases[full:]
+
+    def _end(self):
+        current = self._current
+        pending = current["pending"]
+        if pending:
+            self._dna_spool.write(pack_bases(pending + b"T" * (4 - len(pending))))
+        tables = array(LONG, [current["size"], len(current["n_starts"])])
+        tables.extend(current["n_starts"])
+        tables.extend(current["n_sizes"])
+        tables.append(len(current["mask_starts"]))
+        tables.extend(current["mask_starts"])
+        tables.extend(current["mask_sizes"])
+        tables.append(0)  # reserved
+        table_start = self._table_spool.tell()
+        self._table_spool.write(tables.tobytes())
+        table_size = self._table_spool.tell() - table_start
+        dna_size = self._dna_spool.tell() - current["dna_start"]
+        self._records.append((current["name"], table_start, table_size, current["dna_start"], dna_size))
+        self._current = None
+
+    def close(self):
+        """write the header, index and records to the output file"""
+        if self._current is not None:
+            self._end()
+        if self._records is None:
+            return
+        try:
+            self._assemble()
+        finally:
+            self._discard()
+
+    def _assemble(self):
+        records = self._records
+        names = [name.encode("ascii") for name, _, _, _, _ in records]
+        record_sizes = [table_size + dna_size for _, _, table_size, _, dna_size in records]
+        version = self._version
+        for candidate in [0, 1] if version is None else [version]:
+            # a version 0 index stores 32-bit offsets, version 1 64-bit offsets
+            offset = 16 + sum(len(name) + (5 if candidate == 0 else 9) for name in names)
+            offsets = []
+            for record_size in record_sizes:
+                offsets.append(offset)
+                offset += record_size
+            if candidate == 1 or not offsets or offsets[-1] <= 0xFFFFFFFF:
+                version = candidate
+                break
+        else:
+            raise ValueError("output is too large for a version 0 .2bit file; use version=1")
+        offset_type = "Q" if version == 1 else LONG
+        index = b"".join(
+            bytes([len(name)]) + name + array(offset_type, [offset]).tobytes() for name, offset in zip(names, offsets)
+        )
+        with open(self._filename, "wb") as output:
+            output.write(array(LONG, [0x1A412743, version, len(records), 0]).tobytes())
+            output.write(index)
+            for _, table_start, table_size, dna_start, dna_size in records:
+                self._copy(self._table_spool, table_start, table_size, output)
+                self._copy(self._dna_spool, dna_start, dna_size, output)
+
+    @staticmethod
+    def _copy(spool, start, size, output):
+        spool.seek(start)
+        while size > 0:
+            data = spool.read(min(size, COPY_BLOCK_SIZE))
+            if not data:
+                raise EOFError("temporary file is truncated")
+            output.write(data)
+            size -= len(data)
+
+    def _discard(self):
+        self._records = None
+        self._current = None
+        self._dna_spool.close()
+        self._table_spool.close()
+
+
+def fasta_to_twobit(fasta, filename, version=None):
+    """convert a FASTA file (path or binary file object) to a .2bit file"""
+    with TwoBitWriter(filename, version=version) as writer:
+        writer.write_fasta(fasta)
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit("Example: python -m twobitreader.write genome.fa genome.2bit")
+    fasta = sys.argv[1]
+    if fasta == "-":
+        fasta = sys.stdin.buffer
+    fasta_to_twobit(fasta, sys.argv[2])
+
+
+if __name__ == "__main__":
+    main()